@@ -1,14 +1,33 @@
-from common.algorithms import Algorithm
-from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import copy
+import time
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from aiomysql.cursors import Cursor
 
 from common.logging import logger
 from mq.factory import Factory as MQFactory
-from common.config import Config, MQConfig
+from common.config import Config, MQConfig, CheckpointConfig, ApplyConfig
+from common import codec, pidal
+from common.checkpoint import CheckpointStore
+from common.dsn import DSN
+from common.router import Router
+from common.schema import SchemaCache, parse_lock_keys, unique_keys_query, \
+        unique_keys_fingerprint_query
 from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from mq.mq import AsyncStream, MQMessage
+from mq.commit import OffsetCommitter
+from apply import bulk, statement
+from apply.scheduler import Scheduler
+from apply.watermark import Watermark
 from apply.client.factory import Factory as ClientFactory
 from meta.manager import MetaManager
 from meta.constant import DBNodeType
 
+# 每条 information_schema 查询最多包含的表
+_SCHEMA_QUERY_TABLES = 1000
+
 
 class Apply(object):
     def __init__(self):
@@ -18,57 +37,110 @@ class Apply(object):
         self.current_file_log: str
         self.current_file_log_index: int
         self.current_log_pos: int
-        self._last_lsn: Optional[ChangeEventLSN] = None
+        # 每个分区最后应用的事件，分区之间没有顺序
+        self._last_lsns: Dict[int, ChangeEventLSN] = {}
+        # 重启前已经应用的最后一个事件，之前的事件直接跳过
+        self._checkpoint_lsns: Dict[int, ChangeEventLSN] = {}
+        # 每个分区已经提交的最后一个事件，用于记录进度
+        self._applied_lsns: Dict[int, ChangeEventLSN] = {}
+        # 等待其他分区副本的跨分区事件，和暂停的分区中之后的事件
+        self._barriers: Dict[Tuple[int, ...],
+                             List[Tuple[ChangeEvent, MQMessage]]] = {}
+        self._held: Dict[int, List[Tuple[ChangeEvent, MQMessage]]] = {}
+        self.scheduler: Optional[Scheduler] = None
+        self.committer: OffsetCommitter
         self._running = True
         self.tables: Dict[str, List[str]] = {}
-        self.table_zs_algorithms: Dict[str, Dict[str, Any]] = {}
+        self.router: Router
+        # 物理表 -> 锁索引名
+        self.table_keys: Dict[str, str] = {}
         self.zsid: Dict[int, int] = {}
+        self.apply_conf = ApplyConfig.get_instance()
+        self.schema_cache = SchemaCache(self.apply_conf.schema_cache)
+        # 元数据服务通知的新版本，在批次之间切换
+        self._next_version: Optional[int] = None
 
         self.get_latest()
+        self.checkpoint = CheckpointStore.new(CheckpointConfig.get_instance())
+        self.checkpoint_key = "apply.{}.{}".format(self.zone_id,
+                                                   self.node.name)
+        self.checkpoint.add_mirror(self.checkpoint_key, self._mirror_process)
+        self.load_process()
+        self.watermark: Optional[Watermark] = None
+        if self.apply_conf.watermark:
+            self.watermark = Watermark(self.node.name, self.apply_conf.lanes)
+        self.meta_manager.add_observer(self._on_version_update)
+
+    def load_process(self):
+        p = self.checkpoint.get(self.checkpoint_key)
+        if not p:
+            p = self.meta_manager.get_client().get_apply_process(
+                    self.zone_id, self.node.name)
+        if not p:
+            return
+        if "log_index" in p:  # 不分区时的旧格式
+            p = {"0": p}
+        for k, v in p.items():
+            self._checkpoint_lsns[int(k)] = ChangeEventLSN.decode(v)
+        self._last_lsns = dict(self._checkpoint_lsns)
+        self._applied_lsns = dict(self._checkpoint_lsns)
+
+    def _get_process(self) -> Dict[str, Any]:
+        return {str(k): v.encode() for k, v in self._applied_lsns.items()}
+
+    def _mirror_process(self, lsn: Dict[str, Any]):
+        self.meta_manager.get_client().report_apply_process(
+                self.zone_id, self.node.name, lsn)
 
     def get_latest(self):
         self.current_version = self.meta_manager.get_latest_version()
+        self.meta_manager.pin(self.current_version)
         self.create_mq()
         self.create_client(self.current_version)
         self.parse_zsid()
 
     async def get_tables(self):
-        sql = "SHOW KEYS FROM {} WHERE Non_unique = 0 and Key_name = '{}'"
+        """
+        读取节点上所有物理表的锁字段，表结构不变时使用缓存，只查询缓存中
+        没有的表。
+        """
         db_conf = self.meta_manager.get_db(self.current_version)
-        for i in db_conf.tables.values():
-            raw_tables = []
-            if not i.strategies:
-                continue
-            for s in i.strategies:
-                if not s.backends:
-                    continue
-                for n in s.backends:
-                    if n.node == self.node.name:
-                        if n.number is None:
-                            raw_tables.append(n.prefix)
-                        else:
-                            raw_tables.append(n.prefix + str(n.number))
-                    else:
-                        break
-
-            if raw_tables:
-                r = await self.client.query(sql.format(raw_tables[0],
-                                                       i.lock_key))
-                if not r:
-                    raise Exception("unknown table {} key {}".format(
-                        raw_tables[0], i.lock_key))
-                _raw_lock_keys = {}
-                for k in r:
-                    _raw_lock_keys[k["Seq_in_index"]] = k["Column_name"]
-                lock_key = [_raw_lock_keys[k] for k in sorted(
-                    _raw_lock_keys.keys())]
-                zs_algorithm = {}
-                zs_algorithm["zskeys"] = i.zskeys
-                zs_algorithm["zs_algorithm"] = Algorithm.new(i.zs_algorithm)
-                zs_algorithm["zs_algorithm_args"] = i.zs_algorithm_args
-                for t in raw_tables:
-                    self.tables[t] = lock_key
-                    self.table_zs_algorithms[t] = zs_algorithm
+        table_confs = db_conf.get_node_tables(self.node.name)
+        table_keys = {t: i.lock_key for t, i in table_confs.items()}
+        self.table_keys = table_keys
+        schema = DSN(self.node.dsn).database
+        r = await self.client.query(*unique_keys_fingerprint_query(schema))
+        fingerprint = [int(r[0]["n"]), int(r[0]["crc"] or 0)]
+        key = "{}.{}".format(self.node.name, schema)
+        cached = self.schema_cache.get(key, fingerprint)
+        tables = {t: cached[(t, k)] for t, k in table_keys.items()
+                  if (t, k) in cached}
+        names = sorted(t for t in table_keys.keys() if t not in tables)
+        if names:
+            # IN 列表过长时拆成多条，在连接池上并发查询
+            results = await asyncio.gather(*(
+                self.client.query(*unique_keys_query(
+                    schema, names[i:i + _SCHEMA_QUERY_TABLES]))
+                for i in range(0, len(names), _SCHEMA_QUERY_TABLES)))
+            found = parse_lock_keys([i for r in results for i in r],
+                                    {t: table_keys[t] for t in names})
+            self.schema_cache.save(key, fingerprint, {
+                (t, table_keys[t]): v for t, v in found.items()})
+            tables.update(found)
+        self.tables = tables
+        self.router = Router(table_confs, self.zsid)
+
+    async def _refresh_table(self, table: str):
+        """ 表结构变更后只重新读取这个表的锁字段 """
+        if table not in self.table_keys:
+            return
+        r = await self.client.query(*unique_keys_query(
+            DSN(self.node.dsn).database, [table]))
+        lock_key = parse_lock_keys(r, {table: self.table_keys[table]})[table]
+        if lock_key != self.tables.get(table):
+            logger.info("table [{}] lock key changed {} -> {}".format(
+                table, self.tables.get(table), lock_key))
+        self.tables[table] = lock_key
 
     def create_mq(self):
         self.mq = MQFactory.new_consumer(MQConfig.get_instance())
@@ -76,6 +148,8 @@ class Apply(object):
     def create_client(self, version: int):
         db_conf = self.meta_manager.get_db(version)
         assert all((db_conf, db_conf.nodes, db_conf.tables))
+        if not isinstance(self.config.node, str) or self.config.node == "*":
+            raise Exception("apply only supports one node.")
         if self.config.node not in db_conf.nodes.keys():
             raise Exception("unknown node [{}].".format(self.config.node))
         node = db_conf.nodes[self.config.node]
@@ -85,121 +159,583 @@ class Apply(object):
         self.client = ClientFactory.new(node)
 
     def parse_zsid(self):
+        # 使用新的字典，旧版本的路由不受影响
+        zsid: Dict[int, int] = {}
         zones = self.meta_manager.get_zones(self.current_version)
         for i in zones:
             if not i.shardings:
                 continue
             for s in i.shardings:
-                self.zsid[s.zsid] = i.zone_id
+                zsid[s.zsid] = i.zone_id
+        self.zsid = zsid
+
+    def _on_version_update(self, version: int):
+        """ 在元数据服务的通知线程中调用，只记录版本 """
+        if self.meta_manager.version_gt(version, self.current_version):
+            self._next_version = version
+
+    async def _switch_version(self):
+        """
+        在批次之间切换元数据版本，已经分发到 lane 的事件先用旧版本应用完。
+        只在节点地址或者连接池配置变化时重建连接池。
+        """
+        version = self._next_version
+        self._next_version = None
+        if self.scheduler is not None:
+            await self.scheduler.drain()
+        # 通知之后可能已经被更新的版本挤出，重新加载。加载需要请求元数据
+        # 服务，在线程池中执行
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.meta_manager.load_version_meta,
+                                   version)
+        db_conf = self.meta_manager.get_db(version)
+        node = db_conf.nodes.get(self.config.node) if db_conf else None
+        if node is None or node.type is DBNodeType.REPLICA:
+            logger.error("meta version [{}] ignored, node [{}] is not "
+                         "available.".format(version, self.config.node))
+            return
+        logger.info("apply switch meta version {} -> {}.".format(
+            self.current_version, version))
+        old = self.node
+        self.meta_manager.pin(version)
+        self.meta_manager.unpin(self.current_version)
+        self.current_version = version
+        self.node = node
+        if (node.dsn, node.minimum_pool_size, node.maximum_pool_size,
+                node.wait_time) != (old.dsn, old.minimum_pool_size,
+                                    old.maximum_pool_size, old.wait_time):
+            client = ClientFactory.new(node)
+            await client.connect()
+            self.client, client = client, self.client
+            client.close()
+        self.parse_zsid()
+        await self.get_tables()
 
     async def start(self):
         await self.client.connect()
         await self.get_tables()
-        for i in self.mq.get_stream():
-            if not i.value:
+        if self.watermark is not None:
+            await self.watermark.load(self.client)
+        if self.apply_conf.lanes > 1:
+            self.scheduler = Scheduler(self.apply_conf.lanes,
+                                       self.apply_conf.lane_queue_size,
+                                       self._get_key, self._apply,
+                                       self._on_applied)
+            self.scheduler.start()
+        stream = self._open_stream()
+        try:
+            async for messages in self._get_batches(stream):
+                batch: List[Tuple[ChangeEvent, Any]] = []
+                for i in messages:
+                    self.committer.track(i)
+                    event = self._accept(i)
+                    if event is None:
+                        self._done(i)
+                        continue
+                    batch.extend(self._order(event, i))
+                if self.scheduler is not None:
+                    for event, i in batch:
+                        await self.scheduler.submit(event, i)
+                else:
+                    await self._apply_events(batch)
+                await self._flush_checkpoint()
+            if self.scheduler is not None:
+                await self.scheduler.close()
+            await self._flush_checkpoint(True)
+            self.committer.flush()
+        finally:
+            await stream.close()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.checkpoint.close)
+
+    def _accept(self, i: MQMessage) -> Optional[ChangeEvent]:
+        """ 返回需要应用的事件，不需要应用时返回 None """
+        if not i.value:
+            return None
+        # 二进制格式先只解析消息头，跳过的消息不解析行数据
+        event = codec.decode_header(i.value)
+        if event.node != self.node.name:
+            # 多节点 replicator 共用 topic，只处理当前节点的事件
+            return None
+        if event.event_type is EventType.SNAPSHOT:
+            # 全量数据不在 LSN 链中，按数据版本覆盖，重复应用是幂等的
+            return codec.decode(i.value)
+        checkpoint_lsn = self._checkpoint_lsns.get(event.partition)
+        if checkpoint_lsn and event.lsn <= checkpoint_lsn:
+            return None
+        if not self._check_lsn(event):
+            raise Exception("event has miss [{}]".format(event.lsn.encode()))
+        if self._last_lsns.get(event.partition) == event.lsn:
+            return None  # 重复消费
+        if codec.is_binary(i.value):
+            event = codec.decode(i.value)
+        self._last_lsns[event.partition] = event.lsn
+        return event
+
+    def _order(self, event: ChangeEvent, message: MQMessage) \
+            -> List[Tuple[ChangeEvent, Any]]:
+        """
+        返回可以应用的事件。修改了分区字段的 UPDATE 在 barrier 的每个分区中
+        各有一个副本，先到达的分区暂停，所有副本到达时这些分区之前的事件都
+        已经应用，合并成一个事件应用后再继续暂停的分区。
+        """
+        if event.partition in self._held:
+            self._held[event.partition].append((event, message))
+            return []
+        if len(event.barrier) < 2:
+            return [(event, message)]
+        lsn = event.lsn
+        key = (lsn.server_id, lsn.log_index, lsn.log_position, lsn.xid)
+        copies = self._barriers.setdefault(key, [])
+        copies.append((event, message))
+        if len(copies) < len(event.barrier):
+            self._held[event.partition] = []
+            return []
+        del self._barriers[key]
+        # 合并的事件应用后，每个副本分别记录进度
+        ready: List[Tuple[ChangeEvent, Any]] = [
+            (self._merge([e for e, _ in copies]), copies)]
+        for e, _ in copies:
+            for i in self._held.pop(e.partition, []):
+                ready.extend(self._order(*i))
+        return ready
+
+    @staticmethod
+    def _merge(events: List[ChangeEvent]) -> ChangeEvent:
+        """ 按 binlog 顺序合并各个分区的副本，两个分区都有的行只保留一次 """
+        first = events[0]
+        if first.event_type is EventType.TRANSACTION:
+            parts = [i for e in events for i in e.events]
+        else:
+            parts = events
+        merged: Dict[Tuple[int, int], ChangeEvent] = {}
+        for e in sorted(parts, key=lambda e: (e.lsn.log_index,
+                                              e.lsn.log_position)):
+            k = (e.lsn.log_index, e.lsn.log_position)
+            if k not in merged:
+                merged[k] = copy.copy(e)
+                merged[k].values = list(e.values)
                 continue
-            event = ChangeEvent.decode(i.value.decode())
-            if not self._check_lsn(event):
-                raise Exception("event has miss [{}]".format(
-                    event.lsn.encode()))
-            if event.table not in self.tables.keys():
-                raise Exception("unknown table [{}] in event lsn{}:".format(
-                    event.table, event.lsn.encode()))
-            if self._last_lsn == event.lsn:  # 重复消费
+            values = merged[k].values
+            values.extend(i for i in e.values if i not in values)
+        # 保留 barrier，水位记录到所有分区
+        result = copy.copy(first)
+        if first.event_type is EventType.TRANSACTION:
+            result.events = list(merged.values())
+        else:
+            result.values = list(merged.values())[0].values
+        return result
+
+    def _open_stream(self) -> AsyncStream:
+        conf = MQConfig.get_instance()
+        max_records = max(self.apply_conf.batch_size, conf.max_poll_records)
+        if self.scheduler is not None:
+            max_records = self.apply_conf.lane_queue_size
+        stream = self.mq.get_async_stream(conf.prefetch, max_records,
+                                          self.apply_conf.batch_wait)
+        self.committer = OffsetCommitter(
+                stream.commit, conf.auto_commit_interval_ms / 1000,
+                conf.commit_messages)
+        return stream
+
+    async def _get_batches(self, stream: AsyncStream) \
+            -> AsyncIterator[List[MQMessage]]:
+        """
+        消息由后台线程预取，处理当前批次时下一批已经在拉取。
+        batch_size 大于 1 时最多等待 batch_wait 秒攒够一批消息。
+        """
+        size = self.apply_conf.batch_size
+        if self.scheduler is not None:
+            # 多个 lane 时不攒批，拉取到的消息直接分发到 lane
+            size = 1
+        wait = self.apply_conf.batch_wait
+        while self._running:
+            if self._next_version is not None:
+                await self._switch_version()
+            messages = await stream.get(wait)
+            if messages is None:
+                return
+            if not messages:
+                # 空闲时也按时间刷盘和提交 offset
+                await self._flush_checkpoint()
                 continue
-            if event.event_type is EventType.DELETE:
-                await self._delete(event)
-            elif event.event_type is EventType.INSERT:
-                await self._insert(event)
-            elif event.event_type is EventType.UPDATE:
-                await self._update(event)
-            else:
+            deadline = time.monotonic() + wait
+            while len(messages) < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                r = await stream.get(remaining)
+                if not r:
+                    break
+                messages.extend(r)
+            yield messages
+
+    async def _apply_events(self, events: List[Tuple[ChangeEvent, Any]]):
+        """ 连续的非批量写入的事件在一个事务中提交，提交后记录进度 """
+        batch: List[ChangeEvent] = []
+        for e, _ in events:
+            if e.event_type not in (EventType.SNAPSHOT, EventType.DDL) and \
+                    not self._is_bulk(e, self._get_events(e)):
+                batch.append(e)
                 continue
-            self._last_lsn = event.lsn
+            await self._apply_batch(batch)
+            batch = []
+            await self._apply(e)
+        await self._apply_batch(batch)
+        for e, i in events:
+            self._on_applied(e, i)
+
+    def _on_applied(self, event: ChangeEvent, message: Any):
+        """ event 和之前的事件都已经提交 """
+        if isinstance(message, list):
+            # 合并应用的跨分区副本
+            for e, i in message:
+                self._on_applied(e, i)
+            return
+        if event.event_type is not EventType.SNAPSHOT:
+            self._applied_lsns[event.partition] = event.lsn
+        # 只记录进度，由 _flush_checkpoint 在线程池中刷盘
+        self.checkpoint.update(self.checkpoint_key, self._get_process(), 1,
+                               len(message.value), flush=False)
+        self._done(message)
+
+    def _done(self, message: MQMessage):
+        self.committer.done(message)
+        self._commit()
+
+    async def _flush_checkpoint(self, force: bool = False):
+        """ fsync 在线程池中执行，不阻塞事件循环和 lane """
+        if force or self.checkpoint.need_flush():
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.checkpoint.flush)
+        self._commit()
+
+    def _commit(self):
+        # offset 只提交到进度已经刷盘的位置，重启后 LSN 链能够接上
+        if self.checkpoint.is_flushed():
+            self.committer.durable()
+        self.committer.maybe_commit()
+
+    @staticmethod
+    def _get_events(event: ChangeEvent) -> List[ChangeEvent]:
+        if event.event_type is EventType.TRANSACTION:
+            return event.events
+        return [event]
 
-    async def _update(self, event: ChangeEvent):
-        get_current_sql = "SELECT * FROM {} WHERE {} FOR UPDATE"
-        lock_sql = "UPDATE {} set `pidal_c` = `pidal_c` | 1 WHERE {}"
-        update_sql = "UPDATE {} set {} WHERE {}"
+    async def _apply(self, event: ChangeEvent, lane: Optional[int] = 0):
+        """ 一条消息在目标库的一个事务中提交，事务消息包含源端整个事务 """
+        if event.event_type is EventType.DDL:
+            # 之前的事件都已经应用，之后的事件使用新的元数据
+            await self._refresh_table(event.table)
+            return
+        if self.watermark is not None and \
+                self.watermark.is_applied(event, lane):
+            return
+        events = self._get_events(event)
+        for e in events:
+            if e.table not in self.tables.keys():
+                raise Exception("unknown table [{}] in event lsn{}:".format(
+                    e.table, event.lsn.encode()))
+        is_bulk = self._is_bulk(event, events)
         client = await self.client.acquire()
         try:
-            for i in event.values:
-                if "before_values" not in i.keys() or "after_values" not in i.keys():
-                    raise Exception("update event value {} error lsn{}.".format(i, event.lsn.encode()))
-                if not self._check_lock(event.table, i["before_values"]) or not self._check_lock(event.table, i["after_values"]):
-                    raise Exception("need lock_key {} error lsn{}.".format(self.tables[event.table], event.lsn.encode()))
-
-                where = self._parser_where(self.tables[event.table], i["before_values"])
-                await client.begin()
-                async with client.cursor() as cur:
-                    await cur.execute(get_current_sql.format(event.table, where))
-                    current = await cur.fetchone()
-                    if current == i["after_values"]:  # 数据已经修改过了。
-                        await client.rollback()
-                        continue
-                    belong_zone_id = self._get_belong_zone_id(event.table, i["before_values"])
-                    if belong_zone_id == self.zone_id:
-                        # 自己的修改
-                        continue
-                    source_zone_id, _, data_version, _ = self._parser_pidal_c(i["after_values"]["pidal_c"])
-                    _, _, current_version, is_lock = self._parser_pidal_c(current["pidal_c"])
-                    if belong_zone_id != source_zone_id:
-                        logger.error("error data modify in zone_id {} table {} data {}".format(event.source_zone_id, event.table, i["before_values"]))
-                        if belong_zone_id == self.zone_id and not is_lock:
-                            await cur.execute(lock_sql.format(event.table, where))
-                            await client.commit()
-                        continue
-                    if current == i["before_values"]:
-                        await cur.execute(update_sql.format(event.table, self._parser_set(i["after_values"]), where))
-                        await client.commit()
-                        continue
-                    if data_version < current_version:
-                        # 老数据
-                        await client.rollback()
-                    elif data_version == current_version:
-                        # 数据校验不一致
-                        if belong_zone_id == self.zone_id and not is_lock:
-                            await cur.execute(lock_sql.format(event.table, where))
-                            await client.commit()
-                        else:
-                            await client.rollback()
-                    else:
-                        # 走到这里可能是数据落后版本太多,直接覆盖
-                        await cur.execute(update_sql.format(event.table, self._parser_set(i["after_values"]), where))
-                        await client.commit()
+            await client.begin()
+            async with client.cursor() as cur:
+                for e in events:
+                    if is_bulk:
+                        await self._bulk(cur, e)
+                    elif e.event_type is EventType.DELETE:
+                        await self._delete(cur, e)
+                    elif e.event_type is EventType.INSERT:
+                        await self._insert(cur, e)
+                    elif e.event_type is EventType.UPDATE:
+                        await self._update(cur, e)
+                    elif e.event_type is EventType.SNAPSHOT:
+                        await self._snapshot(cur, e)
+                if self.watermark is not None:
+                    lsns = await self.watermark.save(cur, [event], lane)
+            await client.commit()
+            if self.watermark is not None:
+                self.watermark.commit(lsns)
         finally:
             await client.rollback()
             self.client.release(client)
 
+    async def _apply_batch(self, events: List[ChangeEvent]):
+        """
+        多条消息在一个事务中提交。每个表用一条 SQL 锁定并读取涉及的所有行，
+        在内存中按顺序执行冲突规则，最后把净变化写成多行的 DELETE、INSERT
+        和按锁字段定位的 UPDATE。
+        """
+        if not events:
+            return
+        if self.apply_conf.batch_size <= 1:
+            for e in events:
+                await self._apply(e)
+            return
+        if self.watermark is not None:
+            events = [e for e in events
+                      if not self.watermark.is_applied(e, 0)]
+            if not events:
+                return
+        rows: Dict[str, List[ChangeEvent]] = {}
+        for event in events:
+            for e in self._get_events(event):
+                if e.table not in self.tables.keys():
+                    raise Exception("unknown table [{}] in event lsn{}:"
+                                    .format(e.table, event.lsn.encode()))
+                rows.setdefault(e.table, []).append(e)
+        client = await self.client.acquire()
+        try:
+            await client.begin()
+            async with client.cursor() as cur:
+                for table, table_events in rows.items():
+                    await self._batch_table(cur, table, table_events)
+                if self.watermark is not None:
+                    lsns = await self.watermark.save(cur, events, 0)
+            await client.commit()
+            if self.watermark is not None:
+                self.watermark.commit(lsns)
+        finally:
+            await client.rollback()
+            self.client.release(client)
+
+    async def _batch_table(self, cur: Cursor, table: str,
+                           events: List[ChangeEvent]):
+        lock_key = self.tables[table]
+        batch_rows = self.apply_conf.bulk_batch_rows
+        keys = set()
+        for e in events:
+            for i in e.values:
+                for k in ("values", "before_values", "after_values"):
+                    if k not in i.keys():
+                        continue
+                    if not self._check_lock(table, i[k]):
+                        raise Exception("need lock_key {} error lsn{}.".format(
+                            lock_key, e.lsn.encode()))
+                    keys.add(self._get_key(table, i[k]))
+        initial: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        for sql, args in bulk.select_for_update(table, lock_key, list(keys),
+                                                batch_rows):
+            await cur.execute(sql, args)
+            for r in await cur.fetchall():
+                initial[self._get_key(table, r)] = r
+        state: Dict[Tuple[Any, ...], Optional[Dict[str, Any]]] = {
+                k: initial.get(k) for k in keys}
+        for e in events:
+            if e.event_type is EventType.DELETE:
+                self._batch_delete(state, e)
+            elif e.event_type is EventType.INSERT:
+                self._batch_insert(state, e)
+            elif e.event_type is EventType.UPDATE:
+                self._batch_update(state, e)
+
+        deletes, updates, inserts = [], [], []
+        for k, v in state.items():
+            old = initial.get(k)
+            if old is not None and v is None:
+                deletes.append(k)
+            elif old is None and v is not None:
+                inserts.append(v)
+            elif old is not None and v is not None and old != v:
+                updates.append((old, v))
+        # 先删除再插入，修改了锁字段的行是旧 key 删除、新 key 插入
+        for sql, args in bulk.delete(table, lock_key, deletes, batch_rows):
+            await cur.execute(sql, args)
+        for sql, args in bulk.update(table, lock_key, updates):
+            await cur.execute(sql, args)
+        for sql, args in bulk.insert(table, inserts, batch_rows):
+            await cur.execute(sql, args)
+
+    def _get_key(self, table: str, values: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(values[i] for i in self.tables[table])
+
+    def _batch_insert(self, state: Dict[Tuple[Any, ...], Any],
+                      event: ChangeEvent):
+        """ 和 _insert 相同的规则，作用在内存中的行上 """
+        for i in event.values:
+            if "values" not in i.keys():
+                raise Exception("update event value {} error lsn{}.".format(
+                    i, event.lsn.encode()))
+            key = self._get_key(event.table, i["values"])
+            current = state[key]
+            if current == i["values"]:  # 数据已经插入。
+                continue
+            if not current:
+                state[key] = dict(i["values"])
+                continue
+            belong_zone_id = self._get_belong_zone_id(event.table,
+                                                      i["values"])
+            if belong_zone_id == self.zone_id:
+                # 自己的修改
+                continue
+            source_zone_id, _, _, _ = self._parser_pidal_c(
+                    i["values"]["pidal_c"])
+            if belong_zone_id != source_zone_id:
+                logger.error("error data insert  in zone_id {} table {} "
+                             "data {}".format(event.source_zone_id,
+                                              event.table, i["values"]))
+                continue
+            logger.error("error data insert in zone_id {} table {} data {}"
+                         .format(self.zone_id, event.table, current))
+
+    def _batch_update(self, state: Dict[Tuple[Any, ...], Any],
+                      event: ChangeEvent):
+        """ 和 _update 相同的规则，作用在内存中的行上 """
+        for i in event.values:
+            if "before_values" not in i.keys() or \
+                    "after_values" not in i.keys():
+                raise Exception("update event value {} error lsn{}.".format(
+                    i, event.lsn.encode()))
+            key = self._get_key(event.table, i["before_values"])
+            current = state[key]
+            if self._is_same(current, i["after_values"], event.compact):
+                continue
+            belong_zone_id = self._get_belong_zone_id(event.table,
+                                                      i["before_values"])
+            if belong_zone_id == self.zone_id:
+                # 自己的修改
+                continue
+            if not current:
+                logger.error("error data update in zone_id {} table {} "
+                             "data {}".format(self.zone_id, event.table,
+                                              i["before_values"]))
+                continue
+            source_zone_id, _, data_version, _ = self._parser_pidal_c(
+                    i["after_values"]["pidal_c"])
+            _, _, current_version, _ = self._parser_pidal_c(
+                    current["pidal_c"])
+            if belong_zone_id != source_zone_id:
+                logger.error("error data modify in zone_id {} table {} "
+                             "data {}".format(event.source_zone_id,
+                                              event.table,
+                                              i["before_values"]))
+                continue
+            if not self._is_same(current, i["before_values"], event.compact) \
+                    and data_version <= current_version:
+                # 老数据或者数据校验不一致
+                continue
+            row = dict(current)
+            row.update(self._get_set_values(i, event.compact))
+            new_key = self._get_key(event.table, row)
+            if new_key != key and state.get(new_key) is not None:
+                # 和逐条应用时 UPDATE 锁字段的唯一键冲突一致
+                raise Exception("duplicate lock_key {} in table [{}] "
+                                "lsn{}.".format(new_key, event.table,
+                                                event.lsn.encode()))
+            state[key] = None
+            state[new_key] = row
+
+    def _batch_delete(self, state: Dict[Tuple[Any, ...], Any],
+                      event: ChangeEvent):
+        """ 和 _delete 相同的规则，作用在内存中的行上 """
+        for i in event.values:
+            if "values" not in i.keys():
+                raise Exception("update event value {} error lsn{}.".format(
+                    i, event.lsn.encode()))
+            key = self._get_key(event.table, i["values"])
+            current = state[key]
+            if not current:  # 数据已经删除
+                continue
+            state[key] = None
+            if current != i["values"]:
+                logger.error("error data insert in zone_id {} table {} data {}"
+                             .format(self.zone_id, event.table, current))
+
+    def _is_bulk(self, event: ChangeEvent, events: List[ChangeEvent]) -> bool:
+        """ 全量事件，以及落后较多并且只有 INSERT 的事件批量写入 """
+        if not self.apply_conf.bulk:
+            return False
+        if event.event_type is EventType.SNAPSHOT:
+            return True
+        for e in events:
+            if e.event_type is not EventType.INSERT:
+                return False
+        return time.time() - event.timestamp >= self.apply_conf.bulk_lag
+
+    async def _bulk(self, cur: Cursor, event: ChangeEvent):
+        for i in event.values:
+            if "values" not in i.keys():
+                raise Exception("bulk event value {} error lsn{}.".format(
+                    i, event.lsn.encode()))
+        values = [i["values"] for i in event.values]
+        zones = self.router.get_zones(event.table, values)
+        # 跳过自己的数据
+        rows = [r for r, z in zip(values, zones) if z != self.zone_id]
+        for sql, args in bulk.upsert(event.table, rows,
+                                     self.apply_conf.bulk_batch_rows):
+            await cur.execute(sql, args)
+
+    async def _update(self, cur: Cursor, event: ChangeEvent):
+        lock_key = self.tables[event.table]
+        for i in event.values:
+            if "before_values" not in i.keys() or "after_values" not in i.keys():
+                raise Exception("update event value {} error lsn{}.".format(i, event.lsn.encode()))
+            if not self._check_lock(event.table, i["before_values"]) or not self._check_lock(event.table, i["after_values"]):
+                raise Exception("need lock_key {} error lsn{}.".format(self.tables[event.table], event.lsn.encode()))
+
+            where = i["before_values"]
+            await cur.execute(*statement.select_for_update(event.table, lock_key, where))
+            current = await cur.fetchone()
+            if self._is_same(current, i["after_values"], event.compact):  # 数据已经修改过了。
+                continue
+            belong_zone_id = self._get_belong_zone_id(event.table, i["before_values"])
+            if belong_zone_id == self.zone_id:
+                # 自己的修改
+                continue
+            if not current:
+                # 数据不存在，保留现场，不修改。
+                logger.error("error data update in zone_id {} table {} data {}".format(self.zone_id, event.table, i["before_values"]))
+                continue
+            source_zone_id, _, data_version, _ = self._parser_pidal_c(i["after_values"]["pidal_c"])
+            _, _, current_version, is_lock = self._parser_pidal_c(current["pidal_c"])
+            if belong_zone_id != source_zone_id:
+                logger.error("error data modify in zone_id {} table {} data {}".format(event.source_zone_id, event.table, i["before_values"]))
+                if belong_zone_id == self.zone_id and not is_lock:
+                    await cur.execute(*statement.lock(event.table, lock_key, where))
+                continue
+            set_values = self._get_set_values(i, event.compact)
+            if self._is_same(current, i["before_values"], event.compact):
+                await cur.execute(*statement.update(event.table, lock_key, set_values, where))
+                continue
+            if data_version < current_version:
+                # 老数据
+                continue
+            elif data_version == current_version:
+                # 数据校验不一致
+                if belong_zone_id == self.zone_id and not is_lock:
+                    await cur.execute(*statement.lock(event.table, lock_key, where))
+            else:
+                # 走到这里可能是数据落后版本太多,直接覆盖
+                await cur.execute(*statement.update(event.table, lock_key, set_values, where))
+
     @staticmethod
-    def _parser_set(values: Dict[str, Any]) -> str:
-        r = []
+    def _is_same(current: Optional[Dict[str, Any]], values: Dict[str, Any],
+                 compact: bool) -> bool:
+        """ compact 事件只包含部分字段，只比较事件中有的字段 """
+        if not compact or not current:
+            return current == values
         for k, v in values.items():
-            r.append(" `{}` = '{}' ".format(k, v))
-        return ",".join(r)
+            if current.get(k) != v:
+                return False
+        return True
+
+    @staticmethod
+    def _get_set_values(row: Dict[str, Dict[str, Any]],
+                        compact: bool) -> Dict[str, Any]:
+        """ compact 事件只更新修改过的字段 """
+        if not compact:
+            return row["after_values"]
+        before = row["before_values"]
+        return {k: v for k, v in row["after_values"].items()
+                if k == "pidal_c" or before.get(k) != v}
 
     def _get_belong_zone_id(self, table: str, values: Dict[str, Any]) -> int:
-        a = self.table_zs_algorithms[table]
-        args = []
-        if a["zs_algorithm_args"]:
-            args.append(a["zs_algorithm_args"].copy())
-        for i in a["zskeys"]:
-            args.append(values[i])
-        zsid = a["zs_algorithm"](*args)
-        return self.zsid[zsid]
+        return self.router.get_zone(table, values)
 
     @staticmethod
     def _parser_pidal_c(pidal_c: int) -> Tuple[int, int, int, bool]:
-        p = bin(pidal_c)
-        version = p[-21:-1]
-        meta_version = p[-53:-33]
-        return (pidal_c >> 53, int(meta_version, 2), int(version, 2),
-                not bool(pidal_c | 1))
-
-    @staticmethod
-    def _parser_where(lock_key: List[str], values: Dict[str, Any]) -> str:
-        return "AND".join(
-                [" `{}` = '{}' ".format(i, values[i]) for i in lock_key])
+        return pidal.decode(pidal_c)
 
     def _check_lock(self, table: str, values: Dict[str, Any]) -> bool:
         keys = values.keys()
@@ -208,84 +744,91 @@ class Apply(object):
                 return False
         return True
 
-    async def _insert(self, event: ChangeEvent):
-        get_current_sql = "SELECT * FROM {} WHERE {} FOR UPDATE"
-        insert_sql = "INSERT INTO {} ({}) VALUES ({})"
-        client = await self.client.acquire()
-        try:
-            for i in event.values:
-                if "values" not in i.keys():
-                    raise Exception("update event value {} error lsn{}.".format(i, event.lsn.encode()))
-                if not self._check_lock(event.table, i["values"]):
-                    raise Exception("need lock_key {} error lsn{}.".format(self.tables[event.table], event.lsn.encode()))
-
-                where = self._parser_where(self.tables[event.table], i["values"])
-                await client.begin()
-                async with client.cursor() as cur:
-                    await cur.execute(get_current_sql.format(event.table, where))
-                    current = await cur.fetchone()
-                    if current == i["values"]:  # 数据已经插入。
-                        await client.rollback()
-                        continue
-                    if not current:
-                        # 正常插入数据
-                        cl = ", ".join(["`{}`".format(c) for c in i["values"].keys()])
-                        va = ", ".join(["'{}'".format(c) for c in i["values"].values()])
-                        await cur.execute(insert_sql.format(event.table, cl, va))
-                        await client.commit()
-                    # 走到这里说明有数据，切和 event 的不一致。
-                    belong_zone_id = self._get_belong_zone_id(event.table, i["values"])
-                    if belong_zone_id == self.zone_id:
-                        # 自己的修改
-                        await client.rollback()
-                        continue
-                    source_zone_id, _, data_version, _ = self._parser_pidal_c(i["values"]["pidal_c"])
-                    if belong_zone_id != source_zone_id:
-                        logger.error("error data insert  in zone_id {} table {} data {}".format(event.source_zone_id, event.table, i["before_values"]))
-                        await client.rollback()
-                        continue
-                    # 走到这里说明来源的数据是对的，但是当前的数据不知道什么原因保留现场，不自改。
-                    logger.error("error data insert in zone_id {} table {} data {}".format(self.zone_id, event.table, current))
-                    await client.rollback()
-        finally:
-            await client.rollback()
-            self.client.release(client)
+    async def _insert(self, cur: Cursor, event: ChangeEvent):
+        lock_key = self.tables[event.table]
+        for i in event.values:
+            if "values" not in i.keys():
+                raise Exception("update event value {} error lsn{}.".format(i, event.lsn.encode()))
+            if not self._check_lock(event.table, i["values"]):
+                raise Exception("need lock_key {} error lsn{}.".format(self.tables[event.table], event.lsn.encode()))
 
-    async def _delete(self, event: ChangeEvent):
-        get_current_sql = "SELECT * FROM {} WHERE {} FOR UPDATE"
-        delete_sql = "DELETE FROM {} WHERE {}"
-        client = await self.client.acquire()
-        try:
-            for i in event.values:
-                if "values" not in i.keys():
-                    raise Exception("update event value {} error lsn{}.".format(i, event.lsn.encode()))
-                if not self._check_lock(event.table, i["values"]):
-                    raise Exception("need lock_key {} error lsn{}.".format(self.tables[event.table], event.lsn.encode()))
-
-                where = self._parser_where(self.tables[event.table], i["values"])
-                await client.begin()
-                async with client.cursor() as cur:
-                    await cur.execute(get_current_sql.format(event.table, where))
-                    current = await cur.fetchone()
-                    if not current:  # 数据已经删除
-                        await client.rollback()
-                        continue
-                    await cur.execute(delete_sql.format(event.table, where))
-                    await client.commit()
-                    if current != i["values"]:  # 需要删除数据
-                        # 走到这里说明有数据，切和 event 的不一致。
-                        logger.error("error data insert in zone_id {} table {} data {}".format(self.zone_id, event.table, current))
-        finally:
-            await client.rollback()
-            self.client.release(client)
+            await cur.execute(*statement.select_for_update(event.table, lock_key, i["values"]))
+            current = await cur.fetchone()
+            if current == i["values"]:  # 数据已经插入。
+                continue
+            if not current:
+                # 正常插入数据
+                await cur.execute(*statement.insert(event.table, i["values"]))
+                continue
+            # 走到这里说明有数据，切和 event 的不一致。
+            belong_zone_id = self._get_belong_zone_id(event.table, i["values"])
+            if belong_zone_id == self.zone_id:
+                # 自己的修改
+                continue
+            source_zone_id, _, data_version, _ = self._parser_pidal_c(i["values"]["pidal_c"])
+            if belong_zone_id != source_zone_id:
+                logger.error("error data insert  in zone_id {} table {} data {}".format(event.source_zone_id, event.table, i["values"]))
+                continue
+            # 走到这里说明来源的数据是对的，但是当前的数据不知道什么原因保留现场，不自改。
+            logger.error("error data insert in zone_id {} table {} data {}".format(self.zone_id, event.table, current))
+
+    async def _snapshot(self, cur: Cursor, event: ChangeEvent):
+        lock_key = self.tables[event.table]
+        for i in event.values:
+            if "values" not in i.keys():
+                raise Exception("snapshot event value {} error lsn{}.".format(
+                    i, event.lsn.encode()))
+            if not self._check_lock(event.table, i["values"]):
+                raise Exception("need lock_key {} error lsn{}.".format(
+                    self.tables[event.table], event.lsn.encode()))
+
+            await cur.execute(*statement.select_for_update(
+                event.table, lock_key, i["values"]))
+            current = await cur.fetchone()
+            if current == i["values"]:  # 数据已经同步
+                continue
+            if not current:
+                await cur.execute(*statement.insert(event.table, i["values"]))
+                continue
+            belong_zone_id = self._get_belong_zone_id(event.table,
+                                                      i["values"])
+            if belong_zone_id == self.zone_id:
+                # 自己的数据
+                continue
+            _, _, data_version, _ = self._parser_pidal_c(
+                    i["values"]["pidal_c"])
+            _, _, current_version, _ = self._parser_pidal_c(
+                    current["pidal_c"])
+            # 增量可能已经应用了更新的版本，只在全量的版本更新时覆盖
+            if data_version > current_version:
+                await cur.execute(*statement.update(
+                    event.table, lock_key, i["values"], i["values"]))
+
+    async def _delete(self, cur: Cursor, event: ChangeEvent):
+        lock_key = self.tables[event.table]
+        for i in event.values:
+            if "values" not in i.keys():
+                raise Exception("update event value {} error lsn{}.".format(i, event.lsn.encode()))
+            if not self._check_lock(event.table, i["values"]):
+                raise Exception("need lock_key {} error lsn{}.".format(self.tables[event.table], event.lsn.encode()))
+
+            await cur.execute(*statement.select_for_update(event.table, lock_key, i["values"]))
+            current = await cur.fetchone()
+            if not current:  # 数据已经删除
+                continue
+            await cur.execute(*statement.delete(event.table, lock_key, i["values"]))
+            if current != i["values"]:  # 需要删除数据
+                # 走到这里说明有数据，切和 event 的不一致。
+                logger.error("error data insert in zone_id {} table {} data {}".format(self.zone_id, event.table, current))
 
     def _check_lsn(self, event: ChangeEvent) -> bool:
         if event.is_retry:
             return True
-        if not self._last_lsn:
+        last_lsn = self._last_lsns.get(event.partition)
+        if not last_lsn:
             return True
-        if self._last_lsn == event.prev_lsn:
+        if last_lsn == event.prev_lsn:
             return True
-        if self._last_lsn == event.lsn:  # 消息重复
+        if last_lsn == event.lsn:  # 消息重复
             return True
         return False
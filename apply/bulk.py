@@ -0,0 +1,113 @@
+import functools
+
+from typing import Any, Dict, Iterator, List, Tuple
+
+from apply import statement
+from common import pidal
+
+# pidal_c 中的数据版本
+_DATA_VERSION = "((`pidal_c` >> {}) & 0x{:X})".format(
+        pidal.DATA_VERSION_SHIFT, pidal.DATA_VERSION_MASK)
+_NEW_DATA_VERSION = "((VALUES(`pidal_c`) >> {}) & 0x{:X})".format(
+        pidal.DATA_VERSION_SHIFT, pidal.DATA_VERSION_MASK)
+
+
+def upsert(table: str, rows: List[Dict[str, Any]],
+           batch_rows: int) -> Iterator[Tuple[str, List[Any]]]:
+    """
+    生成多行 INSERT ... ON DUPLICATE KEY UPDATE，已经存在的行只在新数据的
+    版本更高时覆盖。字段相同的行合并到一条 SQL，每条最多 batch_rows 行。
+    """
+    for columns, group in _group(rows).items():
+        if "pidal_c" not in columns:
+            raise Exception("table [{}] row has no pidal_c.".format(table))
+        for i in range(0, len(group), batch_rows):
+            batch = group[i:i + batch_rows]
+            args = [r[c] for r in batch for c in columns]
+            yield _upsert_sql(table, columns, len(batch)), args
+
+
+@functools.lru_cache(maxsize=1024)
+def _upsert_sql(table: str, columns: Tuple[str, ...], rows: int) -> str:
+    row = "({})".format(", ".join(["%s"] * len(columns)))
+    updates = []
+    # MySQL 按顺序赋值，pidal_c 必须最后更新，前面的判断使用的是旧版本
+    for c in columns:
+        if c == "pidal_c":
+            continue
+        updates.append("`{0}` = IF({1} > {2}, VALUES(`{0}`), `{0}`)".format(
+            c, _NEW_DATA_VERSION, _DATA_VERSION))
+    updates.append("`pidal_c` = IF({0} > {1}, VALUES(`pidal_c`), "
+                   "`pidal_c`)".format(_NEW_DATA_VERSION, _DATA_VERSION))
+    return "INSERT INTO `{}` ({}) VALUES {} ON DUPLICATE KEY UPDATE {}"\
+        .format(table, ", ".join("`{}`".format(c) for c in columns),
+                ", ".join([row] * rows), ", ".join(updates))
+
+
+def _group(rows: List[Dict[str, Any]]) \
+        -> Dict[Tuple[str, ...], List[Dict[str, Any]]]:
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for r in rows:
+        groups.setdefault(tuple(r.keys()), []).append(r)
+    return groups
+
+
+def _key_in(key_columns: List[str], count: int) -> str:
+    """ `a` IN (%s, %s) 或者 (`a`, `b`) IN ((%s, %s), (%s, %s)) """
+    if len(key_columns) == 1:
+        return "`{}` IN ({})".format(key_columns[0],
+                                     ", ".join(["%s"] * count))
+    row = "({})".format(", ".join(["%s"] * len(key_columns)))
+    return "({}) IN ({})".format(
+            ", ".join("`{}`".format(c) for c in key_columns),
+            ", ".join([row] * count))
+
+
+def select_for_update(table: str, key_columns: List[str],
+                      keys: List[Tuple[Any, ...]],
+                      batch_rows: int) -> Iterator[Tuple[str, List[Any]]]:
+    """ 一次锁定并读取多行 """
+    for i in range(0, len(keys), batch_rows):
+        batch = keys[i:i + batch_rows]
+        yield "SELECT * FROM `{}` WHERE {} FOR UPDATE".format(
+                table, _key_in(key_columns, len(batch))), \
+            [v for k in batch for v in k]
+
+
+def delete(table: str, key_columns: List[str], keys: List[Tuple[Any, ...]],
+           batch_rows: int) -> Iterator[Tuple[str, List[Any]]]:
+    for i in range(0, len(keys), batch_rows):
+        batch = keys[i:i + batch_rows]
+        yield "DELETE FROM `{}` WHERE {}".format(
+                table, _key_in(key_columns, len(batch))), \
+            [v for k in batch for v in k]
+
+
+def insert(table: str, rows: List[Dict[str, Any]],
+           batch_rows: int) -> Iterator[Tuple[str, List[Any]]]:
+    for columns, group in _group(rows).items():
+        for i in range(0, len(group), batch_rows):
+            batch = group[i:i + batch_rows]
+            yield _insert_sql(table, columns, len(batch)), \
+                [r[c] for r in batch for c in columns]
+
+
+def update(table: str, key_columns: List[str],
+           rows: List[Tuple[Dict[str, Any], Dict[str, Any]]]) \
+        -> Iterator[Tuple[str, List[Any]]]:
+    """
+    更新已经锁定并且确定存在的行，rows 为 (旧行, 新行)，按锁字段定位，只设置
+    变化的字段。不使用 INSERT ... ON DUPLICATE KEY UPDATE，锁字段不是主键时
+    它可能按其他唯一索引匹配到另一行。
+    """
+    for old, new in rows:
+        values = {c: v for c, v in new.items() if old.get(c) != v}
+        yield statement.update(table, key_columns, values, old)
+
+
+@functools.lru_cache(maxsize=1024)
+def _insert_sql(table: str, columns: Tuple[str, ...], rows: int) -> str:
+    row = "({})".format(", ".join(["%s"] * len(columns)))
+    return "INSERT INTO `{}` ({}) VALUES {}".format(
+            table, ", ".join("`{}`".format(c) for c in columns),
+            ", ".join([row] * rows))
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from aiomysql import create_pool
 from aiomysql.connection import Connection
@@ -34,10 +34,11 @@ class AIOMySQL(Client):
             async with conn.cursor() as cur:
                 return await cur.execute(sql)
 
-    async def query(self, sql: str) -> List[Dict[str, Any]]:
+    async def query(self, sql: str,
+                    args: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cur:
-                await cur.execute(sql)
+                await cur.execute(sql, args)
                 return await cur.fetchall()
 
     async def acquire(self) -> Connection:
@@ -1,5 +1,5 @@
 import abc
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from aiomysql.connection import Connection
 from common.dsn import DSN
@@ -18,7 +18,8 @@ class Client(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    async def query(self, sql: str) -> List[Dict[str, Any]]:
+    async def query(self, sql: str,
+                    args: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
         pass
 
     @abc.abstractmethod
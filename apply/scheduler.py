@@ -0,0 +1,154 @@
+import asyncio
+import copy
+import zlib
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, \
+        Tuple
+
+from common.change_event import ChangeEvent, EventType
+
+
+class Scheduler(object):
+    """
+    按表和锁字段把行 hash 到多个 lane，每个 lane 一个协程顺序应用，
+    不同 lane 使用连接池中不同的连接并行执行，同一个 key 的修改保持顺序。
+
+    DDL、涉及多个 lane 的事务消息，以及修改了锁字段跨 lane 的 UPDATE，
+    等待所有 lane 执行完成后再单独执行，保证事务在一个目标库事务中提交。
+    apply(消息, lane) 单独执行时 lane 为 None。
+    消息全部执行完成，并且之前的消息也都完成后才回调
+    on_applied(消息, 提交时传入的 context)，进度只推进到所有 lane 都已经
+    完成的位置。
+    """
+
+    def __init__(self, lanes: int, queue_size: int,
+                 get_key: Callable[[str, Dict[str, Any]], Tuple[Any, ...]],
+                 apply: Callable[[ChangeEvent, Optional[int]],
+                                 Awaitable[None]],
+                 on_applied: Callable[[ChangeEvent, Any], None]):
+        self.lanes = lanes
+        self.get_key = get_key
+        self.apply = apply
+        self.on_applied = on_applied
+        self.queues: List[asyncio.Queue] = [
+                asyncio.Queue(maxsize=queue_size) for _ in range(lanes)]
+        self._workers: List[asyncio.Task] = []
+        self._seq = 0
+        # seq -> [未完成的部分, 消息, context]
+        self._pending: Dict[int, List[Any]] = {}
+        self._order: Deque[int] = deque()
+        self._error: Optional[Exception] = None
+
+    def start(self):
+        self._workers = [asyncio.ensure_future(self._worker(lane))
+                         for lane in range(self.lanes)]
+
+    async def submit(self, event: ChangeEvent, context: Any):
+        self._raise_error()
+        self._seq += 1
+        seq = self._seq
+        parts = self._split(event)
+        self._order.append(seq)
+        if parts is None:
+            self._pending[seq] = [1, event, context]
+            await self._join()
+            self._raise_error()
+            await self._run(seq, event, None)
+            self._raise_error()
+            return
+        self._pending[seq] = [len(parts), event, context]
+        for lane, e in parts.items():
+            await self.queues[lane].put((seq, e))
+
+    async def drain(self):
+        """ 等待已经提交的事件全部应用 """
+        await self._join()
+        self._raise_error()
+
+    async def close(self):
+        await self._join()
+        for i in self._workers:
+            i.cancel()
+        self._raise_error()
+
+    async def _join(self):
+        await asyncio.gather(*(q.join() for q in self.queues))
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _get_lane(self, table: str, values: Dict[str, Any]) -> int:
+        key = repr((table,) + self.get_key(table, values))
+        return zlib.crc32(key.encode()) % self.lanes
+
+    def _row_lane(self, table: str, row: Dict[str, Dict[str, Any]]) -> int:
+        """ 返回 -1 表示 UPDATE 修改了锁字段，前后两个 key 不在一个 lane """
+        if "values" in row:
+            return self._get_lane(table, row["values"])
+        before = self._get_lane(table, row["before_values"])
+        if before != self._get_lane(table, row["after_values"]):
+            return -1
+        return before
+
+    def _split(self, event: ChangeEvent) -> Optional[Dict[int, ChangeEvent]]:
+        """ 按 lane 拆分消息，需要单独执行时返回 None """
+        if event.event_type is EventType.DDL:
+            return None
+        try:
+            return self._split_lanes(event)
+        except KeyError:
+            # 未知的表或者缺少锁字段，单独执行，由 apply 抛出对应的异常
+            return None
+
+    def _split_lanes(self, event: ChangeEvent) \
+            -> Optional[Dict[int, ChangeEvent]]:
+        if event.event_type is EventType.TRANSACTION:
+            lanes = set()
+            for e in event.events:
+                for row in e.values:
+                    lanes.add(self._row_lane(e.table, row))
+            if len(lanes) != 1 or -1 in lanes:
+                return None
+            return {lanes.pop(): event}
+        rows: Dict[int, List[Dict[str, Dict[str, Any]]]] = {}
+        for row in event.values:
+            lane = self._row_lane(event.table, row)
+            if lane == -1:
+                return None
+            rows.setdefault(lane, []).append(row)
+        if len(rows) == 1:
+            return {lane: event for lane in rows.keys()}
+        # 非事务消息的行之间没有原子性要求，拆成多个事件
+        parts = {}
+        for lane, values in rows.items():
+            e = copy.copy(event)
+            e.values = values
+            parts[lane] = e
+        return parts
+
+    async def _worker(self, lane: int):
+        q = self.queues[lane]
+        while True:
+            seq, event = await q.get()
+            try:
+                if self._error is None:
+                    await self._run(seq, event, lane)
+            finally:
+                q.task_done()
+
+    async def _run(self, seq: int, event: ChangeEvent, lane: Optional[int]):
+        try:
+            await self.apply(event, lane)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            return
+        self._done(seq)
+
+    def _done(self, seq: int):
+        self._pending[seq][0] -= 1
+        while self._order and self._pending[self._order[0]][0] == 0:
+            _, event, context = self._pending.pop(self._order.popleft())
+            self.on_applied(event, context)
@@ -0,0 +1,75 @@
+"""
+逐行应用使用的参数化 SQL。模板按 (表, 操作, 字段) 缓存，值作为参数传给
+cursor.execute，由驱动按类型转义，NULL、二进制和包含引号的数据都能正确
+写入。
+"""
+
+import functools
+
+from typing import Any, Dict, List, Tuple
+
+Statement = Tuple[str, List[Any]]
+
+
+def _where(lock_key: Tuple[str, ...]) -> str:
+    return " AND ".join("`{}` = %s".format(k) for k in lock_key)
+
+
+@functools.lru_cache(maxsize=4096)
+def _select_for_update(table: str, lock_key: Tuple[str, ...]) -> str:
+    return "SELECT * FROM `{}` WHERE {} FOR UPDATE".format(
+            table, _where(lock_key))
+
+
+@functools.lru_cache(maxsize=4096)
+def _lock(table: str, lock_key: Tuple[str, ...]) -> str:
+    return "UPDATE `{}` SET `pidal_c` = `pidal_c` | 1 WHERE {}".format(
+            table, _where(lock_key))
+
+
+@functools.lru_cache(maxsize=4096)
+def _update(table: str, columns: Tuple[str, ...],
+            lock_key: Tuple[str, ...]) -> str:
+    return "UPDATE `{}` SET {} WHERE {}".format(
+            table, ", ".join("`{}` = %s".format(c) for c in columns),
+            _where(lock_key))
+
+
+@functools.lru_cache(maxsize=4096)
+def _insert(table: str, columns: Tuple[str, ...]) -> str:
+    return "INSERT INTO `{}` ({}) VALUES ({})".format(
+            table, ", ".join("`{}`".format(c) for c in columns),
+            ", ".join(["%s"] * len(columns)))
+
+
+@functools.lru_cache(maxsize=4096)
+def _delete(table: str, lock_key: Tuple[str, ...]) -> str:
+    return "DELETE FROM `{}` WHERE {}".format(table, _where(lock_key))
+
+
+def select_for_update(table: str, lock_key: List[str],
+                      values: Dict[str, Any]) -> Statement:
+    return _select_for_update(table, tuple(lock_key)), \
+        [values[k] for k in lock_key]
+
+
+def lock(table: str, lock_key: List[str],
+         values: Dict[str, Any]) -> Statement:
+    """ 设置 pidal_c 的锁标记 """
+    return _lock(table, tuple(lock_key)), [values[k] for k in lock_key]
+
+
+def update(table: str, lock_key: List[str], values: Dict[str, Any],
+           where: Dict[str, Any]) -> Statement:
+    return _update(table, tuple(values.keys()), tuple(lock_key)), \
+        list(values.values()) + [where[k] for k in lock_key]
+
+
+def insert(table: str, values: Dict[str, Any]) -> Statement:
+    return _insert(table, tuple(values.keys())), list(values.values())
+
+
+def delete(table: str, lock_key: List[str],
+           values: Dict[str, Any]) -> Statement:
+    return _delete(table, tuple(lock_key)), [values[k] for k in lock_key]
+
@@ -0,0 +1,147 @@
+import json
+
+from typing import Dict, List, Optional, Tuple
+
+from aiomysql.cursors import Cursor
+
+from apply.client.client import Client
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from common.logging import logger
+
+TABLE = "pidal_apply_watermark"
+
+_CREATE_SQL = """CREATE TABLE IF NOT EXISTS `{}` (
+  `source_zone_id` INT NOT NULL,
+  `node` VARCHAR(64) NOT NULL,
+  `partition_id` INT NOT NULL,
+  `lane` INT NOT NULL,
+  `lanes` INT NOT NULL,
+  `position` CHAR(60) NOT NULL,
+  `lsn` VARCHAR(255) NOT NULL,
+  `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`source_zone_id`, `node`, `partition_id`, `lane`)
+) ENGINE=InnoDB""".format(TABLE)
+
+# lsn 在 position 之前赋值，判断使用的是旧的 position
+_UPSERT_SQL = "INSERT INTO `{}` (`source_zone_id`, `node`, `partition_id`, " \
+    "`lane`, `lanes`, `position`, `lsn`) VALUES {} ON DUPLICATE KEY UPDATE " \
+    "`lsn` = IF(VALUES(`position`) > `position`, VALUES(`lsn`), `lsn`), " \
+    "`lanes` = VALUES(`lanes`), " \
+    "`position` = GREATEST(`position`, VALUES(`position`))"
+
+# (源 zone, 分区, lane)
+Key = Tuple[int, int, int]
+
+
+def _position(lsn: ChangeEventLSN) -> str:
+    """ 和 ChangeEventLSN 的比较顺序一致，可以按字符串比较 """
+    return "{:020d}{:020d}{:020d}".format(lsn.source_zone_change_no,
+                                          lsn.log_index, lsn.log_position)
+
+
+class Watermark(object):
+    """
+    目标库中每个 (源 zone, 节点, 分区, lane) 已经应用的最后一个事件，和数据在
+    同一个事务中更新。重复消费时不超过水位的事件直接跳过，不再读取、锁定
+    业务表的行。
+
+    每个 lane 按顺序应用自己的事件，水位按 lane 记录，跨 lane 的事务写入
+    所有 lane 的水位。lane 数量变化时，分区所有 lane 的最小值作为新的
+    水位，缺少 lane 的分区丢弃水位，由逐行检查保证幂等。
+    """
+
+    def __init__(self, node: str, lanes: int):
+        self.node = node
+        self.lanes = lanes
+        self.lsns: Dict[Key, ChangeEventLSN] = {}
+
+    async def load(self, client: Client):
+        conn = await client.acquire()
+        try:
+            await conn.begin()
+            async with conn.cursor() as cur:
+                await cur.execute(_CREATE_SQL)
+                await cur.execute(
+                        "SELECT * FROM `{}` WHERE `node` = %s FOR UPDATE"
+                        .format(TABLE), [self.node])
+                rows = await cur.fetchall()
+                if any(r["lanes"] != self.lanes for r in rows):
+                    self.lsns = self._collapse(rows)
+                    await cur.execute("DELETE FROM `{}` WHERE `node` = %s"
+                                      .format(TABLE), [self.node])
+                    await self._write(cur, self.lsns)
+                else:
+                    self.lsns = {
+                        (r["source_zone_id"], r["partition_id"], r["lane"]):
+                        ChangeEventLSN.decode(json.loads(r["lsn"]))
+                        for r in rows}
+            await conn.commit()
+        finally:
+            await conn.rollback()
+            client.release(conn)
+
+    def _collapse(self, rows: List[Dict]) -> Dict[Key, ChangeEventLSN]:
+        groups: Dict[Tuple[int, int], List[Dict]] = {}
+        for r in rows:
+            groups.setdefault((r["source_zone_id"], r["partition_id"]),
+                              []).append(r)
+        lsns: Dict[Key, ChangeEventLSN] = {}
+        for (zone, partition), group in groups.items():
+            if len(group) != group[0]["lanes"] or \
+                    any(r["lanes"] != group[0]["lanes"] for r in group):
+                logger.warning("node [{}] partition {} watermark dropped, "
+                               "lanes changed to {}.".format(
+                                   self.node, partition, self.lanes))
+                continue
+            lsn = min(ChangeEventLSN.decode(json.loads(r["lsn"]))
+                      for r in group)
+            for lane in range(self.lanes):
+                lsns[(zone, partition, lane)] = lsn
+        return lsns
+
+    def _keys(self, event: ChangeEvent, lane: Optional[int]) -> List[Key]:
+        # lane 为 None 表示跨 lane 执行的事件，合并的跨分区事件记录到
+        # barrier 中的每个分区
+        lanes = range(self.lanes) if lane is None else [lane]
+        partitions = event.barrier or [event.partition]
+        return [(event.source_zone_id, p, i) for p in partitions
+                for i in lanes]
+
+    def is_applied(self, event: ChangeEvent, lane: Optional[int]) -> bool:
+        if event.event_type is EventType.SNAPSHOT:
+            # 全量数据没有顺序的位置
+            return False
+        for k in self._keys(event, lane):
+            lsn = self.lsns.get(k)
+            if lsn is None or not event.lsn <= lsn:
+                return False
+        return True
+
+    async def save(self, cur: Cursor, events: List[ChangeEvent],
+                   lane: Optional[int]) -> Dict[Key, ChangeEventLSN]:
+        """ 在应用事件的事务中写入水位，提交后调用 commit 更新内存 """
+        lsns: Dict[Key, ChangeEventLSN] = {}
+        for e in events:
+            if e.event_type is EventType.SNAPSHOT:
+                continue
+            for k in self._keys(e, lane):
+                if k not in lsns or lsns[k] < e.lsn:
+                    lsns[k] = e.lsn
+        await self._write(cur, lsns)
+        return lsns
+
+    async def _write(self, cur: Cursor, lsns: Dict[Key, ChangeEventLSN]):
+        if not lsns:
+            return
+        args = []
+        for (zone, partition, lane), lsn in sorted(lsns.items()):
+            args.extend([zone, self.node, partition, lane, self.lanes,
+                         _position(lsn), json.dumps(lsn.encode())])
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(lsns))
+        await cur.execute(_UPSERT_SQL.format(TABLE, values), args)
+
+    def commit(self, lsns: Dict[Key, ChangeEventLSN]):
+        for k, lsn in lsns.items():
+            if k not in self.lsns or self.lsns[k] < lsn:
+                self.lsns[k] = lsn
@@ -0,0 +1,53 @@
+"""
+JSON 和二进制格式的编解码速度和消息大小:
+
+    python -m benchmarks.bench_codec
+"""
+
+import time
+
+from typing import Any, Dict
+
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from common.codec import CODECS, encode, decode
+
+
+def new_event(columns: int, rows: int) -> ChangeEvent:
+    values = []
+    for r in range(rows):
+        v: Dict[str, Any] = {"id": r, "pidal_c": (1 << 53) | r << 1}
+        for c in range(columns):
+            if c % 3 == 0:
+                v["col_{}".format(c)] = r * c
+            elif c % 3 == 1:
+                v["col_{}".format(c)] = "value_{}_{}".format(r, c)
+            else:
+                v["col_{}".format(c)] = None
+        values.append({"values": v})
+    return ChangeEvent(ChangeEventLSN(0, 1, 1, 100),
+                       ChangeEventLSN(0, 1, 1, 200, 9), 1600000000,
+                       EventType.INSERT, 1, "db0", "test", "test_raw",
+                       values)
+
+
+def main():
+    for columns, rows in [(10, 1), (60, 1), (60, 20)]:
+        event = new_event(columns, rows)
+        for codec in CODECS:
+            data = encode(event, codec)
+            n = 2000
+            start = time.perf_counter()
+            for _ in range(n):
+                encode(event, codec)
+            enc = n / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(n):
+                decode(data)
+            dec = n / (time.perf_counter() - start)
+            print("columns {:3} rows {:3} {:6} size {:7} encode {:9.0f}/s "
+                  "decode {:9.0f}/s".format(columns, rows, codec, len(data),
+                                            enc, dec))
+
+
+if __name__ == "__main__":
+    main()
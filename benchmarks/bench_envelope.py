@@ -0,0 +1,27 @@
+"""
+不同压缩方式的信封大小:
+
+    python -m benchmarks.bench_envelope
+"""
+
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from mq.envelope import COMPRESSIONS, get_compression, pack
+
+
+def main():
+    values = []
+    for r in range(100):
+        e = ChangeEvent(None, ChangeEventLSN(0, 1, 1, r), 1600000000,
+                        EventType.INSERT, 1, "db0", "test", "test_raw",
+                        [{"values": {"id": r, "name": "name_{}".format(r),
+                                     "pidal_c": 1 << 53}}])
+        values.append(e.encode())
+    size = sum(len(v) for v in values)
+    for name in COMPRESSIONS.keys():
+        data = pack(values, get_compression(name))
+        print("compression {:5} events {} size {:6} -> {:6}".format(
+            name, len(values), size, len(data)))
+
+
+if __name__ == "__main__":
+    main()
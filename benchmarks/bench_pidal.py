@@ -0,0 +1,40 @@
+"""
+pidal_c 解码和旧的字符串切片实现对比:
+
+    python -m benchmarks.bench_pidal
+"""
+
+import random
+import time
+
+from common import pidal
+
+
+def legacy(pidal_c: int):
+    p = bin(pidal_c)
+    version = p[-21:-1]
+    meta_version = p[-53:-33]
+    return (pidal_c >> 53, int(meta_version, 2), int(version, 2),
+            not bool(pidal_c | 1))
+
+
+def main():
+    rnd = random.Random(0)
+    values = [pidal.encode(rnd.randint(1, 1023),
+                           rnd.randint(0, pidal.META_VERSION_MASK),
+                           rnd.randint(0, pidal.DATA_VERSION_MASK),
+                           rnd.random() < 0.5)
+              for _ in range(100000)]
+    for f in (legacy, pidal.decode):
+        start = time.perf_counter()
+        for v in values:
+            f(v)
+        print("{:7} {:.3f}s".format(f.__name__, time.perf_counter() - start))
+    start = time.perf_counter()
+    pidal.decode_batch(values)
+    print("batch   {:.3f}s (numpy: {})".format(time.perf_counter() - start,
+                                               pidal.numpy is not None))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+行归属 zone 的计算，旧实现、编译后的逐行计算和批量计算对比:
+
+    python -m benchmarks.bench_router
+"""
+
+import time
+
+from typing import Any, Dict
+
+from common.algorithms import Algorithm
+from common.router import Router, numpy
+from meta.model import DBTable
+
+
+def main():
+    t = DBTable(None, "t", None, ["uid"], "mod", [8], "PRIMARY", [])
+    zones = {i: i % 2 for i in range(8)}
+    rows = [{"uid": i, "name": "n"} for i in range(200000)]
+    legacy = {"zskeys": t.zskeys, "zs_algorithm": Algorithm.new("mod"),
+              "zs_algorithm_args": t.zs_algorithm_args}
+
+    def legacy_zone(values: Dict[str, Any]) -> int:
+        # 旧的实现，每行复制参数、调用 lambda、查字典
+        a = legacy
+        args = list(a["zs_algorithm_args"])
+        for i in a["zskeys"]:
+            args.append(values[i])
+        return zones[a["zs_algorithm"](*args)]
+
+    router = Router({"t_0": t}, zones)
+    start = time.perf_counter()
+    for r in rows:
+        legacy_zone(r)
+    print("legacy   {:.3f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+    for r in rows:
+        router.get_zone("t_0", r)
+    print("compiled {:.3f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+    router.get_zones("t_0", rows)
+    print("batch    {:.3f}s (numpy: {})".format(
+        time.perf_counter() - start, numpy is not None))
+
+
+if __name__ == "__main__":
+    main()
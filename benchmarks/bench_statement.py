@@ -0,0 +1,63 @@
+"""
+逐行 SQL 的生成，旧的字符串拼接和参数化模板对比:
+
+    python -m benchmarks.bench_statement
+"""
+
+import datetime
+import decimal
+import time
+
+from typing import Any, Dict, List
+
+from pymysql.converters import escape_item
+
+from apply.statement import Statement, select_for_update, insert, update
+
+LOCK_KEY = ["id"]
+
+
+def legacy(values: Dict[str, Any]) -> List[str]:
+    # 旧的实现，把每个值格式化成带引号的字符串
+    where = "AND".join(
+            [" `{}` = '{}' ".format(i, values[i]) for i in LOCK_KEY])
+    cl = ", ".join(["`{}`".format(c) for c in values.keys()])
+    va = ", ".join(["'{}'".format(c) for c in values.values()])
+    st = ",".join([" `{}` = '{}' ".format(k, v)
+                   for k, v in values.items()])
+    return ["SELECT * FROM {} WHERE {} FOR UPDATE".format("t", where),
+            "INSERT INTO {} ({}) VALUES ({})".format("t", cl, va),
+            "UPDATE {} set {} WHERE {}".format("t", st, where)]
+
+
+def bound(values: Dict[str, Any]) -> List[Statement]:
+    return [select_for_update("t", LOCK_KEY, values),
+            insert("t", values),
+            update("t", LOCK_KEY, values, values)]
+
+
+def escaped(values: Dict[str, Any]) -> List[str]:
+    # 包括驱动在客户端转义参数的开销
+    return [s % tuple(escape_item(a, "utf8") for a in args)
+            for s, args in bound(values)]
+
+
+def main():
+    rows = [{"id": i, "name": "name_{}".format(i), "age": i % 100,
+             "score": decimal.Decimal("12.34"), "memo": None,
+             "created": datetime.datetime(2020, 1, 1, 0, 0, i % 60),
+             "pidal_c": (1 << 53) | (i << 1)} for i in range(20000)]
+    for name, f in (("legacy", legacy), ("template", bound),
+                    ("template+escape", escaped)):
+        start = time.perf_counter()
+        for r in rows:
+            f(r)
+        cost = time.perf_counter() - start
+        print("{:16} {:6} rows {:.3f}s {:.2f}us/row".format(
+            name, len(rows), cost, cost / len(rows) * 1e6))
+    print("NULL legacy: {}".format(legacy(rows[0])[1]))
+    print("NULL bound:  {}".format(escaped(rows[0])[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import enum
 import json
+import time
 
 from typing import Any, Dict, List, Optional
 
+from pymysqlreplication.event import BinLogEvent
 from pymysqlreplication.row_event import RowsEvent
 
 
@@ -11,6 +13,9 @@ class EventType(enum.IntEnum):
     INSERT = 1
     UPDATE = 2
     DELETE = 3
+    TRANSACTION = 4
+    SNAPSHOT = 5
+    DDL = 6
 
 
 class ChangeEventLSN(object):
@@ -31,11 +36,19 @@ class ChangeEventLSN(object):
                 lsn.server_id == self.server_id and \
                 lsn.log_index == self.log_index and\
                 lsn.log_position == self.log_position and\
-                lsn.xid == lsn.xid:
+                lsn.xid == self.xid:
             return True
         else:
             return False
 
+    def __lt__(self, lsn: 'ChangeEventLSN') -> bool:
+        return (self.source_zone_change_no, self.log_index,
+                self.log_position) < (lsn.source_zone_change_no,
+                                      lsn.log_index, lsn.log_position)
+
+    def __le__(self, lsn: 'ChangeEventLSN') -> bool:
+        return self == lsn or self < lsn
+
     def encode(self) -> Dict[str, Any]:
         return vars(self)
 
@@ -52,12 +65,59 @@ class ChangeEvent(object):
     def new(cls, prev_lsn: Optional[ChangeEventLSN],
             source_zone_id: int, node: str, event: RowsEvent,
             event_type: EventType, log_index: int,
-            values: List[Dict[str, Dict[str, Any]]]) -> 'ChangeEvent':
+            values: List[Dict[str, Dict[str, Any]]],
+            compact: bool = False, partition: int = 0) -> 'ChangeEvent':
         lsn = ChangeEventLSN(0, event.packet.server_id, log_index,
                              event.packet.log_pos)
         e = cls(prev_lsn, lsn, event.timestamp, event_type, source_zone_id,
                 node, event.schema, event.table, values,
-                prev_lsn is None)
+                prev_lsn is None, compact=compact, partition=partition)
+        return e
+
+    @classmethod
+    def new_transaction(cls, prev_lsn: Optional[ChangeEventLSN],
+                        source_zone_id: int, node: str, event: BinLogEvent,
+                        log_index: int, xid: int,
+                        events: List['ChangeEvent'],
+                        partition: int = 0) -> 'ChangeEvent':
+        """
+        一个源端事务的所有行变更，apply 端需要在一个事务中提交。
+        """
+        lsn = ChangeEventLSN(0, event.packet.server_id, log_index,
+                             event.packet.log_pos, xid)
+        e = cls(prev_lsn, lsn, event.timestamp, EventType.TRANSACTION,
+                source_zone_id, node, events[0].db, "", [],
+                prev_lsn is None, events, partition=partition)
+        return e
+
+    @classmethod
+    def new_snapshot(cls, source_zone_id: int, node: str, server_id: int,
+                     log_index: int, log_position: int, db: str, table: str,
+                     values: List[Dict[str, Dict[str, Any]]],
+                     partition: int = 0) -> 'ChangeEvent':
+        """
+        全量同步的行，LSN 为全量开始时的 binlog 位置，不在 LSN 链中。
+        """
+        lsn = ChangeEventLSN(0, server_id, log_index, log_position)
+        e = cls(None, lsn, int(time.time()), EventType.SNAPSHOT,
+                source_zone_id, node, db, table, values, True,
+                partition=partition)
+        return e
+
+    @classmethod
+    def new_ddl(cls, prev_lsn: Optional[ChangeEventLSN], source_zone_id: int,
+                node: str, event: BinLogEvent, log_index: int, db: str,
+                table: str, partition: int = 0,
+                index: int = 0) -> 'ChangeEvent':
+        """
+        表结构变更，没有行数据，apply 端收到后刷新这个表的元数据。一条
+        语句修改多个表时(RENAME TABLE)，按 index 区分每个表的 LSN。
+        """
+        lsn = ChangeEventLSN(0, event.packet.server_id, log_index,
+                             event.packet.log_pos, index)
+        e = cls(prev_lsn, lsn, event.timestamp, EventType.DDL,
+                source_zone_id, node, db, table, [], prev_lsn is None,
+                partition=partition)
         return e
 
     def __init__(self,
@@ -70,7 +130,11 @@ class ChangeEvent(object):
                  db: str,
                  table: str,
                  values: List[Dict[str, Dict[str, Any]]],
-                 is_retry: bool = False):
+                 is_retry: bool = False,
+                 events: Optional[List['ChangeEvent']] = None,
+                 compact: bool = False,
+                 partition: int = 0,
+                 barrier: Optional[List[int]] = None):
         self.lsn = lsn
         self.prev_lsn = prev_lsn
         self.timestamp = timestamp
@@ -81,9 +145,21 @@ class ChangeEvent(object):
         self.table = table
         self.values = values
         self.is_retry = is_retry
+        self.events: List[ChangeEvent] = events or []
+        # UPDATE 只包含锁字段、zskeys、pidal_c 和修改过的字段
+        self.compact = compact
+        # 分区模式下每个分区有自己的 prev_lsn 链
+        self.partition = partition
+        # UPDATE 修改了分区字段时，事件在修改前后的分区中各有一个副本，
+        # apply 等所有分区的副本都到达后合并应用
+        self.barrier: List[int] = barrier or []
 
     def encode(self) -> bytes:
-        data = {}
+        j = json.dumps(self.to_dict())
+        return j.encode()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
         data["lsn"] = self.lsn.encode()
         if self.prev_lsn:
             data["prev_lsn"] = self.prev_lsn.encode()
@@ -97,16 +173,29 @@ class ChangeEvent(object):
         data["table"] = self.table
         data["values"] = self.values
         data["is_retry"] = self.is_retry
-        j = json.dumps(data)
-        return j.encode()
+        if self.events:
+            data["events"] = [i.to_dict() for i in self.events]
+        if self.compact:
+            data["compact"] = True
+        if self.partition:
+            data["partition"] = self.partition
+        if self.barrier:
+            data["barrier"] = self.barrier
+        return data
+
+    @classmethod
+    def decode(cls, data: str) -> 'ChangeEvent':
+        return cls.from_dict(json.loads(data))
 
     @classmethod
-    def decode(cls, data: str):
-        d = json.loads(data)
+    def from_dict(cls, d: Dict[str, Any]) -> 'ChangeEvent':
         prev_lsn = None
         if d["prev_lsn"]:
             prev_lsn = ChangeEventLSN.decode(d["prev_lsn"])
         lsn = ChangeEventLSN.decode(d["lsn"])
         return cls(prev_lsn, lsn, d["timestamp"], EventType(d["event_type"]),
                    d["source_zone_id"], d["node"], d["db"], d["table"],
-                   d["values"], d["is_retry"])
+                   d["values"], d["is_retry"],
+                   [cls.from_dict(i) for i in d.get("events", [])],
+                   d.get("compact", False), d.get("partition", 0),
+                   d.get("barrier"))
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, Optional
+
+from common.config import CheckpointConfig
+from common.logging import logger
+
+
+class CheckpointStore(object):
+    """
+    本地进度文件，写临时文件后原子替换。按照时间、事件数或字节数批量刷盘，
+    并在后台线程中把最新的进度同步到元数据服务。
+    """
+
+    _instance: Optional['CheckpointStore'] = None
+
+    @classmethod
+    def new(cls, conf: CheckpointConfig) -> 'CheckpointStore':
+        if cls._instance:
+            return cls._instance
+        c = cls(conf.path, conf.flush_interval, conf.flush_events,
+                conf.flush_bytes)
+        cls._instance = c
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls) -> 'CheckpointStore':
+        if not cls._instance:
+            raise Exception("Not yet initialized")
+        return cls._instance
+
+    def __init__(self, path: str, flush_interval: float, flush_events: int,
+                 flush_bytes: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.flush_bytes = flush_bytes
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程写文件，写文件时不持有 _lock
+        self._flush_lock = threading.Lock()
+        self._data: Dict[str, Any] = self._load()
+        # 每次修改加一，和已经写入文件的序号比较判断是否需要刷盘
+        self._seq = 0
+        self._flushed_seq = 0
+        self._events = 0
+        self._bytes = 0
+        self._last_flush = time.monotonic()
+
+        self._mirrors: Dict[str, Callable[[Any], None]] = {}
+        self._mirror_pending: Dict[str, Any] = {}
+        self._mirror_cond = threading.Condition()
+        self._mirror_thread: Optional[threading.Thread] = None
+
+    def _load(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._data.get(key)
+
+    def add_mirror(self, key: str, handler: Callable[[Any], None]):
+        """ key 的进度刷盘后异步调用 handler，用于同步到元数据服务 """
+        with self._mirror_cond:
+            self._mirrors[key] = handler
+            if self._mirror_thread is None:
+                self._mirror_thread = threading.Thread(
+                        target=self._mirror_loop, name="checkpoint-mirror",
+                        daemon=True)
+                self._mirror_thread.start()
+
+    def update(self, key: str, value: Any, events: int = 1, size: int = 0,
+               flush: bool = True):
+        """ flush 为 False 时只记录，由调用方在合适的时候刷盘 """
+        with self._lock:
+            if self._data.get(key) != value:
+                self._data[key] = value
+                self._seq += 1
+            self._events += events
+            self._bytes += size
+            need = flush and self._need_flush()
+        if need:
+            self.flush()
+
+    def is_flushed(self) -> bool:
+        """ 所有更新都已经写入文件 """
+        with self._lock:
+            return self._flushed_seq == self._seq
+
+    def need_flush(self) -> bool:
+        with self._lock:
+            return self._need_flush()
+
+    def maybe_flush(self):
+        if self.need_flush():
+            self.flush()
+
+    def flush(self):
+        """ 写入和 fsync 时不持有 _lock，刷盘期间可以继续更新进度 """
+        with self._flush_lock:
+            with self._lock:
+                self._events = 0
+                self._bytes = 0
+                self._last_flush = time.monotonic()
+                if self._flushed_seq == self._seq:
+                    return
+                seq = self._seq
+                data = json.dumps(self._data)
+                with self._mirror_cond:
+                    mirrored = {k: self._data[k] for k in self._mirrors
+                                if k in self._data}
+            self._write(data)
+            with self._lock:
+                self._flushed_seq = seq
+            if mirrored:
+                with self._mirror_cond:
+                    self._mirror_pending.update(mirrored)
+                    self._mirror_cond.notify()
+
+    def _need_flush(self) -> bool:
+        if self._flushed_seq == self._seq:
+            return False
+        if self.flush_events and self._events >= self.flush_events:
+            return True
+        if self.flush_bytes and self._bytes >= self.flush_bytes:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def _write(self, data: str):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._fsync_dir()
+
+    def _fsync_dir(self):
+        d = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd = os.open(d, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _mirror_loop(self):
+        while True:
+            with self._mirror_cond:
+                while not self._mirror_pending:
+                    self._mirror_cond.wait()
+                pending = self._mirror_pending
+                self._mirror_pending = {}
+                handlers = dict(self._mirrors)
+            for k, v in pending.items():
+                try:
+                    handlers[k](v)
+                except Exception as e:
+                    # 同步失败忽略，下次刷盘会再同步
+                    logger.warning("mirror checkpoint [{}] error: {}".format(
+                        k, e))
+
+    def close(self):
+        self.flush()
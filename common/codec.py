@@ -0,0 +1,580 @@
+"""
+ChangeEvent 的二进制格式(版本 1)，所有整数为小端:
+
+    magic(2) version(1) | header | dictionary | rows | events
+
+header: event_type(1) flags(1) lsn [prev_lsn] timestamp(8)
+        source_zone_id(4) node db table [partition] [barrier]
+    不需要解析行数据就可以读取，见 decode_header。
+dictionary: 字节长度 + 本条消息中用到的 (表, 字段列表)，每个只出现一次，
+    行数据通过序号引用，事务中的多个事件共用。
+rows: 每行若干个镜像(values/before_values/after_values)，
+    镜像为字典序号、类型签名(每个字段一个字节)、定长部分和变长部分，
+    同一签名的定长部分用一个 struct 编解码，原生支持 datetime、date、time、timedelta、Decimal、bytes、set 等
+    MySQL 类型。
+events: 事务中的子事件，每个子事件为 header + rows。
+
+JSON 格式以 "{" 开头，decode 根据 magic 自动识别两种格式。
+"""
+
+import datetime
+import decimal
+import json
+import operator
+import struct
+
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+
+
+MAGIC = b"PD"
+VERSION = 1
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+CODECS = (CODEC_JSON, CODEC_BINARY)
+
+_PREFIX = struct.Struct("<2sB")
+_HEAD = struct.Struct("<BB")
+_LSN = struct.Struct("<qqqqQ")
+_TAIL = struct.Struct("<qi")
+
+_FLAG_RETRY = 1
+_FLAG_PREV_LSN = 2
+_FLAG_COMPACT = 4
+_FLAG_PARTITION = 8
+_FLAG_BARRIER = 16
+
+_IMAGES = ("values", "before_values", "after_values")
+_IMAGE_IDS = {k: i for i, k in enumerate(_IMAGES)}
+
+_T_NONE = 0
+_T_TRUE = 1
+_T_FALSE = 2
+_T_INT = 3
+_T_BIGINT = 4
+_T_FLOAT = 5
+_T_STR = 6
+_T_BYTES = 7
+_T_DECIMAL = 8
+_T_DATETIME = 9
+_T_DATE = 10
+_T_TIMEDELTA = 11
+_T_TIME = 12
+_T_JSON = 13
+_T_SET = 14
+
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+# 每种类型在定长部分的格式，变长的值在定长部分只记录长度
+_FORMATS = {
+    _T_NONE: "",
+    _T_TRUE: "",
+    _T_FALSE: "",
+    _T_INT: "q",
+    _T_BIGINT: "I",
+    _T_FLOAT: "d",
+    _T_STR: "I",
+    _T_BYTES: "I",
+    _T_DECIMAL: "I",
+    _T_DATETIME: "HBBBBBI",
+    _T_DATE: "HBB",
+    _T_TIMEDELTA: "iii",
+    _T_TIME: "BBBI",
+    _T_JSON: "I",
+    _T_SET: "I",
+}
+
+_TYPE_TAGS: Dict[type, int] = {
+    type(None): _T_NONE,
+    int: _T_INT,
+    float: _T_FLOAT,
+    str: _T_STR,
+    bytes: _T_BYTES,
+    bytearray: _T_BYTES,
+    decimal.Decimal: _T_DECIMAL,
+    datetime.datetime: _T_DATETIME,
+    datetime.date: _T_DATE,
+    datetime.timedelta: _T_TIMEDELTA,
+    datetime.time: _T_TIME,
+    dict: _T_JSON,
+    list: _T_JSON,
+    set: _T_SET,
+    frozenset: _T_SET,
+}
+
+# 只有这些类型的签名使用快速路径，定长部分每个字段最多一个值
+_SIMPLE = (_T_NONE, _T_TRUE, _T_FALSE, _T_INT, _T_FLOAT, _T_STR)
+
+
+def _getter(indexes: List[int]) -> Callable[[List[Any]], Tuple[Any, ...]]:
+    """ 按下标取多个值，总是返回元组 """
+    if not indexes:
+        return lambda values: ()
+    if len(indexes) == 1:
+        i = indexes[0]
+        return lambda values: (values[i],)
+    return operator.itemgetter(*indexes)
+
+
+class _Plan(object):
+    """
+    一个类型签名的编解码方式。签名中只有整数、浮点、字符串、NULL 和
+    bool 时(宽表中最常见)，用 itemgetter 整行取值，不再逐个字段判断类型。
+    """
+
+    __slots__ = ("struct", "simple", "get_strs", "get_args", "get_lens",
+                 "get_values")
+
+    def __init__(self, sig: bytes):
+        try:
+            self.struct = struct.Struct(
+                    "<" + "".join(_FORMATS[t] for t in sig))
+        except KeyError:
+            raise Exception("unknown value type in [{}].".format(sig.hex()))
+        self.simple = all(t in _SIMPLE for t in sig)
+        if not self.simple:
+            return
+        n = len(sig)
+        strs = [i for i, t in enumerate(sig) if t == _T_STR]
+        fixed = [i for i, t in enumerate(sig)
+                 if t in (_T_INT, _T_FLOAT, _T_STR)]
+        self.get_strs = _getter(strs)
+        # 编码: 从 values + 字符串的字节长度中取定长部分
+        self.get_args = _getter([n + strs.index(i) if sig[i] == _T_STR
+                                 else i for i in fixed])
+        # 解码: 从定长部分 + 字符串 + (None, True, False) 中取每个字段
+        self.get_lens = _getter([fixed.index(i) for i in strs])
+        consts = len(fixed) + len(strs)
+        source = []
+        for i, t in enumerate(sig):
+            if t == _T_STR:
+                source.append(len(fixed) + strs.index(i))
+            elif i in fixed:
+                source.append(fixed.index(i))
+            else:
+                source.append(consts + (_T_NONE, _T_TRUE, _T_FALSE).index(t))
+        self.get_values = _getter(source)
+
+
+# 类型签名到 _Plan 的缓存，同一张表的行通常签名相同。字典的缓存也用这个上限
+_PLANS: Dict[bytes, _Plan] = {}
+# 字段的 Python 类型到签名
+_SIGS: Dict[Tuple[type, ...], bytes] = {}
+_MAX_PLANS = 4096
+
+
+def _write_varint(out: bytearray, v: int):
+    while v > 0x7f:
+        out.append((v & 0x7f) | 0x80)
+        v >>= 7
+    out.append(v)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_str(out: bytearray, v: str):
+    b = v.encode()
+    _write_varint(out, len(b))
+    out += b
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    n, pos = _read_varint(data, pos)
+    return data[pos:pos + n].decode(), pos + n
+
+
+def _plan(sig: bytes) -> _Plan:
+    p = _PLANS.get(sig)
+    if p is None:
+        p = _Plan(sig)
+        _cache(_PLANS, sig, p)
+    return p
+
+
+def _tag(v: Any) -> int:
+    t = type(v)
+    if t is bool:
+        return _T_TRUE if v else _T_FALSE
+    if t is int and not _INT_MIN <= v <= _INT_MAX:
+        return _T_BIGINT
+    tag = _TYPE_TAGS.get(t)
+    if tag is None:
+        raise Exception("unsupported value type [{}].".format(t))
+    return tag
+
+
+def _write_values(out: bytearray, values: List[Any]):
+    """ 类型签名(每个字段一个字节) + 定长部分 + 变长部分 """
+    types = tuple(map(type, values))
+    sig = _SIGS.get(types)
+    if sig is None:
+        try:
+            sig = bytes(map(_TYPE_TAGS.__getitem__, types))
+            _cache(_SIGS, types, sig)
+        except KeyError:
+            # bool 等需要逐个判断，签名和值有关，不缓存
+            sig = bytes([_tag(v) for v in values])
+    try:
+        plan = _plan(sig)
+        if plan.simple:
+            _pack_simple(out, sig, plan, values)
+        else:
+            _pack_values(out, sig, values)
+    except struct.error:
+        # 超出 64 位的整数
+        _pack_values(out, bytes([_tag(v) for v in values]), values)
+
+
+def _pack_simple(out: bytearray, sig: bytes, plan: _Plan, values: List[Any]):
+    var = list(map(str.encode, plan.get_strs(values)))
+    fixed = plan.struct.pack(*plan.get_args([*values, *map(len, var)]))
+    out += sig
+    out += fixed
+    out += b"".join(var)
+
+
+def _pack_values(out: bytearray, sig: bytes, values: List[Any]):
+    args: List[Any] = []
+    var: List[bytes] = []
+    for t, v in zip(sig, values):
+        if t == _T_INT or t == _T_FLOAT:
+            args.append(v)
+        elif t == _T_STR:
+            b = v.encode()
+            args.append(len(b))
+            var.append(b)
+        elif t <= _T_FALSE:
+            pass
+        elif t == _T_DATETIME:
+            args += (v.year, v.month, v.day, v.hour, v.minute, v.second,
+                     v.microsecond)
+        elif t == _T_DECIMAL or t == _T_BIGINT:
+            b = str(v).encode()
+            args.append(len(b))
+            var.append(b)
+        elif t == _T_BYTES:
+            args.append(len(v))
+            var.append(bytes(v))
+        elif t == _T_DATE:
+            args += (v.year, v.month, v.day)
+        elif t == _T_TIMEDELTA:
+            args += (v.days, v.seconds, v.microseconds)
+        elif t == _T_TIME:
+            args += (v.hour, v.minute, v.second, v.microsecond)
+        elif t == _T_JSON:
+            b = json.dumps(v).encode()
+            args.append(len(b))
+            var.append(b)
+        else:
+            # MySQL SET 的成员不能包含逗号
+            b = ",".join(sorted(v)).encode()
+            args.append(len(b))
+            var.append(b)
+    fixed = _plan(sig).struct.pack(*args)
+    out += sig
+    out += fixed
+    out += b"".join(var)
+
+
+def _read_values(data: bytes, pos: int,
+                 n: int) -> Tuple[Sequence[Any], int]:
+    sig = data[pos:pos + n]
+    pos += n
+    plan = _plan(sig)
+    s = plan.struct
+    fixed = s.unpack_from(data, pos)
+    pos += s.size
+    if plan.simple:
+        return _unpack_simple(data, pos, plan, fixed)
+    values: List[Any] = []
+    j = 0
+    for t in sig:
+        if t == _T_INT or t == _T_FLOAT:
+            values.append(fixed[j])
+            j += 1
+        elif t == _T_STR:
+            e = pos + fixed[j]
+            values.append(data[pos:e].decode())
+            pos = e
+            j += 1
+        elif t == _T_NONE:
+            values.append(None)
+        elif t == _T_DATETIME:
+            values.append(datetime.datetime(*fixed[j:j + 7]))
+            j += 7
+        elif t == _T_DECIMAL:
+            e = pos + fixed[j]
+            values.append(decimal.Decimal(data[pos:e].decode()))
+            pos = e
+            j += 1
+        elif t == _T_TRUE:
+            values.append(True)
+        elif t == _T_FALSE:
+            values.append(False)
+        elif t == _T_BYTES:
+            e = pos + fixed[j]
+            values.append(data[pos:e])
+            pos = e
+            j += 1
+        elif t == _T_DATE:
+            values.append(datetime.date(*fixed[j:j + 3]))
+            j += 3
+        elif t == _T_TIMEDELTA:
+            values.append(datetime.timedelta(fixed[j], fixed[j + 1],
+                                             fixed[j + 2]))
+            j += 3
+        elif t == _T_TIME:
+            values.append(datetime.time(*fixed[j:j + 4]))
+            j += 4
+        else:
+            e = pos + fixed[j]
+            s_value = data[pos:e].decode()
+            pos = e
+            j += 1
+            if t == _T_BIGINT:
+                values.append(int(s_value))
+            elif t == _T_JSON:
+                values.append(json.loads(s_value))
+            else:
+                values.append(set(s_value.split(",")) if s_value else set())
+    return values, pos
+
+
+def _unpack_simple(data: bytes, pos: int, plan: _Plan,
+                   fixed: Tuple[Any, ...]) -> Tuple[Sequence[Any], int]:
+    strs = []
+    for n in plan.get_lens(fixed):
+        e = pos + n
+        strs.append(data[pos:e].decode())
+        pos = e
+    return plan.get_values((*fixed, *strs, None, True, False)), pos
+
+
+class _Dictionary(object):
+    """ 一条消息内的 (表, 字段列表) 字典 """
+
+    def __init__(self):
+        self.ids: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        self.entries: List[Tuple[str, Tuple[str, ...]]] = []
+
+    def get_id(self, table: str, columns: Tuple[str, ...]) -> int:
+        key = (table, columns)
+        i = self.ids.get(key)
+        if i is None:
+            i = len(self.entries)
+            self.ids[key] = i
+            self.entries.append(key)
+        return i
+
+    def write(self, out: bytearray):
+        """ 字典前面加上字节长度，解码时按原始字节缓存解析结果 """
+        key = tuple(self.entries)
+        b = _DICTIONARIES.get(key)
+        if b is None:
+            buf = bytearray()
+            _write_varint(buf, len(self.entries))
+            for table, columns in self.entries:
+                _write_str(buf, table)
+                _write_varint(buf, len(columns))
+                for c in columns:
+                    _write_str(buf, c)
+            b = bytes(buf)
+            _cache(_DICTIONARIES, key, b)
+        _write_varint(out, len(b))
+        out += b
+
+    @staticmethod
+    def read(data: bytes, pos: int) \
+            -> Tuple[List[Tuple[str, ...]], int]:
+        size, pos = _read_varint(data, pos)
+        end = pos + size
+        raw = data[pos:end]
+        entries = _ENTRIES.get(raw)
+        if entries is None:
+            entries = []
+            n, p = _read_varint(raw, 0)
+            for _ in range(n):
+                _, p = _read_str(raw, p)
+                nc, p = _read_varint(raw, p)
+                columns = []
+                for _ in range(nc):
+                    c, p = _read_str(raw, p)
+                    columns.append(c)
+                entries.append(tuple(columns))
+            _cache(_ENTRIES, raw, entries)
+        return entries, end
+
+
+_DICTIONARIES: Dict[Tuple[Tuple[str, Tuple[str, ...]], ...], bytes] = {}
+_ENTRIES: Dict[bytes, List[Tuple[str, ...]]] = {}
+
+
+def _cache(cache: Dict[Any, Any], key: Any, value: Any):
+    if len(cache) >= _MAX_PLANS:
+        cache.clear()
+    cache[key] = value
+
+
+def _write_lsn(out: bytearray, lsn: ChangeEventLSN):
+    out += _LSN.pack(lsn.source_zone_change_no, lsn.server_id,
+                     lsn.log_index, lsn.log_position, lsn.xid)
+
+
+def _read_lsn(data: bytes, pos: int) -> Tuple[ChangeEventLSN, int]:
+    return ChangeEventLSN(*_LSN.unpack_from(data, pos)), pos + _LSN.size
+
+
+def _write_header(out: bytearray, event: ChangeEvent):
+    flags = 0
+    if event.is_retry:
+        flags |= _FLAG_RETRY
+    if event.prev_lsn:
+        flags |= _FLAG_PREV_LSN
+    if event.compact:
+        flags |= _FLAG_COMPACT
+    if event.partition:
+        flags |= _FLAG_PARTITION
+    if event.barrier:
+        flags |= _FLAG_BARRIER
+    out += _HEAD.pack(event.event_type.value, flags)
+    _write_lsn(out, event.lsn)
+    if event.prev_lsn:
+        _write_lsn(out, event.prev_lsn)
+    out += _TAIL.pack(event.timestamp, event.source_zone_id)
+    _write_str(out, event.node)
+    _write_str(out, event.db)
+    _write_str(out, event.table)
+    if event.partition:
+        _write_varint(out, event.partition)
+    if event.barrier:
+        _write_varint(out, len(event.barrier))
+        for i in event.barrier:
+            _write_varint(out, i)
+
+
+def _read_header(data: bytes, pos: int) -> Tuple[ChangeEvent, int]:
+    event_type, flags = _HEAD.unpack_from(data, pos)
+    pos += _HEAD.size
+    lsn, pos = _read_lsn(data, pos)
+    prev_lsn = None
+    if flags & _FLAG_PREV_LSN:
+        prev_lsn, pos = _read_lsn(data, pos)
+    timestamp, source_zone_id = _TAIL.unpack_from(data, pos)
+    pos += _TAIL.size
+    node, pos = _read_str(data, pos)
+    db, pos = _read_str(data, pos)
+    table, pos = _read_str(data, pos)
+    partition = 0
+    if flags & _FLAG_PARTITION:
+        partition, pos = _read_varint(data, pos)
+    barrier = []
+    if flags & _FLAG_BARRIER:
+        n, pos = _read_varint(data, pos)
+        for _ in range(n):
+            i, pos = _read_varint(data, pos)
+            barrier.append(i)
+    e = ChangeEvent(prev_lsn, lsn, timestamp, EventType(event_type),
+                    source_zone_id, node, db, table, [],
+                    bool(flags & _FLAG_RETRY),
+                    compact=bool(flags & _FLAG_COMPACT),
+                    partition=partition, barrier=barrier)
+    return e, pos
+
+
+def _write_rows(out: bytearray, event: ChangeEvent, dictionary: _Dictionary):
+    _write_varint(out, len(event.values))
+    for row in event.values:
+        out.append(len(row))
+        for k, image in row.items():
+            columns = tuple(image.keys())
+            out.append(_IMAGE_IDS[k])
+            _write_varint(out, dictionary.get_id(event.table, columns))
+            _write_values(out, list(image.values()))
+
+
+def _read_rows(data: bytes, pos: int, event: ChangeEvent,
+               dictionary: List[Tuple[str, ...]]) -> int:
+    n, pos = _read_varint(data, pos)
+    values = []
+    for _ in range(n):
+        row = {}
+        images = data[pos]
+        pos += 1
+        for _ in range(images):
+            kind = data[pos]
+            pos += 1
+            d, pos = _read_varint(data, pos)
+            columns = dictionary[d]
+            v, pos = _read_values(data, pos, len(columns))
+            row[_IMAGES[kind]] = dict(zip(columns, v))
+        values.append(row)
+    event.values = values
+    return pos
+
+
+def encode(event: ChangeEvent, codec: str = CODEC_JSON) -> bytes:
+    if codec == CODEC_JSON:
+        return event.encode()
+    if codec != CODEC_BINARY:
+        raise Exception("unknown codec [{}].".format(codec))
+    head = bytearray(_PREFIX.pack(MAGIC, VERSION))
+    _write_header(head, event)
+    dictionary = _Dictionary()
+    body = bytearray()
+    _write_rows(body, event, dictionary)
+    _write_varint(body, len(event.events))
+    for e in event.events:
+        _write_header(body, e)
+        _write_rows(body, e, dictionary)
+    dictionary.write(head)
+    return bytes(head + body)
+
+
+def is_binary(data: bytes) -> bool:
+    return data[:2] == MAGIC
+
+
+def decode_header(data: bytes) -> ChangeEvent:
+    """
+    二进制格式只解析事件头，values 和 events 为空；JSON 格式无法只解析头部，
+    返回完整的事件。
+    """
+    if not is_binary(data):
+        return ChangeEvent.decode(data.decode())
+    event, _ = _decode_header(data)
+    return event
+
+
+def _decode_header(data: bytes) -> Tuple[ChangeEvent, int]:
+    _, version = _PREFIX.unpack_from(data, 0)
+    if version != VERSION:
+        raise Exception("unsupported codec version [{}].".format(version))
+    return _read_header(data, _PREFIX.size)
+
+
+def decode(data: bytes) -> ChangeEvent:
+    if not is_binary(data):
+        return ChangeEvent.decode(data.decode())
+    event, pos = _decode_header(data)
+    dictionary, pos = _Dictionary.read(data, pos)
+    pos = _read_rows(data, pos, event, dictionary)
+    n, pos = _read_varint(data, pos)
+    for _ in range(n):
+        e, pos = _read_header(data, pos)
+        pos = _read_rows(data, pos, e, dictionary)
+        event.events.append(e)
+    return event
+
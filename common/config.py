@@ -12,13 +12,16 @@ class Config(object):
 
     _instance: Optional['Config'] = None
 
-    def __init__(self, current_zone_id: int, node: str, server_id: int):
+    def __init__(self, current_zone_id: int, node: Union[str, List[str]],
+                 server_id: int):
         self.current_zone_id: int = int(current_zone_id)
+        # replicator 可以处理多个节点，节点依次使用 server_id, server_id + 1...
         self.node = node
         self.server_id = server_id
 
     @classmethod
-    def new(cls, current_zone_id: int, node: str, server_id: int):
+    def new(cls, current_zone_id: int, node: Union[str, List[str]],
+            server_id: int):
         if cls._instance:
             del(cls._instance)
         c = cls(current_zone_id, node, server_id)
@@ -45,17 +48,21 @@ class MetaService(object):
 
     def __init__(self,
                  servers: List[Tuple[str, int]],
-                 wait_timeout: int):
+                 wait_timeout: int,
+                 retain_versions: int = 8):
         self.servers: List[Tuple[str, int]] = servers
         self.wait_timeout: int = wait_timeout
+        # 内存中保留的最新元数据版本数，正在使用的版本不清理
+        self.retain_versions: int = max(int(retain_versions), 1)
 
     @classmethod
     def new(cls,
             servers: List[Tuple[str, int]],
-            wait_timeout: int) -> 'MetaService':
+            wait_timeout: int,
+            retain_versions: int = 8) -> 'MetaService':
         if cls._instance:
             return cls._instance
-        c = cls(servers, wait_timeout)
+        c = cls(servers, wait_timeout, retain_versions)
         cls._instance = c
         return cls._instance
 
@@ -107,12 +114,21 @@ class MQConfig(object):
 
     @classmethod
     def new(cls, type: str, bootstrap_servers: str, client_id: str,
-            topic: str, group_id: str, auto_commit_interval_ms: int = 50,
-            acks: Union[str, int] = 1, timeout: int = 50) -> 'MQConfig':
+            topic: str, group_id: str, auto_commit_interval_ms: int = 5000,
+            acks: Union[str, int] = 1, timeout: int = 50,
+            max_in_flight: int = 1, linger_ms: int = 0,
+            batch_size: int = 16384, envelope_max_events: int = 0,
+            envelope_max_bytes: int = 1048576, envelope_linger_ms: int = 10,
+            compression: str = "none", prefetch: int = 4,
+            max_poll_records: int = 500,
+            commit_messages: int = 10000) -> 'MQConfig':
         if cls._instance:
             return cls._instance
         m = cls(type, bootstrap_servers, client_id, topic, group_id,
-                auto_commit_interval_ms, acks, timeout)
+                auto_commit_interval_ms, acks, timeout, max_in_flight,
+                linger_ms, batch_size, envelope_max_events,
+                envelope_max_bytes, envelope_linger_ms, compression, prefetch,
+                max_poll_records, commit_messages)
         cls._instance = m
         return cls._instance
 
@@ -123,8 +139,15 @@ class MQConfig(object):
         return cls._instance
 
     def __init__(self, type: str, bootstrap_servers: str, client_id: str,
-                 topic: str, group_id: str, auto_commit_interval_ms: int = 50,
-                 acks: Union[str, int] = 1, timeout: int = 50):
+                 topic: str, group_id: str,
+                 auto_commit_interval_ms: int = 5000,
+                 acks: Union[str, int] = 1, timeout: int = 50,
+                 max_in_flight: int = 1, linger_ms: int = 0,
+                 batch_size: int = 16384, envelope_max_events: int = 0,
+                 envelope_max_bytes: int = 1048576,
+                 envelope_linger_ms: int = 10, compression: str = "none",
+                 prefetch: int = 4, max_poll_records: int = 500,
+                 commit_messages: int = 10000):
         self.type = type
         self.bootstrap_servers = bootstrap_servers
         self.client_id = client_id
@@ -132,7 +155,229 @@ class MQConfig(object):
         self.topic = topic
         self.acks = acks
         self.timeout = timeout
+        # consumer 提交已应用 offset 的间隔和消息数，先到者触发
         self.auto_commit_interval_ms = auto_commit_interval_ms
+        self.commit_messages = commit_messages
+        # 未确认消息的上限，1 表示每条消息都等待 broker 确认
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.linger_ms = linger_ms
+        self.batch_size = batch_size
+        # 多条消息打包成一条(信封)，条数小于 2 表示不打包
+        self.envelope_max_events = envelope_max_events
+        self.envelope_max_bytes = envelope_max_bytes
+        self.envelope_linger_ms = envelope_linger_ms
+        if self.envelope_max_events > 1 and \
+                self.max_in_flight < self.envelope_max_events:
+            # 窗口满时信封还没有攒够，只能等攒批超时
+            raise Exception("max_in_flight [{}] is less than "
+                            "envelope_max_events [{}].".format(
+                                self.max_in_flight, self.envelope_max_events))
+        # 信封压缩：none/zlib/lz4/zstd
+        self.compression = compression
+        # consumer 后台线程预取的批数，每批最多 max_poll_records 条
+        self.prefetch = max(int(prefetch), 1)
+        self.max_poll_records = max(int(max_poll_records), 1)
+
+
+class ReplicatorConfig(object):
+    """
+    单例，不能被修改
+    """
+
+    _instance: Optional['ReplicatorConfig'] = None
+
+    def __init__(self, transaction_group: bool = True, blocking: bool = True,
+                 heartbeat_period: float = 10, reconnect_interval: float = 5,
+                 gtid: bool = False, pipeline: bool = False,
+                 encoder_workers: int = 4, encoder_type: str = "thread",
+                 queue_size: int = 1000, stats_interval: float = 60,
+                 update_format: str = "full", codec: str = "json",
+                 partition_by: str = "table", partitions: int = 1):
+        # 按照 binlog 中的事务边界把多个 RowsEvent 合并成一条消息
+        self.transaction_group: bool = transaction_group
+        # 持续读取 binlog，不在读到末尾时退出
+        self.blocking: bool = blocking
+        # 主库心跳间隔，单位秒，0 表示不开启
+        self.heartbeat_period: float = heartbeat_period
+        self.reconnect_interval: float = reconnect_interval
+        # 使用 GTID 集合定位，否则使用 binlog 文件和位置
+        self.gtid: bool = gtid
+        # 分段流水线：读取、编码(thread/process)、按序发送
+        self.pipeline: bool = pipeline
+        self.encoder_workers: int = encoder_workers
+        self.encoder_type: str = encoder_type
+        self.queue_size: int = queue_size
+        # 流水线状态日志的输出间隔，单位秒，0 表示不输出
+        self.stats_interval: float = stats_interval
+        # UPDATE 事件格式：full 为完整的前后镜像，compact 只包含锁字段、
+        # zskeys、pidal_c 和修改过的字段
+        if update_format not in ("full", "compact"):
+            raise Exception("unknown update_format [{}].".format(
+                update_format))
+        self.update_format: str = update_format
+        # 消息格式：json 或 binary，apply 根据消息头自动识别
+        if codec not in ("json", "binary"):
+            raise Exception("unknown codec [{}].".format(codec))
+        self.codec: str = codec
+        # 分区方式：table 按表名作为 key，全部事件一条 LSN 链；lock_key/zsid
+        # 按行 hash 到 partitions 个分区，每个分区一条 LSN 链
+        if partition_by not in ("table", "lock_key", "zsid"):
+            raise Exception("unknown partition_by [{}].".format(partition_by))
+        self.partition_by: str = partition_by
+        self.partitions: int = max(int(partitions), 1)
+
+    @classmethod
+    def new(cls, transaction_group: bool = True, blocking: bool = True,
+            heartbeat_period: float = 10, reconnect_interval: float = 5,
+            gtid: bool = False, pipeline: bool = False,
+            encoder_workers: int = 4, encoder_type: str = "thread",
+            queue_size: int = 1000, stats_interval: float = 60,
+            update_format: str = "full", codec: str = "json",
+            partition_by: str = "table",
+            partitions: int = 1) -> 'ReplicatorConfig':
+        if cls._instance:
+            return cls._instance
+        c = cls(transaction_group, blocking, heartbeat_period,
+                reconnect_interval, gtid, pipeline, encoder_workers,
+                encoder_type, queue_size, stats_interval, update_format,
+                codec, partition_by, partitions)
+        cls._instance = c
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls) -> 'ReplicatorConfig':
+        if not cls._instance:
+            raise Exception("Not yet initialized")
+        return cls._instance
+
+
+class CheckpointConfig(object):
+    """
+    单例，不能被修改
+    """
+
+    _instance: Optional['CheckpointConfig'] = None
+
+    def __init__(self, path: str = "./checkpoint.json",
+                 flush_interval: float = 1, flush_events: int = 10000,
+                 flush_bytes: int = 4 * 1024 * 1024):
+        self.path: str = path
+        # 满足任意一个条件就刷盘，时间单位秒，0 表示不按该条件刷盘
+        self.flush_interval: float = flush_interval
+        self.flush_events: int = flush_events
+        self.flush_bytes: int = flush_bytes
+
+    @classmethod
+    def new(cls, path: str = "./checkpoint.json", flush_interval: float = 1,
+            flush_events: int = 10000,
+            flush_bytes: int = 4 * 1024 * 1024) -> 'CheckpointConfig':
+        if cls._instance:
+            return cls._instance
+        c = cls(path, flush_interval, flush_events, flush_bytes)
+        cls._instance = c
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls) -> 'CheckpointConfig':
+        if not cls._instance:
+            raise Exception("Not yet initialized")
+        return cls._instance
+
+
+class SnapshotConfig(object):
+    """
+    单例，不能被修改
+    """
+
+    _instance: Optional['SnapshotConfig'] = None
+
+    def __init__(self, enable: bool = False, parallelism: int = 4,
+                 chunk_size: int = 10000, fetch_size: int = 1000,
+                 max_rows_per_second: int = 0, lock: bool = True):
+        # 没有同步进度时先做全量同步，完成后从全量开始时的 binlog 位置继续
+        self.enable: bool = enable
+        # 同时读取的连接数
+        self.parallelism: int = max(int(parallelism), 1)
+        # 按主键分页读取，每页的行数，每页确认后记录进度
+        self.chunk_size: int = max(int(chunk_size), 1)
+        # 每次从流式游标中读取并发送的行数
+        self.fetch_size: int = max(int(fetch_size), 1)
+        # 限速，所有连接合计每秒的行数，0 表示不限速
+        self.max_rows_per_second: int = max_rows_per_second
+        # 使用 FLUSH TABLES WITH READ LOCK 对齐多个连接的快照和 binlog 位置
+        self.lock: bool = lock
+
+    @classmethod
+    def new(cls, enable: bool = False, parallelism: int = 4,
+            chunk_size: int = 10000, fetch_size: int = 1000,
+            max_rows_per_second: int = 0,
+            lock: bool = True) -> 'SnapshotConfig':
+        if cls._instance:
+            return cls._instance
+        c = cls(enable, parallelism, chunk_size, fetch_size,
+                max_rows_per_second, lock)
+        cls._instance = c
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls) -> 'SnapshotConfig':
+        if not cls._instance:
+            raise Exception("Not yet initialized")
+        return cls._instance
+
+
+class ApplyConfig(object):
+    """
+    单例，不能被修改
+    """
+
+    _instance: Optional['ApplyConfig'] = None
+
+    def __init__(self, bulk: bool = False, bulk_batch_rows: int = 1000,
+                 bulk_lag: float = 60, batch_size: int = 1,
+                 batch_wait: float = 0.1, lanes: int = 1,
+                 lane_queue_size: int = 1000, watermark: bool = False,
+                 schema_cache: str = "./schema_cache.json"):
+        # 全量和落后较多的 INSERT 使用多行 INSERT ... ON DUPLICATE KEY
+        # UPDATE 写入，按数据版本覆盖，不逐行检查冲突
+        self.bulk: bool = bulk
+        # 每条 SQL 的最大行数
+        self.bulk_batch_rows: int = max(int(bulk_batch_rows), 1)
+        # 事件落后超过多少秒时 INSERT 使用批量写入，追上后恢复逐行写入
+        self.bulk_lag: float = bulk_lag
+        # 最多 batch_size 条消息在一个事务中提交，按表批量锁定、读取，
+        # 在内存中检查冲突后写入净变化，1 表示每条消息一个事务
+        self.batch_size: int = max(int(batch_size), 1)
+        # 攒批的最长等待时间，单位秒
+        self.batch_wait: float = batch_wait
+        # 按表和锁字段 hash 到多个 lane 并行应用，每个 lane 使用连接池中的
+        # 一个连接，大于 1 时 batch_size 不生效
+        self.lanes: int = max(int(lanes), 1)
+        self.lane_queue_size: int = max(int(lane_queue_size), 1)
+        # 在目标库的 pidal_apply_watermark 表中和数据一起记录应用位置，
+        # 重复消费时不超过水位的事件直接跳过
+        self.watermark: bool = watermark
+        # 锁字段的本地缓存文件，空字符串表示只在内存中缓存
+        self.schema_cache: str = schema_cache
+
+    @classmethod
+    def new(cls, bulk: bool = False, bulk_batch_rows: int = 1000,
+            bulk_lag: float = 60, batch_size: int = 1,
+            batch_wait: float = 0.1, lanes: int = 1,
+            lane_queue_size: int = 1000, watermark: bool = False,
+            schema_cache: str = "./schema_cache.json") -> 'ApplyConfig':
+        if cls._instance:
+            return cls._instance
+        c = cls(bulk, bulk_batch_rows, bulk_lag, batch_size, batch_wait,
+                lanes, lane_queue_size, watermark, schema_cache)
+        cls._instance = c
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls) -> 'ApplyConfig':
+        if not cls._instance:
+            raise Exception("Not yet initialized")
+        return cls._instance
 
 
 def parser_config(zone_id: int, file: str):
@@ -172,8 +417,14 @@ def parser_config(zone_id: int, file: str):
             servers.append((i["host"], i["port"]))
 
         MetaService.new(servers,
-                        config["base"]["meta_service"]["wait_timeout"])
+                        config["base"]["meta_service"]["wait_timeout"],
+                        config["base"]["meta_service"].get(
+                            "retain_versions", 8))
         MQConfig.new(**config["mq"])
+        ReplicatorConfig.new(**config.get("replicator", {}))
+        CheckpointConfig.new(**config.get("checkpoint", {}))
+        SnapshotConfig.new(**config.get("snapshot", {}))
+        ApplyConfig.new(**config.get("apply", {}))
 
 
 def _get_zone_id(zone_id: int, conf: MutableMapping[str, Any]) -> int:
@@ -0,0 +1,86 @@
+"""
+pidal_c 控制字段的位布局:
+
+    63..53 源 zone | 52..33 元数据版本 | 32..21 保留 | 20..1 数据版本 |
+    0 锁标记
+"""
+
+from typing import List, NamedTuple, Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ZONE_SHIFT = 53
+META_VERSION_SHIFT = 33
+META_VERSION_MASK = 0xFFFFF
+DATA_VERSION_SHIFT = 1
+DATA_VERSION_MASK = 0xFFFFF
+LOCK_MASK = 1
+
+
+class PidalC(NamedTuple):
+    zone_id: int
+    meta_version: int
+    data_version: int
+    is_lock: bool
+
+
+def decode(value: int) -> PidalC:
+    return PidalC(value >> ZONE_SHIFT,
+                  (value >> META_VERSION_SHIFT) & META_VERSION_MASK,
+                  (value >> DATA_VERSION_SHIFT) & DATA_VERSION_MASK,
+                  bool(value & LOCK_MASK))
+
+
+def encode(zone_id: int, meta_version: int, data_version: int,
+           is_lock: bool = False) -> int:
+    if meta_version & ~META_VERSION_MASK or \
+            data_version & ~DATA_VERSION_MASK:
+        raise Exception("pidal_c version out of range [{}, {}].".format(
+            meta_version, data_version))
+    return (zone_id << ZONE_SHIFT) | \
+        (meta_version << META_VERSION_SHIFT) | \
+        (data_version << DATA_VERSION_SHIFT) | int(bool(is_lock))
+
+
+def get_zone(value: int) -> int:
+    return value >> ZONE_SHIFT
+
+
+def get_data_version(value: int) -> int:
+    return (value >> DATA_VERSION_SHIFT) & DATA_VERSION_MASK
+
+
+def is_lock(value: int) -> bool:
+    return bool(value & LOCK_MASK)
+
+
+def get_zones(values: Sequence[int]) -> Sequence[int]:
+    """ 批量取源 zone，安装了 numpy 时整列计算 """
+    if numpy is not None and len(values) > 64:
+        return numpy.asarray(values, dtype=numpy.uint64) >> \
+            numpy.uint64(ZONE_SHIFT)
+    return [v >> ZONE_SHIFT for v in values]
+
+
+def decode_batch(values: Sequence[int]) -> List[Sequence]:
+    """ 返回 [源 zone, 元数据版本, 数据版本, 锁标记] 四列 """
+    if numpy is not None and len(values) > 64:
+        a = numpy.asarray(values, dtype=numpy.uint64)
+        return [a >> numpy.uint64(ZONE_SHIFT),
+                (a >> numpy.uint64(META_VERSION_SHIFT)) &
+                numpy.uint64(META_VERSION_MASK),
+                (a >> numpy.uint64(DATA_VERSION_SHIFT)) &
+                numpy.uint64(DATA_VERSION_MASK),
+                (a & numpy.uint64(LOCK_MASK)).astype(bool)]
+    return [list(i) for i in zip(*map(decode, values))] or [[], [], [], []]
+
+
+def encode_batch(zone_ids: Sequence[int], meta_versions: Sequence[int],
+                 data_versions: Sequence[int],
+                 locks: Sequence[bool]) -> List[int]:
+    return [encode(*i) for i in zip(zone_ids, meta_versions, data_versions,
+                                    locks)]
+
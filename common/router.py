@@ -0,0 +1,103 @@
+import array
+
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from common.algorithms import Algorithm
+from meta.model import DBTable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# zsid 没有对应的 zone
+_NO_ZONE = -1
+
+
+class TableRoute(object):
+    """
+    一个表的 zsid 和 zone 计算，mod 算法把模数和 zsid -> zone 的映射
+    展开成数组，其他算法退回到 Algorithm。
+    """
+
+    def __init__(self, table: DBTable, zones: Dict[int, int]):
+        self.zskeys: List[str] = list(table.zskeys)
+        self.args: List[Any] = list(table.zs_algorithm_args or [])
+        self.algorithm = Algorithm.new(table.zs_algorithm)
+        self.modulus: Optional[int] = None
+        if table.zs_algorithm == "mod" and len(self.args) == 1 and \
+                len(self.zskeys) == 1:
+            self.modulus = int(self.args[0])
+        self.zones: Dict[int, int] = zones
+        # zsid -> zone，没有 zone 的位置为 -1
+        size = self.modulus if self.modulus is not None else \
+            max(list(zones.keys()) + [-1]) + 1
+        self.zone_array = array.array("q", [_NO_ZONE] * size)
+        for zsid, zone in zones.items():
+            if 0 <= zsid < size:
+                self.zone_array[zsid] = zone
+        self.get_zsid: Callable[[Dict[str, Any]], int] = self._compile()
+
+    def _compile(self) -> Callable[[Dict[str, Any]], int]:
+        if self.modulus is not None:
+            key, modulus = self.zskeys[0], self.modulus
+            return lambda values: int(values[key]) % modulus
+        algorithm, args, zskeys = self.algorithm, self.args, self.zskeys
+        return lambda values: int(algorithm(
+            *args, *[values[k] for k in zskeys]))
+
+    def get_zone(self, values: Dict[str, Any]) -> int:
+        zsid = self.get_zsid(values)
+        zone = self.zone_array[zsid] if 0 <= zsid < len(self.zone_array) \
+            else _NO_ZONE
+        if zone == _NO_ZONE:
+            raise Exception("unknown zsid [{}].".format(zsid))
+        return zone
+
+    def get_zones(self, columns: Sequence[Sequence[Any]]) -> Sequence[int]:
+        """
+        批量计算，columns 为每个 zskey 一列值，返回每行的 zone。
+        安装了 numpy 并且是 mod 算法时整列计算，返回 numpy 数组。
+        """
+        if self.modulus is not None and numpy is not None:
+            zsids = numpy.asarray(columns[0], dtype=numpy.int64) % \
+                self.modulus
+            zones = numpy.frombuffer(self.zone_array,
+                                     dtype=numpy.int64)[zsids]
+            if (zones == _NO_ZONE).any():
+                raise Exception("unknown zsid [{}].".format(
+                    int(zsids[zones == _NO_ZONE][0])))
+            return zones
+        if self.modulus is not None:
+            modulus, zone_array = self.modulus, self.zone_array
+            result = [zone_array[int(v) % modulus] for v in columns[0]]
+            if _NO_ZONE in result:
+                raise Exception("unknown zsid [{}].".format(
+                    int(columns[0][result.index(_NO_ZONE)]) % modulus))
+            return result
+        return [self.get_zone(dict(zip(self.zskeys, r)))
+                for r in zip(*columns)]
+
+
+class Router(object):
+    """ 按元数据版本编译的行归属计算，物理表 -> TableRoute """
+
+    def __init__(self, tables: Dict[str, DBTable], zones: Dict[int, int]):
+        self.routes: Dict[str, TableRoute] = {}
+        compiled: Dict[str, TableRoute] = {}
+        for t, i in tables.items():
+            if i.name not in compiled:
+                compiled[i.name] = TableRoute(i, zones)
+            self.routes[t] = compiled[i.name]
+
+    def get_zsid(self, table: str, values: Dict[str, Any]) -> int:
+        return self.routes[table].get_zsid(values)
+
+    def get_zone(self, table: str, values: Dict[str, Any]) -> int:
+        return self.routes[table].get_zone(values)
+
+    def get_zones(self, table: str,
+                  rows: List[Dict[str, Any]]) -> Sequence[int]:
+        route = self.routes[table]
+        return route.get_zones([[r[k] for r in rows] for k in route.zskeys])
+
@@ -0,0 +1,95 @@
+import json
+import os
+
+from typing import Any, Dict, List, Optional, Tuple
+
+# 一次查询所有表的唯一索引，代替逐个表 SHOW KEYS
+UNIQUE_KEYS_SQL = "SELECT TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME "\
+        "FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = %s AND "\
+        "NON_UNIQUE = 0 AND TABLE_NAME IN ({})"
+
+
+# 唯一索引的行数和校验和，用于判断缓存的表结构是否有效
+UNIQUE_KEYS_FINGERPRINT_SQL = "SELECT COUNT(*) AS n, BIT_XOR(CRC32(CONCAT_WS("\
+        "'.', TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME))) AS crc "\
+        "FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = %s AND "\
+        "NON_UNIQUE = 0"
+
+
+def unique_keys_fingerprint_query(schema: str) -> Tuple[str, List[Any]]:
+    return UNIQUE_KEYS_FINGERPRINT_SQL, [schema]
+
+
+def unique_keys_query(schema: str,
+                      tables: List[str]) -> Tuple[str, List[Any]]:
+    sql = UNIQUE_KEYS_SQL.format(", ".join(["%s"] * len(tables)))
+    return sql, [schema] + list(tables)
+
+
+def parse_lock_keys(rows: List[Dict[str, Any]],
+                    table_keys: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    table_keys 为物理表名到锁索引名的映射，返回物理表的锁字段(按索引顺序)。
+    """
+    keys: Dict[str, Dict[int, str]] = {}
+    for i in rows:
+        r = {k.upper(): v for k, v in i.items()}
+        table = r["TABLE_NAME"]
+        if table_keys.get(table) != r["INDEX_NAME"]:
+            continue
+        keys.setdefault(table, {})[int(r["SEQ_IN_INDEX"])] = \
+            r["COLUMN_NAME"]
+    result = {}
+    for t, k in table_keys.items():
+        if t not in keys:
+            raise Exception("unknown table {} key {}".format(t, k))
+        result[t] = [keys[t][s] for s in sorted(keys[t].keys())]
+    return result
+
+
+class SchemaCache(object):
+    """
+    锁字段缓存，按节点的库保存每个 (物理表, 锁索引) 的锁字段，和元数据
+    版本无关，切换版本时只查询新增或者锁索引变化的表。唯一索引的校验和
+    变化时整个库的缓存失效。path 为空时只缓存在内存中。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Optional[Dict[str, Any]] = None
+
+    def _load(self) -> Dict[str, Any]:
+        if self._data is not None:
+            return self._data
+        self._data = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self._data = json.load(f)
+            except ValueError:
+                pass
+        return self._data
+
+    def get(self, key: str, fingerprint: List[Any]) \
+            -> Dict[Tuple[str, str], List[str]]:
+        """ 返回 (物理表, 锁索引) -> 锁字段，校验和不一致时为空 """
+        c = self._load().get(key)
+        if not c or c["fingerprint"] != fingerprint:
+            return {}
+        return {(t, index): columns for t, index, columns in c["tables"]}
+
+    def save(self, key: str, fingerprint: List[Any],
+             lock_keys: Dict[Tuple[str, str], List[str]]):
+        """ 校验和不变时合并到已有的缓存 """
+        tables = self.get(key, fingerprint)
+        tables.update(lock_keys)
+        data = self._load()
+        data[key] = {"fingerprint": fingerprint,
+                     "tables": [[t, index, columns] for (t, index), columns
+                                in sorted(tables.items())]}
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
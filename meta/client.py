@@ -56,12 +56,23 @@ class Client(object):
         return self.get_zones(version).get("db")  # type: ignore
 
     def report_replicator_process(self, target_zone: int, node: str,
-                                  log_file: str, log_pos: int):
+                                  log_file: str, log_pos: int,
+                                  gtid: Optional[str] = None):
         pass
 
-    def get_replicator_process(self, target_zone: int,
-                               node: str) -> Tuple[Optional[str], int]:
-        return None, 0
+    def get_replicator_process(self, target_zone: int, node: str) -> \
+            Tuple[Optional[str], int, Optional[str]]:
+        """ 返回 (binlog 文件, 位置, GTID 集合) """
+        return None, 0, None
+
+    def report_apply_process(self, source_zone: int, node: str,
+                             lsn: Dict[str, Any]):
+        pass
+
+    def get_apply_process(self, source_zone: int,
+                          node: str) -> Optional[Dict[str, Any]]:
+        """ 返回每个分区最后一个已经应用的 ChangeEventLSN，key 为分区号 """
+        return None
 
     def hearbeat(self):
         # TODO finish heartbeat.
@@ -1,8 +1,11 @@
+import functools
+import threading
+
 from typing import Any, Dict, List, Callable, Optional
 
 from common.config import Config
 
-from meta.model import DBConfig, ZoneConfig
+from meta.model import DBConfig, ZoneConfig, ObjectPool
 from common.circular_version_number import CircularVersionNumber
 from meta.client import Client
 
@@ -37,6 +40,12 @@ class MetaManager(object):
 
         # 元数据更新的观察者
         self.observers: List[Callable[[int]]] = []
+        # 正在使用的版本的引用计数，这些版本不会被清理
+        self._pins: Dict[int, int] = {}
+        # 版本之间共享没有变化的 zone、节点和表
+        self._pool = ObjectPool()
+        self._lock = threading.RLock()
+        self.retain_versions = config.get_meta_config().retain_versions
 
         self._pimms_client: Client
         self._meta_version_tool = CircularVersionNumber(
@@ -46,6 +55,20 @@ class MetaManager(object):
     def get_latest_version(self) -> int:
         return self.latest_version
 
+    def pin(self, version: int):
+        """ 标记版本正在使用，unpin 之前不会被清理 """
+        with self._lock:
+            self._pins[version] = self._pins.get(version, 0) + 1
+
+    def unpin(self, version: int):
+        with self._lock:
+            n = self._pins.get(version, 0) - 1
+            if n > 0:
+                self._pins[version] = n
+            else:
+                self._pins.pop(version, None)
+        self.clean_ontime()
+
     def add_observer(self, handler: Callable[[int], None]):
         if handler in self.observers:
             return
@@ -56,6 +79,10 @@ class MetaManager(object):
         self._pimms_client.add_observer(self._on_version_update)
 
     def _on_version_update(self, new_version: int):
+        # 先加载新版本，观察者收到通知时可以直接读取
+        self.load_version_meta(new_version)
+        if self.version_gt(new_version, self.latest_version):
+            self.latest_version = new_version
         for i in self.observers:
             i(new_version)
 
@@ -69,56 +96,96 @@ class MetaManager(object):
         self.load_version_meta(latest_version)
 
     def load_version_meta(self, version: int):
-        if version in self.versions.keys():
-            return
-        zones_dict = self._pimms_client.get_zones(version)
-        zone_list = self.parser_zone_config(zones_dict)
-        zones = {}
-        for zone in zone_list:
-            if zone.zone_id in zones.keys():
-                raise Exception("zone id [{}] has defined.".format(
-                                zone.zone_id))
-            if zone.zone_id == self.zone_id and not zone.db:
-                db_conf = self._pimms_client.get_db(version, self.zone_id)
-                zone.db = self.parser_db_config(db_conf)
-            zones[zone.zone_id] = zone
-        self.versions[version] = zones
+        with self._lock:
+            if version in self.versions.keys():
+                return
+            zones_dict = self._pimms_client.get_zones(version)
+            zone_list = self.parser_zone_config(zones_dict, self._pool)
+            zones = {}
+            for zone in zone_list:
+                if zone.zone_id in zones.keys():
+                    raise Exception("zone id [{}] has defined.".format(
+                                    zone.zone_id))
+                if zone.zone_id == self.zone_id and not zone.db:
+                    db_conf = self._pimms_client.get_db(version,
+                                                        self.zone_id)
+                    # 共享的 zone 不能修改，当前 zone 使用新的对象
+                    zone = ZoneConfig(zone.zone_id, zone.zone_name,
+                                      zone.shardings, self.parser_db_config(
+                                          db_conf, self._pool))
+                zones[zone.zone_id] = zone
+            self.versions[version] = zones
+        self.clean_ontime()
 
     def version_isloaded(self, version: int) -> bool:
         return version in self.versions.keys()
 
-    def get_zones(self, version: int = 0) -> List[ZoneConfig]:
+    def _get_version(self, version: int) -> Dict[int, ZoneConfig]:
         if version < 1:
             version = self.latest_version
-        return list(self.versions[version].values())
+        zones = self.versions.get(version)
+        if zones is None:
+            raise Exception("meta version [{}] is not loaded.".format(
+                version))
+        return zones
+
+    def get_zones(self, version: int = 0) -> List[ZoneConfig]:
+        return list(self._get_version(version).values())
 
     def get_db(self, version: int = 0, zone_id: int = 0) -> Optional[DBConfig]:
-        if version < 1:
-            version = self.latest_version
         if not zone_id:
             zone_id = self.zone_id
-        zone = self.versions[version].get(zone_id)
+        zone = self._get_version(version).get(zone_id)
         return zone.db
 
     def get_client(self) -> Client:
         return self._pimms_client
 
-    def clean_ontime():  # type: ignore
-        """ 定时清理过期的 version 数据 """
-        # TODO
-        pass
+    def clean_ontime(self):
+        """
+        只保留最新的 retain_versions 个版本和正在使用的版本，清理的版本
+        中不再被引用的对象由 ObjectPool 回收。
+        """
+        with self._lock:
+            if len(self.versions) <= self.retain_versions:
+                return
+            ordered = sorted(self.versions.keys(),
+                             key=functools.cmp_to_key(self._compare))
+            keep = set(ordered[-self.retain_versions:])
+            keep.update(self._pins.keys())
+            keep.add(self.latest_version)
+            for i in ordered:
+                if i not in keep:
+                    del self.versions[i]
+
+    def _compare(self, v1: int, v2: int) -> int:
+        if self.version_gt(v1, v2):
+            return 1
+        if self.version_gt(v2, v1):
+            return -1
+        return 0
 
     @staticmethod
-    def parser_zone_config(conf: List[dict]) -> List[ZoneConfig]:
+    def parser_zone_config(conf: List[dict],
+                           pool: Optional[ObjectPool] = None) \
+            -> List[ZoneConfig]:
         zones: List[ZoneConfig] = []
         for i in conf:
-            zone = ZoneConfig.new_from_dict(i)
+            if pool is None:
+                zone = ZoneConfig.new_from_dict(i)
+            else:
+                zone = pool.get("zone", i,
+                                lambda c: ZoneConfig.new_from_dict(c, pool))
             zones.append(zone)
         return zones
 
     @staticmethod
-    def parser_db_config(conf: Dict[str, Any]) -> DBConfig:
-        return DBConfig.new_from_dict(conf)
+    def parser_db_config(conf: Dict[str, Any],
+                         pool: Optional[ObjectPool] = None) -> DBConfig:
+        if pool is None:
+            return DBConfig.new_from_dict(conf)
+        return pool.get("db", conf,
+                        lambda c: DBConfig.new_from_dict(c, pool))
 
     def version_gt(self, v1: int, v2: int) -> bool:
         return self._meta_version_tool.gt(v1, v2)
@@ -1,6 +1,8 @@
+import json
 import re
+import weakref
 
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Callable, Union
 
 from meta.constant import DBNodeType, DBTableType, RuleStatus
 
@@ -8,6 +10,35 @@ TABLE_NAME_EXP_RE = re.compile(r"^([\w.]+)_{(\d+)\,\s*(\d+)\,*\s*(\d?)}$")
 TABLE_NAME_NUM_RE = re.compile(r"^([\w.]+)_(\d+)$")
 
 
+class ObjectPool(object):
+    """
+    按原始配置共享解析后的对象，多个版本中配置相同的节点、表是同一个
+    对象，不再被任何版本引用时自动回收。共享的对象不能被修改。
+    """
+
+    def __init__(self):
+        self._objects: weakref.WeakValueDictionary = \
+            weakref.WeakValueDictionary()
+
+    def get(self, kind: str, conf: Any, new: Callable[[Any], Any]) -> Any:
+        key = (kind, json.dumps(conf, sort_keys=True, default=str))
+        obj = self._objects.get(key)
+        if obj is None:
+            obj = new(conf)
+            self._objects[key] = obj
+        return obj
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+
+def _shared(pool: Optional[ObjectPool], kind: str, conf: Any,
+            new: Callable[[Any], Any]) -> Any:
+    if pool is None:
+        return new(conf)
+    return pool.get(kind, conf, new)
+
+
 class ZoneConfig(object):
     def __init__(self, zone_id: int, zone_name: str,
                  shardings: List['ZoneSharding'],
@@ -18,7 +49,8 @@ class ZoneConfig(object):
         self.db: Optional[DBConfig] = db
 
     @classmethod
-    def new_from_dict(cls, conf: Dict[str, Any]):
+    def new_from_dict(cls, conf: Dict[str, Any],
+                      pool: Optional[ObjectPool] = None):
         shardings: List[ZoneSharding] = []
         for i in conf["shardings"]:
             sharding = ZoneSharding.new_from_dict(i)
@@ -26,7 +58,8 @@ class ZoneConfig(object):
 
         db = None
         if "db" in conf.keys():
-            db = DBConfig.new_from_dict(conf["db"])
+            db = _shared(pool, "db", conf["db"],
+                         lambda c: DBConfig.new_from_dict(c, pool))
         zc = cls(conf["zone_id"], conf["zone_name"], shardings, db)
 
         return zc
@@ -68,7 +101,8 @@ class DBConfig(object):
             = idle_in_transaction_session_timeout
 
     @classmethod
-    def new_from_dict(cls, conf: dict) -> 'DBConfig':
+    def new_from_dict(cls, conf: dict,
+                      pool: Optional[ObjectPool] = None) -> 'DBConfig':
         transaction_mod = str(conf.get("transaction_mod", "simple"))
         idle_in_transaction_session_timeout = conf.get(
                 "idle_in_transaction_session_timeout", 0)
@@ -79,18 +113,34 @@ class DBConfig(object):
                   transaction_mod, idle_in_transaction_session_timeout)
 
         for i in conf["nodes"]:
-            node = DBNode.new_from_dict(i)
+            node = _shared(pool, "node", i, DBNode.new_from_dict)
             if node.name in dbc.nodes.keys():
                 raise Exception("[{}] node has defined.".format(node.name))
             dbc.nodes[node.name] = node
 
         for i in conf["tables"]:
-            table = DBTable.new_from_dict(i)
+            table = _shared(pool, "table", i, DBTable.new_from_dict)
             if table.name in dbc.tables.keys():
                 raise Exception("[{}] table has defined.".format(table.name))
             dbc.tables[table.name] = table
         return dbc
 
+    def get_node_tables(self, node: str) -> Dict[str, 'DBTable']:
+        """ 节点上的物理表名到逻辑表的映射 """
+        result: Dict[str, DBTable] = {}
+        for i in self.tables.values():
+            if not i.strategies:
+                continue
+            for s in i.strategies:
+                if not s.backends:
+                    continue
+                for n in s.backends:
+                    if n.node != node:
+                        continue
+                    for t in n.get_table_names():
+                        result[t] = i
+        return result
+
 
 class DBTable(object):
     def __init__(self, type: DBTableType, name: str,
@@ -131,22 +181,25 @@ class DBTable(object):
 
 class DBTableStrategy(object):
     def __init__(self,
-                 backends: List['DBTableStrategyBackend'],
+                 backends: List[Union['DBTableStrategyBackend',
+                                      'DBTableStrategyBackendRange']],
                  sharding_columns: Optional[List[str]],
                  algorithm: Optional[str],
                  algorithm_args: Optional[List[Any]] = None):
-        self.backends: List[DBTableStrategyBackend] = backends
+        self.backends: List[Union[DBTableStrategyBackend,
+                                  DBTableStrategyBackendRange]] = backends
         self.sharding_columns: Optional[List[str]] = sharding_columns
         self.algorithm: Optional[str] = algorithm
         self.algorithm_args = algorithm_args
 
     @classmethod
     def new_from_dict(cls, conf: dict) -> 'DBTableStrategy':
-        backends: List[DBTableStrategyBackend] = []
+        backends: List[Union[DBTableStrategyBackend,
+                             DBTableStrategyBackendRange]] = []
         for i in conf["backends"]:
-            bs = DBTableStrategyBackend.number_expression(i)
-            if bs:
-                backends.extend(bs)
+            r = DBTableStrategyBackendRange.number_expression(i)
+            if r is not None:
+                backends.append(r)
                 continue
             t = DBTableStrategyBackend.parser_tablename(i)
             if t:
@@ -171,39 +224,13 @@ class DBTableStrategyBackend(object):
         self.prefix: str = prefix
         self.number = number
 
-    @classmethod
-    def number_expression(cls, expression: str) -> \
-            Optional[List['DBTableStrategyBackend']]:
-        value = TABLE_NAME_EXP_RE.findall(expression)
-        if not value:
-            return None
-        if len(value) > 1:
-            raise Exception("expression: [{}] has two expression".format(
-                expression))
-        value = [i for i in value[0] if i]
-        if len(value) < 3:
-            raise Exception("expression: [{}] need stop.".format(
-                expression))
-        if len(value) > 4:
-            raise Exception("expression: [{}] only need start, stop, step.\
-".format(expression))
-        base = [i for i in str(value[0]).split(".", 1) if i]
-        if len(base) != 2:
-            raise Exception("expression: [{}] need [node.table].".format(
-                expression))
-        node = base[0]
-        prefix = base[1] + "_"
-        start = int(value[1])
-        stop = int(value[2])
-        step = 1
-        if len(value) > 3:
-            step = int(value[3])
+    def get_table_name(self) -> str:
+        if self.number is None:
+            return self.prefix
+        return self.prefix + str(self.number)
 
-        result = []
-        for i in range(start, stop, step):
-            result.append(cls(node, prefix, i))
-
-        return result
+    def get_table_names(self) -> List[str]:
+        return [self.get_table_name()]
 
     @classmethod
     def parser_tablename(cls, expression: str) -> \
@@ -239,6 +266,51 @@ class DBTableStrategyBackend(object):
         return cls(node, table, None)
 
 
+class DBTableStrategyBackendRange(object):
+    """ node.table_{start, stop, step} 表示的一组分表，只保存范围 """
+
+    def __init__(self, node: str, prefix: str, numbers: range):
+        self.node: str = node
+        self.prefix: str = prefix
+        self.numbers: range = numbers
+
+    def get_table_names(self) -> List[str]:
+        return [self.prefix + str(i) for i in self.numbers]
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    @classmethod
+    def number_expression(cls, expression: str) -> \
+            Optional['DBTableStrategyBackendRange']:
+        value = TABLE_NAME_EXP_RE.findall(expression)
+        if not value:
+            return None
+        if len(value) > 1:
+            raise Exception("expression: [{}] has two expression".format(
+                expression))
+        value = [i for i in value[0] if i]
+        if len(value) < 3:
+            raise Exception("expression: [{}] need stop.".format(
+                expression))
+        if len(value) > 4:
+            raise Exception("expression: [{}] only need start, stop, step.\
+".format(expression))
+        base = [i for i in str(value[0]).split(".", 1) if i]
+        if len(base) != 2:
+            raise Exception("expression: [{}] need [node.table].".format(
+                expression))
+        node = base[0]
+        prefix = base[1] + "_"
+        start = int(value[1])
+        stop = int(value[2])
+        step = 1
+        if len(value) > 3:
+            step = int(value[3])
+
+        return cls(node, prefix, range(start, stop, step))
+
+
 class DBNode(object):
     def __init__(self, type: DBNodeType, name: str, dsn: str,
                  minimum_pool_size: int = 1, maximum_pool_size: int = 100,
@@ -0,0 +1,69 @@
+import time
+
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple
+
+from mq.mq import MQMessage
+
+
+class OffsetCommitter(object):
+    """
+    按消费顺序跟踪每个分区的消息，只把连续处理完成的前缀作为可提交的位置。
+    处理完成的位置在进度持久化(durable)后才会提交，提交按时间或者消息数
+    批量进行，重启后最多重新消费一个提交周期的消息。
+
+    信封中的消息只有最后一条完成后才提交下一个 offset，否则提交信封本身，
+    重启后整个信封重新消费，已经应用的事件按 LSN 跳过。
+    """
+
+    def __init__(self, commit: Callable[[Dict[int, int]], None],
+                 interval: float, messages: int):
+        self.commit = commit
+        self.interval = interval
+        self.messages = messages
+        # 分区 -> [offset, index, count, 是否完成]
+        self._inflight: Dict[int, Deque[List]] = {}
+        self._index: Dict[Tuple[int, int, int], List] = {}
+        self._applied: Dict[int, int] = {}
+        self._durable: Dict[int, int] = {}
+        self._committed: Dict[int, int] = {}
+        self._count = 0
+        self._last_commit = time.monotonic()
+
+    def track(self, message: MQMessage):
+        """ 按消费顺序登记每一条消息 """
+        item = [message.offset, message.index, message.count, False]
+        self._inflight.setdefault(message.partition, deque()).append(item)
+        self._index[(message.partition, message.offset, message.index)] = item
+
+    def done(self, message: MQMessage):
+        """ 消息已经处理完成(已应用或者不需要应用) """
+        item = self._index.pop(
+                (message.partition, message.offset, message.index))
+        item[3] = True
+        q = self._inflight[message.partition]
+        while q and q[0][3]:
+            offset, index, count, _ = q.popleft()
+            self._applied[message.partition] = \
+                offset + 1 if index == count - 1 else offset
+        self._count += 1
+
+    def durable(self):
+        """ 已完成的消息对应的进度已经持久化，之后可以提交 """
+        self._durable.update(self._applied)
+
+    def maybe_commit(self):
+        if self.messages and self._count >= self.messages:
+            self.flush()
+        elif time.monotonic() - self._last_commit >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self._count = 0
+        self._last_commit = time.monotonic()
+        offsets = {p: o for p, o in self._durable.items()
+                   if self._committed.get(p) != o}
+        if not offsets:
+            return
+        self.commit(offsets)
+        self._committed.update(offsets)
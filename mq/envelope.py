@@ -0,0 +1,261 @@
+"""
+多条消息打包成一条 MQ 消息(信封)，可选压缩，所有整数为小端:
+
+    magic(2) version(1) compression(1) count(4) | payload
+
+payload 压缩前为 count 个 length(4) + value。同一个 key 和分区的消息才会
+放进同一个信封，保证同 key 的顺序。
+"""
+
+import struct
+import threading
+import time
+import zlib
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from common.config import MQConfig
+from common.logging import logger
+from mq.mq import MQConsumer, MQMessage, MQProducer
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAGIC = b"PE"
+VERSION = 1
+
+_HEAD = struct.Struct("<2sBBI")
+_LEN = struct.Struct("<I")
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+COMPRESSION_ZSTD = 3
+
+COMPRESSIONS = {"none": COMPRESSION_NONE, "zlib": COMPRESSION_ZLIB,
+                "lz4": COMPRESSION_LZ4, "zstd": COMPRESSION_ZSTD}
+
+Callback = Callable[[Optional[Exception]], None]
+# (key, partition)
+BatchKey = Tuple[bytes, Optional[int]]
+
+
+def get_compression(name: str) -> int:
+    """ lz4/zstd 没有安装时退回 zlib """
+    if name not in COMPRESSIONS:
+        raise Exception("unknown compression [{}].".format(name))
+    c = COMPRESSIONS[name]
+    if (c == COMPRESSION_LZ4 and lz4_frame is None) or \
+            (c == COMPRESSION_ZSTD and zstandard is None):
+        logger.warning("compression [{}] is not installed, use zlib.".format(
+            name))
+        return COMPRESSION_ZLIB
+    return c
+
+
+def _compress(compression: int, data: bytes) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data, 1)
+    if compression == COMPRESSION_LZ4:
+        return lz4_frame.compress(data)
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    raise Exception("unknown compression [{}].".format(compression))
+
+
+def _decompress(compression: int, data: bytes) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_LZ4:
+        if lz4_frame is None:
+            raise Exception("lz4 is not installed.")
+        return lz4_frame.decompress(data)
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise Exception("zstandard is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise Exception("unknown compression [{}].".format(compression))
+
+
+def pack(values: List[bytes], compression: int = COMPRESSION_NONE) -> bytes:
+    payload = bytearray()
+    for v in values:
+        payload += _LEN.pack(len(v))
+        payload += v
+    return _HEAD.pack(MAGIC, VERSION, compression, len(values)) + \
+        _compress(compression, bytes(payload))
+
+
+def is_envelope(data: bytes) -> bool:
+    return data[:2] == MAGIC
+
+
+def unpack(data: bytes) -> List[bytes]:
+    _, version, compression, count = _HEAD.unpack_from(data, 0)
+    if version != VERSION:
+        raise Exception("unsupported envelope version [{}].".format(version))
+    payload = _decompress(compression, data[_HEAD.size:])
+    values = []
+    pos = 0
+    for _ in range(count):
+        n, = _LEN.unpack_from(payload, pos)
+        pos += _LEN.size
+        values.append(payload[pos:pos + n])
+        pos += n
+    return values
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.values: List[bytes] = []
+        self.callbacks: List[Callback] = []
+        self.size: int = 0
+        self.created: float = time.monotonic()
+
+
+class EnvelopeProducer(MQProducer):
+    """
+    按 key 和分区攒批，达到条数、字节数或者等待时间后打包成一条消息发送，
+    信封被 broker 确认后依次回调其中每条消息的 callback。
+    """
+
+    @classmethod
+    def new(cls, conf: MQConfig) -> 'EnvelopeProducer':
+        raise Exception("use EnvelopeProducer(producer, conf).")
+
+    def __init__(self, producer: MQProducer, conf: MQConfig):
+        self.producer = producer
+        self.max_events = conf.envelope_max_events
+        self.max_bytes = conf.envelope_max_bytes
+        self.linger = conf.envelope_linger_ms / 1000
+        self.compression = get_compression(conf.compression)
+        self._batches: Dict[BatchKey, _Batch] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._linger_thread = threading.Thread(target=self._linger_loop,
+                                               name="mq-envelope",
+                                               daemon=True)
+        self._linger_thread.start()
+
+    def send(self, table: bytes, value: bytes):
+        # 同步发送前先发出同 key 的缓存，保证顺序
+        self._flush_key((table, None))
+        return self.producer.send(table, value)
+
+    def send_async(self, key: bytes, value: bytes, callback: Callback,
+                   partition: Optional[int] = None):
+        k = (key, partition)
+        with self._cond:
+            batch = self._batches.get(k)
+            if batch is None:
+                batch = _Batch()
+                self._batches[k] = batch
+                self._cond.notify()
+            batch.values.append(value)
+            batch.callbacks.append(callback)
+            batch.size += len(value)
+            if len(batch.values) < self.max_events and \
+                    batch.size < self.max_bytes:
+                return
+            del self._batches[k]
+            self._send_batch(k, batch)
+
+    def _send_batch(self, key: BatchKey, batch: _Batch):
+        def ack(e: Optional[Exception]):
+            for c in batch.callbacks:
+                c(e)
+        try:
+            value = pack(batch.values, self.compression)
+            self.producer.send_async(key[0], value, ack, key[1])
+        except Exception as e:
+            ack(e)
+
+    def _flush_key(self, key: BatchKey):
+        with self._cond:
+            batch = self._batches.pop(key, None)
+            if batch is not None:
+                self._send_batch(key, batch)
+
+    def _flush_batches(self, expired: Optional[float] = None):
+        with self._cond:
+            for k, b in list(self._batches.items()):
+                if expired is None or b.created <= expired:
+                    del self._batches[k]
+                    self._send_batch(k, b)
+
+    def _linger_loop(self):
+        while True:
+            with self._cond:
+                while not self._batches and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                oldest = min(b.created for b in self._batches.values())
+                timeout = oldest + self.linger - time.monotonic()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+            self._flush_batches(time.monotonic() - self.linger)
+
+    def flush_pending(self):
+        self._flush_batches()
+        self.producer.flush_pending()
+
+    def flush(self, timeout: Optional[float] = None):
+        self._flush_batches()
+        self.producer.flush(timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._flush_batches()
+        self.producer.close()
+
+
+class EnvelopeConsumer(MQConsumer):
+    """ 透明拆开信封，每条内部消息单独返回 """
+
+    @classmethod
+    def new(cls, conf: MQConfig) -> 'EnvelopeConsumer':
+        raise Exception("use EnvelopeConsumer(consumer).")
+
+    def __init__(self, consumer: MQConsumer):
+        self.consumer = consumer
+
+    def get_stream(self) -> Iterator[MQMessage]:
+        for i in self.consumer.get_stream():
+            yield from self._unpack(i)
+
+    def poll(self, timeout: float, max_records: int) -> List[MQMessage]:
+        result: List[MQMessage] = []
+        for i in self.consumer.poll(timeout, max_records):
+            result.extend(self._unpack(i))
+        return result
+
+    def commit(self, offsets: Dict[int, int]):
+        self.consumer.commit(offsets)
+
+    @staticmethod
+    def _unpack(i: Any) -> List[MQMessage]:
+        if not i.value or not is_envelope(i.value):
+            return [MQMessage(i.key, i.value, i.partition, i.offset)]
+        values = unpack(i.value)
+        return [MQMessage(i.key, v, i.partition, i.offset, index, len(values))
+                for index, v in enumerate(values)]
+
+    def close(self):
+        self.consumer.close()
+
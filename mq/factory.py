@@ -1,19 +1,25 @@
 from mq.mq import MQConsumer, MQProducer
 from common.config import MQConfig
 from mq.kafka import KafkaC, KafkaP
+from mq.envelope import EnvelopeConsumer, EnvelopeProducer
 
 
 class Factory(object):
     @staticmethod
     def new_producer(conf: MQConfig) -> MQProducer:
         if conf.type == "kafka":
-            return KafkaP.new(conf)
+            producer: MQProducer = KafkaP.new(conf)
         else:
             raise Exception("unknown mq type")
+        if conf.envelope_max_events > 1:
+            return EnvelopeProducer(producer, conf)
+        return producer
 
     @staticmethod
     def new_consumer(conf: MQConfig) -> MQConsumer:
         if conf.type == "kafka":
-            return KafkaC.new(conf)
+            consumer: MQConsumer = KafkaC.new(conf)
         else:
             raise Exception("unknown mq type")
+        # 兼容打包和未打包的消息
+        return EnvelopeConsumer(consumer)
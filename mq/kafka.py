@@ -1,8 +1,10 @@
-from typing import Iterator
+from typing import Callable, Dict, Iterator, List, Optional
 from common.config import MQConfig
 from kafka import KafkaConsumer, KafkaProducer
+from kafka.errors import KafkaTimeoutError
+from kafka.structs import OffsetAndMetadata, TopicPartition
 
-from mq.mq import MQConsumer, MQProducer
+from mq.mq import MQConsumer, MQMessage, MQProducer
 
 
 class KafkaP(MQProducer):
@@ -18,12 +20,32 @@ class KafkaP(MQProducer):
         self.kafka = KafkaProducer(
                 bootstrap_servers=conf.bootstrap_servers,
                 client_id=conf.client_id,
-                acks=conf.acks)
+                acks=conf.acks,
+                linger_ms=conf.linger_ms,
+                batch_size=conf.batch_size)
 
     def send(self, table: bytes, value: bytes):
         f = self.kafka.send(self.topic, key=table, value=value)
         return f.get(timeout=self.timeout)
 
+    def send_async(self, key: bytes, value: bytes,
+                   callback: Callable[[Optional[Exception]], None],
+                   partition: Optional[int] = None):
+        f = self.kafka.send(self.topic, key=key, value=value,
+                            partition=partition)
+        f.add_callback(lambda _: callback(None))
+        f.add_errback(callback)
+
+    def flush(self, timeout: Optional[float] = None):
+        self.kafka.flush(timeout=timeout)
+
+    def flush_pending(self):
+        """ 唤醒发送线程立即发出 linger_ms 中攒批的消息，不等待确认 """
+        try:
+            self.kafka.flush(timeout=0)
+        except KafkaTimeoutError:
+            pass
+
     def close(self):
         self.kafka.close()
 
@@ -42,11 +64,27 @@ class KafkaC(MQConsumer):
                 bootstrap_servers=conf.bootstrap_servers,
                 client_id=conf.client_id,
                 group_id=conf.group_id,
-                enable_auto_commit=False,
-                auto_commit_interval_ms=conf.auto_commit_interval_ms,)
+                enable_auto_commit=False,)
 
     def get_stream(self) -> Iterator:
         return self.kafka
 
+    def poll(self, timeout: float, max_records: int) -> List[MQMessage]:
+        r = self.kafka.poll(timeout_ms=int(timeout * 1000),
+                            max_records=max_records)
+        return [MQMessage(i.key, i.value, i.partition, i.offset)
+                for records in r.values() for i in records]
+
+    def commit(self, offsets: Dict[int, int]):
+        self.kafka.commit({TopicPartition(self.topic, p): _offset(o)
+                           for p, o in offsets.items()})
+
     def close(self):
         self.kafka.close()
+
+
+def _offset(offset: int) -> OffsetAndMetadata:
+    # kafka-python 2.1 开始 OffsetAndMetadata 增加了 leader_epoch
+    if "leader_epoch" in OffsetAndMetadata._fields:
+        return OffsetAndMetadata(offset, "", -1)
+    return OffsetAndMetadata(offset, "")
@@ -1,6 +1,29 @@
 import abc
-from typing import Iterator
+import asyncio
+import concurrent.futures
+import threading
+
+from typing import Callable, Dict, Iterator, List, Optional
 from common.config import MQConfig
+from common.logging import logger
+
+
+class MQMessage(object):
+    """
+    消费到的一条消息，index/count 为信封中的第几条和总条数，
+    没有打包的消息为 0/1。
+    """
+
+    __slots__ = ("key", "value", "partition", "offset", "index", "count")
+
+    def __init__(self, key: Optional[bytes], value: bytes, partition: int,
+                 offset: int, index: int = 0, count: int = 1):
+        self.key = key
+        self.value = value
+        self.partition = partition
+        self.offset = offset
+        self.index = index
+        self.count = count
 
 
 class MQProducer(metaclass=abc.ABCMeta):
@@ -14,6 +37,25 @@ class MQProducer(metaclass=abc.ABCMeta):
     def send(self, table: bytes, value: bytes):
         pass
 
+    @abc.abstractmethod
+    def send_async(self, key: bytes, value: bytes,
+                   callback: Callable[[Optional[Exception]], None],
+                   partition: Optional[int] = None):
+        """
+        异步发送，broker 确认后以 None 调用 callback，失败时传入异常。
+        callback 可能在 MQ 客户端的 IO 线程中执行。
+        partition 为 None 时由 key 决定分区。
+        """
+        pass
+
+    @abc.abstractmethod
+    def flush(self, timeout: Optional[float] = None):
+        pass
+
+    def flush_pending(self):
+        """ 发出在客户端攒批的消息，不等待确认 """
+        pass
+
     @abc.abstractmethod
     def close(self):
         pass
@@ -33,3 +75,110 @@ class MQConsumer(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def get_stream(self) -> Iterator:
         pass
+
+    @abc.abstractmethod
+    def poll(self, timeout: float, max_records: int) -> List[MQMessage]:
+        """ 最多等待 timeout 秒，返回不超过 max_records 条消息 """
+        pass
+
+    @abc.abstractmethod
+    def commit(self, offsets: Dict[int, int]):
+        """ 同步提交 分区 -> 下一条要消费的 offset """
+        pass
+
+    def get_async_stream(self, prefetch: int, max_records: int,
+                         timeout: float = 1) -> 'AsyncStream':
+        """ 在事件循环中运行，返回后台线程预取的消息批次 """
+        return AsyncStream(self, prefetch, max_records, timeout)
+
+
+class AsyncStream(object):
+    """
+    后台线程调用 consumer.poll 拉取消息，最多预取 prefetch 批放进
+    asyncio.Queue，协程处理消息时下一批已经在拉取，不阻塞事件循环。
+    consumer 只在拉取线程中使用，队列满时拉取线程等待，offset 的提交也在
+    拉取线程中执行。
+
+        async for messages in consumer.get_async_stream(4, 500):
+            ...
+    """
+
+    def __init__(self, consumer: MQConsumer, prefetch: int, max_records: int,
+                 timeout: float):
+        self.consumer = consumer
+        self.max_records = max_records
+        self.timeout = timeout
+        self.loop = asyncio.get_event_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(prefetch, 1))
+        self._closed = threading.Event()
+        self._commit_lock = threading.Lock()
+        self._commit: Dict[int, int] = {}
+        self._thread = threading.Thread(target=self._fetch,
+                                        name="mq-fetch", daemon=True)
+        self._thread.start()
+
+    def __aiter__(self) -> 'AsyncStream':
+        return self
+
+    async def __anext__(self) -> List[MQMessage]:
+        messages = await self.get()
+        if messages is None:
+            raise StopAsyncIteration
+        return messages
+
+    async def get(self, timeout: Optional[float] = None) \
+            -> Optional[List[MQMessage]]:
+        """ 超时返回空列表，关闭后返回 None """
+        if self._closed.is_set() and self.queue.empty():
+            return None
+        try:
+            r = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    def commit(self, offsets: Dict[int, int]):
+        """ 在下一次拉取前提交，关闭时提交剩余的 offset """
+        with self._commit_lock:
+            self._commit.update(offsets)
+
+    async def close(self):
+        """ 等待拉取线程退出后提交剩余的 offset，在线程池中执行 """
+        self._closed.set()
+        await self.loop.run_in_executor(None, self._stop)
+
+    def _stop(self):
+        self._thread.join()
+        self._commit_offsets()
+
+    def _commit_offsets(self):
+        with self._commit_lock:
+            offsets = self._commit
+            self._commit = {}
+        if offsets:
+            self.consumer.commit(offsets)
+
+    def _fetch(self):
+        while not self._closed.is_set():
+            try:
+                self._commit_offsets()
+                r = self.consumer.poll(self.timeout, self.max_records)
+            except Exception as e:
+                logger.error("mq fetch error: {}".format(e))
+                self._put(e)
+                return
+            if r:
+                self._put(r)
+
+    def _put(self, r):
+        # 队列满时在这里等待，直到协程取走或者关闭
+        f = asyncio.run_coroutine_threadsafe(self.queue.put(r), self.loop)
+        while not self._closed.is_set():
+            try:
+                f.result(self.timeout)
+                return
+            except concurrent.futures.TimeoutError:
+                continue
+        f.cancel()
@@ -0,0 +1,79 @@
+import threading
+
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional
+
+
+class SendWindow(object):
+    """
+    异步发送窗口：限制未确认消息的数量，并且只有在之前的消息全部确认后
+    才推进进度，保证断点续传时不会丢消息。
+
+    窗口满时先调用 on_full 发出生产者中攒批的消息，否则未确认的消息可能
+    都在等待攒批超时。
+    """
+
+    def __init__(self, max_in_flight: int, position: Any = None,
+                 on_full: Optional[Callable[[], None]] = None):
+        self.max_in_flight: int = max(max_in_flight, 1)
+        self.on_full = on_full
+        self._cond = threading.Condition()
+        # [seq, position, acked]
+        self._pending: Deque[List[Any]] = deque()
+        self._seq: int = 0
+        self._acked_position: Any = position
+        self._error: Optional[Exception] = None
+
+    def add(self, position: Any) -> int:
+        """ 登记一条待确认消息，窗口满时阻塞 """
+        if self.on_full is not None:
+            with self._cond:
+                full = len(self._pending) >= self.max_in_flight
+            # 不能持有锁，发送时 MQ 客户端可能在其他线程中回调 ack
+            if full:
+                self.on_full()
+        with self._cond:
+            while len(self._pending) >= self.max_in_flight and \
+                    not self._error:
+                self._cond.wait()
+            self._raise_error()
+            self._seq += 1
+            self._pending.append([self._seq, position, False])
+            return self._seq
+
+    def ack(self, seq: int, error: Optional[Exception] = None):
+        with self._cond:
+            if error is not None:
+                self._error = error
+                self._cond.notify_all()
+                return
+            for i in self._pending:
+                if i[0] == seq:
+                    i[2] = True
+                    break
+            while self._pending and self._pending[0][2]:
+                self._acked_position = self._pending.popleft()[1]
+            self._cond.notify_all()
+
+    def committed(self, current: Any) -> Any:
+        """
+        返回可以安全记录的进度，窗口为空时说明 current 之前的消息都已确认。
+        """
+        with self._cond:
+            self._raise_error()
+            if not self._pending:
+                self._acked_position = current
+            return self._acked_position
+
+    def check(self):
+        """ 有发送失败时抛出异常，不改变已确认的进度 """
+        with self._cond:
+            self._raise_error()
+
+    def in_flight(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise Exception("mq send error [{}].".format(self._error))
@@ -1,3 +1,5 @@
+from typing import List
+
 from meta.model import DBNode
 from common.dsn import DSN, Platform
 from replicator.listener.listener import Listener
@@ -7,11 +9,11 @@ from replicator.listener.mysql import MySQL
 class Factory(object):
 
     @staticmethod
-    def new(node: DBNode, server_id: int) -> Listener:
+    def new(node: DBNode, server_id: int, tables: List[str]) -> Listener:
         dsn = DSN(node.dsn)
         if dsn.platform is Platform.MariaDB:
-            return MySQL.new(node, dsn, server_id)
+            return MySQL.new(node, dsn, server_id, tables)
         elif dsn.platform is Platform.MySQL:
-            return MySQL.new(node, dsn, server_id)
+            return MySQL.new(node, dsn, server_id, tables)
         else:
             raise Exception("Unknown platform [{}]".format(node.dsn))
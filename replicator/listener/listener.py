@@ -1,5 +1,5 @@
 import abc
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from pymysqlreplication.binlogstream import BinLogStreamReader
 
@@ -11,7 +11,8 @@ class Listener(metaclass=abc.ABCMeta):
 
     @classmethod
     @abc.abstractclassmethod
-    def new(cls, node: DBNode, dsn: DSN, server_id: int) -> 'Listener':
+    def new(cls, node: DBNode, dsn: DSN, server_id: int,
+            tables: List[str]) -> 'Listener':
         pass
 
     @abc.abstractmethod
@@ -19,6 +20,26 @@ class Listener(metaclass=abc.ABCMeta):
         pass
 
     @abc.abstractmethod
-    def get_stream(self, log_file: Optional[str],
-                   log_pos: int) -> BinLogStreamReader:
+    def set_tail(self, blocking: bool, heartbeat_period: Optional[float]):
+        pass
+
+    @abc.abstractmethod
+    def get_master_status(self) -> Tuple[str, int, Optional[str]]:
+        """ 返回 (binlog 文件, 位置, 已执行的 GTID 集合) """
+        pass
+
+    @abc.abstractmethod
+    def get_gtid_executed(self, log_file: str, log_pos: int) -> str:
+        """ 返回执行到 log_file:log_pos 时的 GTID 集合 """
+        pass
+
+    @abc.abstractmethod
+    def get_lock_keys(self,
+                      table_keys: Dict[str, str]) -> Dict[str, List[str]]:
+        """ 物理表名到锁索引名的映射，返回每个表的锁字段 """
+        pass
+
+    @abc.abstractmethod
+    def get_stream(self, log_file: Optional[str], log_pos: int,
+                   gtid: Optional[str] = None) -> BinLogStreamReader:
         pass
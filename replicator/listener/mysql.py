@@ -1,35 +1,130 @@
-from typing import Optional
+import re
+
+from typing import Dict, List, Optional, Tuple
+
+import pymysql
+from pymysql.cursors import DictCursor, SSDictCursor
+
 from replicator.listener.listener import Listener
 from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.event import RotateEvent, QueryEvent, XidEvent,\
+        GtidEvent, HeartbeatLogEvent, MariadbGtidEvent
+from pymysqlreplication.gtid import Gtid, GtidSet
+from pymysqlreplication.row_event import WriteRowsEvent, DeleteRowsEvent,\
+        UpdateRowsEvent
 
-from common.dsn import DSN
+from common.dsn import DSN, Platform
+from common.schema import unique_keys_query, parse_lock_keys
 from meta.model import DBNode
 
+# TableMapEvent 由 BinLogStreamReader 自动加入
+ONLY_EVENTS = [RotateEvent, QueryEvent, XidEvent, GtidEvent,
+               MariadbGtidEvent, HeartbeatLogEvent, WriteRowsEvent,
+               DeleteRowsEvent, UpdateRowsEvent]
+
+# SHOW BINLOG EVENTS 中 Gtid 事件的 Info
+_GTID_NEXT_RE = re.compile(r"GTID_NEXT\s*=\s*'([^']+)'", re.IGNORECASE)
+
 
 class MySQL(Listener):
 
     @classmethod
-    def new(cls, node: DBNode, dsn: DSN, server_id: int) -> 'Listener':
-        return cls(node, dsn, server_id)
+    def new(cls, node: DBNode, dsn: DSN, server_id: int,
+            tables: List[str]) -> 'Listener':
+        return cls(node, dsn, server_id, tables)
 
-    def __init__(self, node: DBNode, dsn: DSN, server_id: int):
+    def __init__(self, node: DBNode, dsn: DSN, server_id: int,
+                 tables: List[str]):
         self.node = node
         self.dsn = dsn
         self.server_id = server_id
+        self.tables = tables
+        self.blocking = False
+        self.heartbeat_period: Optional[float] = None
+        self.stream: Optional[BinLogStreamReader] = None
+
+    def set_tail(self, blocking: bool, heartbeat_period: Optional[float]):
+        self.blocking = blocking
+        self.heartbeat_period = heartbeat_period or None
+
+    def get_master_status(self) -> Tuple[str, int, Optional[str]]:
+        conn = pymysql.connect(**self.dsn.get_args())
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SHOW MASTER STATUS")
+                r = cur.fetchone()
+        finally:
+            conn.close()
+        if not r:
+            raise Exception("node [{}] binlog is not enabled.".format(
+                self.node.name))
+        gtid = r[4] if len(r) > 4 else None
+        return r[0], r[1], gtid
+
+    def get_gtid_executed(self, log_file: str, log_pos: int) -> str:
+        """
+        文件开头的 Previous_gtids 加上文件中 log_pos 之前的事务。没有 GTID
+        时抛出异常，空集合会让 auto_position 从头重放所有 binlog。
+        """
+        if self.dsn.platform is Platform.MariaDB:
+            raise Exception("node [{}] gtid positioning is not supported "
+                            "on mariadb.".format(self.node.name))
+        gtids: Optional[GtidSet] = None
+        conn = pymysql.connect(cursorclass=SSDictCursor,
+                               **self.dsn.get_args())
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SHOW BINLOG EVENTS IN %s", [log_file])
+                for r in cur:
+                    if r["End_log_pos"] > log_pos:
+                        break
+                    if r["Event_type"] == "Previous_gtids":
+                        gtids = GtidSet("".join((r["Info"] or "").split())
+                                        or None)
+                    elif r["Event_type"] == "Gtid" and gtids is not None:
+                        m = _GTID_NEXT_RE.search(r["Info"] or "")
+                        if m:
+                            gtids = gtids + Gtid(m.group(1))
+        finally:
+            conn.close()
+        if gtids is None or not str(gtids):
+            raise Exception("node [{}] has no gtid executed at {}:{}, can "
+                            "not position by gtid.".format(
+                                self.node.name, log_file, log_pos))
+        return str(gtids)
+
+    def get_lock_keys(self,
+                      table_keys: Dict[str, str]) -> Dict[str, List[str]]:
+        sql, args = unique_keys_query(self.dsn.database,
+                                      list(table_keys.keys()))
+        conn = pymysql.connect(cursorclass=DictCursor, **self.dsn.get_args())
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, args)
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        return parse_lock_keys(list(rows), table_keys)
 
-    def get_stream(self, log_file: Optional[str],
-                   log_pos: int) -> BinLogStreamReader:
-        blocking = False
-        if log_file is None:
-            self.stream = BinLogStreamReader(
-                    connection_settings=self.dsn.get_args(),
-                    server_id=self.server_id, blocking=blocking)
-        else:
-            self.stream = BinLogStreamReader(
-                    connection_settings=self.dsn.get_args(),
-                    server_id=self.server_id, blocking=blocking,
-                    log_file=log_file, log_pos=log_pos)
+    def get_stream(self, log_file: Optional[str], log_pos: int,
+                   gtid: Optional[str] = None) -> BinLogStreamReader:
+        # 不需要同步的表在 TableMapEvent 阶段就被过滤，不会解析行数据
+        kwargs = dict(connection_settings=self.dsn.get_args(),
+                      server_id=self.server_id, blocking=self.blocking,
+                      slave_heartbeat=self.heartbeat_period,
+                      only_events=ONLY_EVENTS,
+                      only_schemas=[self.dsn.database],
+                      only_tables=self.tables)
+        if gtid:
+            kwargs["auto_position"] = gtid
+        elif log_file is not None:
+            kwargs["log_file"] = log_file
+            kwargs["log_pos"] = log_pos
+            kwargs["resume_stream"] = True
+        self.stream = BinLogStreamReader(**kwargs)
         return self.stream
 
     def close(self):
-        self.stream.close()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
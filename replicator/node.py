@@ -0,0 +1,528 @@
+import functools
+import re
+import time
+
+import pymysql
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.event import RotateEvent, QueryEvent, XidEvent,\
+        GtidEvent, HeartbeatLogEvent, MariadbGtidEvent
+from pymysqlreplication.gtid import Gtid, GtidSet
+from pymysqlreplication.row_event import RowsEvent, WriteRowsEvent,\
+        DeleteRowsEvent, UpdateRowsEvent
+
+from replicator.listener.factory import Factory
+from mq.mq import MQProducer
+from mq.window import SendWindow
+from replicator.pipeline import Pipeline
+from replicator.partitioner import Partitioner, PARTITION_BY_LOCK_KEY
+from replicator.snapshot import Snapshot
+from common.config import MQConfig, ReplicatorConfig, SnapshotConfig
+from common import codec, pidal
+from common.checkpoint import CheckpointStore
+from common.dsn import DSN
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from common.logging import logger
+
+from meta.manager import MetaManager
+from meta.model import DBNode, DBTable
+
+# 事务开始的语句，BEGIN 之后可以有注释
+_BEGIN_RE = re.compile(r"^\s*(?:BEGIN|START\s+TRANSACTION)\b", re.IGNORECASE)
+
+# 语句中的注释，gh-ost 的语句为 rename /* gh-ost */ table ...，不去掉
+# 可执行的 /*! */ 注释
+_COMMENT_RE = re.compile(r"/\*(?!!).*?\*/", re.S)
+# 语句开头的单行注释
+_LINE_COMMENT_RE = re.compile(r"\s*(?:--|#)[^\n]*(?:\n|$)")
+
+# 修改表结构的 DDL，DROP TABLE 和 RENAME TABLE 分组 1 可以有多个表
+_DDL_RE = re.compile(
+        r"(?:ALTER\s+(?:ONLINE\s+|IGNORE\s+)?TABLE|"
+        r"(?:CREATE|DROP)\s+(?:ONLINE\s+)?"
+        r"(?:UNIQUE\s+|FULLTEXT\s+|SPATIAL\s+)?INDEX\s+\S+\s+ON|"
+        r"CREATE\s+TABLE(?:\s+IF\s+NOT\s+EXISTS)?|"
+        r"(DROP\s+TABLE(?:\s+IF\s+EXISTS)?|RENAME\s+TABLE))\s+",
+        re.IGNORECASE)
+# 表名，分组为库名和表名
+_TABLE_RE = re.compile(r"(?:`?(\w+)`?\.)?`?(\w+)`?")
+# 多个表之间的分隔，RENAME TABLE a TO b, c TO d
+_TABLE_SEP_RE = re.compile(r"\s*(,|TO\b)\s*", re.IGNORECASE)
+
+
+def ddl_tables(query: str, schema: str) -> Dict[Tuple[str, str], bool]:
+    """
+    解析 DDL 影响的表，返回 (库名, 表名) 到表是否被删除的映射，不是
+    DDL 时返回空。RENAME TABLE 的原表被删除，除非之后又作为目标表。
+    """
+    query = _COMMENT_RE.sub(" ", query)
+    while True:
+        r = _LINE_COMMENT_RE.match(query)
+        if not r:
+            break
+        query = query[r.end():]
+    query = query.lstrip()
+    r = _DDL_RE.match(query)
+    if not r:
+        return {}
+    multi = (r.group(1) or "").upper()
+    tables: Dict[Tuple[str, str], bool] = {}
+    pos = r.end()
+    sep = ","
+    while True:
+        t = _TABLE_RE.match(query, pos)
+        if not t:
+            break
+        name = (t.group(1) or schema, t.group(2))
+        # RENAME 中 TO 之前的是原表，后出现的状态覆盖之前的
+        tables.pop(name, None)
+        tables[name] = multi.startswith("DROP") or \
+            (multi.startswith("RENAME") and sep == ",")
+        pos = t.end()
+        if not multi:
+            break
+        s = _TABLE_SEP_RE.match(query, pos)
+        if not s:
+            break
+        sep = s.group(1).upper()
+        pos = s.end()
+    return tables
+
+
+class NodeReplicator(object):
+    """
+    一个 DB 节点的 binlog 读取，每个节点有自己的 server_id、进度和 LSN 链。
+    """
+
+    def __init__(self, zone_id: int, meta_manager: MetaManager,
+                 node: DBNode, tables: Dict[str, DBTable], server_id: int,
+                 mq: MQProducer, executor: Optional[Executor],
+                 checkpoint: CheckpointStore):
+        self.zone_id = zone_id
+        self.meta_manager = meta_manager
+        self.node = node
+        self.server_id = server_id
+        self.mq = mq
+        self.current_file_log: str
+        self.current_file_log_index: int
+        self.current_log_pos: int
+        self.gtid_set: Optional[GtidSet] = None
+        self._current_gtid: Optional[str] = None
+        self._gtid: Optional[str] = None
+        # 每个分区一条 LSN 链，不分区时只有分区 0
+        self._prev_lsns: Dict[int, ChangeEventLSN] = {}
+        conf = ReplicatorConfig.get_instance()
+        self.transaction_group = conf.transaction_group
+        self.blocking = conf.blocking
+        self.use_gtid = conf.gtid
+        self.reconnect_interval = conf.reconnect_interval
+        self.codec = conf.codec
+        self._in_transaction = False
+        # 事务由 BEGIN 开始，否则是 GTID 事件开始的单条语句
+        self._explicit_begin = False
+        self._transaction_events: Dict[int, List[ChangeEvent]] = {}
+        # 当前事务中修改了分区字段的行涉及的分区
+        self._transaction_barrier: Set[int] = set()
+        self._running = True
+        # 其他线程通知的新元数据，在下一个事务边界切换
+        self._next_meta: Optional[Tuple[DBNode, Dict[str, DBTable]]] = None
+        self._events = 0
+        self._bytes = 0
+
+        self.checkpoint = checkpoint
+        self.checkpoint_key = "replicator.{}.{}".format(zone_id, node.name)
+        self.checkpoint.add_mirror(self.checkpoint_key, self._mirror_process)
+        self.window = SendWindow(MQConfig.get_instance().max_in_flight,
+                                 on_full=self.mq.flush_pending)
+        self.pipeline: Optional[Pipeline] = None
+        if executor is not None:
+            self.pipeline = Pipeline(self.mq, self.window, executor,
+                                     conf.queue_size, conf.stats_interval,
+                                     node.name, conf.codec)
+        self.tables = tables
+        self.database = DSN(node.dsn).database
+        self.compact_update = conf.update_format == "compact"
+        # 物理表的锁字段，compact UPDATE 和按锁字段分区需要
+        self.lock_keys: Dict[str, List[str]] = {}
+        self.partitioner = Partitioner(conf.partition_by, conf.partitions,
+                                       tables, self.lock_keys)
+        self.heartbeat_period = conf.heartbeat_period
+        self.node_stream = Factory.new(node, server_id, list(tables.keys()))
+        self.node_stream.set_tail(self.blocking, self.heartbeat_period)
+        self.snapshot: Optional[Snapshot] = None
+        snapshot_conf = SnapshotConfig.get_instance()
+        if snapshot_conf.enable:
+            self.snapshot = Snapshot(
+                    node, list(tables.keys()), snapshot_conf, checkpoint,
+                    "snapshot.{}.{}".format(zone_id, node.name),
+                    self._emit_snapshot, self._sync)
+
+    def stop(self):
+        self._running = False
+
+    def update_meta(self, node: DBNode, tables: Dict[str, DBTable]):
+        """ 在通知线程中调用，正在读取的事务仍然使用旧的元数据 """
+        self._next_meta = (node, tables)
+
+    def _load_lock_keys(self):
+        if self.compact_update or \
+                self.partitioner.partition_by == PARTITION_BY_LOCK_KEY:
+            self.lock_keys.clear()
+            self.lock_keys.update(self.node_stream.get_lock_keys(
+                    {k: v.lock_key for k, v in self.tables.items()}))
+
+    def _switch_meta(self) -> bool:
+        """
+        在事务边界切换到新的元数据，只重建变化的部分。节点地址或者表
+        变化时重新创建 binlog 读取，返回 True，由调用方从当前进度重新
+        打开流。
+        """
+        node, tables = self._next_meta
+        self._next_meta = None
+        reopen = node.dsn != self.node.dsn or \
+            set(tables.keys()) != set(self.tables.keys())
+        logger.info("node [{}] switch meta, reopen stream: {}.".format(
+            node.name, reopen))
+        self.node = node
+        self.tables = tables
+        self.database = DSN(node.dsn).database
+        self.partitioner = Partitioner(self.partitioner.partition_by,
+                                       self.partitioner.partitions, tables,
+                                       self.lock_keys)
+        if reopen:
+            self.node_stream.close()
+            self.node_stream = Factory.new(node, self.server_id,
+                                           list(tables.keys()))
+            self.node_stream.set_tail(self.blocking, self.heartbeat_period)
+        self._load_lock_keys()
+        return reopen
+
+    def start(self):
+        self._load_lock_keys()
+        log_file, log_pos, gtid = self._load_process()
+        self.current_file_log = log_file
+        self.current_log_pos = log_pos
+        if self.use_gtid:
+            if not gtid:
+                # 从 file/pos 进度切换到 GTID，从源库计算这个位置的 GTID
+                # 集合，不能从空集合开始
+                gtid = self.node_stream.get_gtid_executed(log_file, log_pos)
+            self.gtid_set = GtidSet(gtid)
+            self._gtid = str(self.gtid_set)
+        while self._running:
+            # 断线重连时从最后一个事务边界继续读取，未提交的事务重新读取
+            self._in_transaction = False
+            self._explicit_begin = False
+            self._current_gtid = None
+            self._transaction_events = {}
+            self._transaction_barrier = set()
+            stream = self.node_stream.get_stream(self.current_file_log,
+                                                 self.current_log_pos,
+                                                 self._gtid)
+            try:
+                reopen = self._consume(stream)
+            except (pymysql.err.OperationalError,
+                    pymysql.err.InterfaceError, OSError) as e:
+                logger.warning("node [{}] binlog stream error: {}".format(
+                    self.node.name, e))
+                time.sleep(self.reconnect_interval)
+                continue
+            finally:
+                self.node_stream.close()
+            if reopen:
+                continue
+            if not self.blocking:
+                break
+        if self.pipeline:
+            self.pipeline.close()
+        self.mq.flush()
+        self._report_process()
+        self.checkpoint.flush()
+
+    def _load_process(self) -> Tuple[str, int, Optional[str]]:
+        """
+        优先使用本地进度，其次元数据服务，都没有时先全量同步，
+        最后从当前位置开始
+        """
+        p = self.checkpoint.get(self.checkpoint_key)
+        if p:
+            return p["log_file"], p["log_pos"], p["gtid"]
+        log_file, log_pos, gtid = self.meta_manager.get_client()\
+            .get_replicator_process(self.zone_id, self.node.name)
+        if log_file is not None:
+            return log_file, log_pos, gtid
+        if self.snapshot is not None:
+            return self.snapshot.run()
+        return self.node_stream.get_master_status()
+
+    def _consume(self, stream: BinLogStreamReader) -> bool:
+        """ 需要用新的元数据重新打开流时返回 True """
+        for event in stream:
+            if not self._running:
+                break
+            if isinstance(event, RotateEvent):
+                self._rotate_event(event)
+            elif isinstance(event, GtidEvent):
+                self._current_gtid = event.gtid
+                self._begin(False)
+            elif isinstance(event, MariadbGtidEvent):
+                # MariaDB 用 GTID 事件代替 BEGIN
+                self._begin(False)
+            elif isinstance(event, XidEvent):
+                self._commit_event(event, event.xid)
+            elif isinstance(event, QueryEvent):
+                self._query_event(event)
+            elif isinstance(event, WriteRowsEvent):
+                self._insert_event(event)
+            elif isinstance(event, DeleteRowsEvent):
+                self._delete_event(event)
+            elif isinstance(event, UpdateRowsEvent):
+                self._update_event(event)
+            else:
+                pass
+            self._events += 1
+            self._bytes += event.event_size
+            # 只在事务边界推进进度，避免从事务中间恢复
+            if not self._in_transaction and \
+                    not isinstance(event, (RotateEvent, HeartbeatLogEvent,
+                                           GtidEvent, MariadbGtidEvent)) \
+                    and event.packet.log_pos:
+                self.current_log_pos = event.packet.log_pos
+            if not self._in_transaction:
+                # 空闲时依靠心跳推进已确认的进度
+                self._report_process()
+                if self._next_meta is not None and self._switch_meta():
+                    return True
+        return False
+
+    def _rotate_event(self, event: RotateEvent):
+        self.current_log_pos = event.position
+        self.current_file_log = event.next_binlog
+        self.current_file_log_index = self._get_log_index(event.next_binlog)
+
+    @staticmethod
+    def _get_log_index(file_log: str) -> int:
+        log_index = ""
+        for i in file_log[::-1]:
+            if i.isdigit():
+                log_index = i + log_index
+            else:
+                break
+        return int(log_index)
+
+    def _begin(self, explicit: bool):
+        """ 事务开始之后不再推进进度，直到提交 """
+        self._in_transaction = True
+        self._explicit_begin = self._explicit_begin or explicit
+
+    def _query_event(self, event: QueryEvent):
+        query = event.query.strip()
+        if _BEGIN_RE.match(query):
+            self._begin(True)
+        elif query.upper() == "COMMIT":
+            # 非事务引擎没有 XidEvent
+            self._commit_event(event, 0)
+        else:
+            self._ddl_event(event)
+            if self._in_transaction and not self._explicit_begin:
+                # GTID 事件之后的 DDL 隐式提交，没有 XidEvent 和 COMMIT
+                self._commit_event(event, 0)
+
+    def _ddl_event(self, event: QueryEvent):
+        """
+        同步的表结构变更后刷新锁字段，并在每个分区中发送 DDL 事件，
+        保证 apply 在应用之后的行之前刷新这个表的元数据。
+        """
+        schema = event.schema
+        if isinstance(schema, bytes):
+            schema = schema.decode()
+        tables = {t: dropped for (db, t), dropped in
+                  ddl_tables(event.query, schema).items()
+                  if db == self.database and t in self.tables}
+        if not tables:
+            return
+        logger.info("node [{}] tables {} ddl: {}".format(
+            self.node.name, list(tables.keys()), event.query))
+        if self.compact_update or \
+                self.partitioner.partition_by == PARTITION_BY_LOCK_KEY:
+            # 删除的表没有锁字段，重新创建时再读取
+            for t in [t for t, dropped in tables.items() if dropped]:
+                self.lock_keys.pop(t, None)
+            refresh = {t: self.tables[t].lock_key
+                       for t, dropped in tables.items() if not dropped}
+            if refresh:
+                self.lock_keys.update(
+                        self.node_stream.get_lock_keys(refresh))
+        partitions = range(self.partitioner.partitions) \
+            if self.partitioner.is_partitioned() else [0]
+        for index, table in enumerate(tables):
+            key = self.node.name if self.transaction_group else table
+            for partition in partitions:
+                c_event = ChangeEvent.new_ddl(
+                        self._prev_lsns.get(partition), self.zone_id,
+                        self.node.name, event, self.current_file_log_index,
+                        self.database, table, partition, index)
+                self._send(c_event, key)
+
+    def _commit_event(self, event: Union[XidEvent, QueryEvent], xid: int):
+        self._in_transaction = False
+        self._explicit_begin = False
+        self.current_log_pos = event.packet.log_pos
+        if self.gtid_set is not None and self._current_gtid:
+            self.gtid_set = self.gtid_set + Gtid(self._current_gtid)
+            self._gtid = str(self.gtid_set)
+            self._current_gtid = None
+        # 分区模式下一个事务按分区拆成多条消息，每个分区内保持事务
+        events = self._transaction_events
+        barrier = sorted(self._transaction_barrier)
+        self._transaction_events = {}
+        self._transaction_barrier = set()
+        for partition, i in events.items():
+            c_event = ChangeEvent.new_transaction(
+                    self._prev_lsns.get(partition), self.zone_id,
+                    self.node.name, event, self.current_file_log_index, xid,
+                    i, partition)
+            if partition in barrier:
+                c_event.barrier = barrier
+            self._send(c_event, self.node.name)
+
+    def _report_process(self):
+        # 只记录之前的消息都已经被 broker 确认的位置
+        log_file, log_pos, gtid = self.window.committed(
+                self._current_position())
+        self.checkpoint.update(self.checkpoint_key,
+                               {"log_file": log_file, "log_pos": log_pos,
+                                "gtid": gtid}, self._events, self._bytes)
+        self._events = 0
+        self._bytes = 0
+
+    def _mirror_process(self, p: Dict[str, Any]):
+        self.meta_manager.get_client().report_replicator_process(
+                self.zone_id, self.node.name, p["log_file"], p["log_pos"],
+                p["gtid"])
+
+    def _update_event(self, event: UpdateRowsEvent):
+        values = self._current_zone_rows(event.rows, "after_values")
+        if self.compact_update:
+            values = [self._compact_row(event.table, i) for i in values]
+        if not values:
+            return
+        self._emit(event, EventType.UPDATE, values, self.compact_update)
+
+    def _compact_row(self, table: str, row: Dict[str, Dict[str, Any]]) \
+            -> Dict[str, Dict[str, Any]]:
+        """ 只保留锁字段、zskeys、pidal_c 和修改过的字段 """
+        before = row["before_values"]
+        after = row["after_values"]
+        columns = set(self.lock_keys[table])
+        columns.update(self.tables[table].zskeys)
+        columns.add("pidal_c")
+        for k, v in after.items():
+            if before.get(k) != v:
+                columns.add(k)
+        return {"before_values": {k: before[k] for k in columns},
+                "after_values": {k: after[k] for k in columns}}
+
+    def _delete_event(self, event: DeleteRowsEvent):
+        values = self._current_zone_rows(event.rows, "values")
+        if not values:
+            return
+        self._emit(event, EventType.DELETE, values)
+
+    def _insert_event(self, event: WriteRowsEvent):
+        values = self._current_zone_rows(event.rows, "values")
+        if not values:
+            return
+        self._emit(event, EventType.INSERT, values)
+
+    def _emit(self, event: RowsEvent, event_type: EventType,
+              values: List[Dict[str, Dict[str, Any]]], compact: bool = False):
+        parts, barrier = self._split(event.table, values)
+        if self.transaction_group:
+            self._transaction_barrier.update(barrier)
+        for partition, rows in parts.items():
+            c_event = ChangeEvent.new(self._prev_lsns.get(partition),
+                                      self.zone_id, self.node.name, event,
+                                      event_type, self.current_file_log_index,
+                                      rows, compact, partition)
+            if self.transaction_group:
+                self._transaction_events.setdefault(partition, [])\
+                    .append(c_event)
+                continue
+            if partition in barrier:
+                c_event.barrier = barrier
+            self._send(c_event, c_event.table)
+
+    def _split(self, table: str, values: List[Dict[str, Dict[str, Any]]]) \
+            -> Tuple[Dict[int, List[Dict[str, Dict[str, Any]]]], List[int]]:
+        """
+        按分区拆分行，修改了分区字段的 UPDATE 在前后两个分区中各发送一次，
+        返回的 barrier 为这些分区，apply 在这些分区之间同步。
+        """
+        if not self.partitioner.is_partitioned():
+            return {0: values}, []
+        result: Dict[int, List[Dict[str, Dict[str, Any]]]] = {}
+        barrier: Set[int] = set()
+        for row in values:
+            partitions = self.partitioner.get_row_partitions(table, row)
+            if len(partitions) > 1:
+                barrier.update(partitions)
+            for p in partitions:
+                result.setdefault(p, []).append(row)
+        return result, sorted(barrier)
+
+    def _emit_snapshot(self, table: str, rows: List[Dict[str, Any]],
+                       position: Tuple[str, int, Optional[str]]):
+        """ 在全量同步的读取线程中调用 """
+        values = self._current_zone_rows([{"values": i} for i in rows],
+                                         "values")
+        if not values:
+            return
+        log_index = self._get_log_index(position[0])
+        # 和增量事件使用相同的 key，保证同一行的全量和增量在一个分区中
+        key = self.node.name if self.transaction_group else table
+        for partition, i in self._split(table, values)[0].items():
+            c_event = ChangeEvent.new_snapshot(
+                    self.zone_id, self.node.name, 0, log_index, position[1],
+                    self.snapshot.dsn.database, table, i, partition)
+            seq = self.window.add(position)
+            k, p = self._route(c_event, key)
+            self.mq.send_async(k.encode(), codec.encode(c_event, self.codec),
+                               functools.partial(self.window.ack, seq), p)
+
+    def _sync(self):
+        """ 等待已发送的消息全部被确认，有发送失败时抛出异常 """
+        self.mq.flush()
+        self.window.check()
+
+    def _route(self, c_event: ChangeEvent, key: str) \
+            -> Tuple[str, Optional[int]]:
+        if not self.partitioner.is_partitioned():
+            return key, None
+        # 分区由行决定，不再按 key hash
+        return "{}.{}".format(self.node.name, c_event.partition), \
+            c_event.partition
+
+    def _send(self, c_event: ChangeEvent, key: str):
+        # 在窗口中登记后才交给流水线，保证未发送的事件不会被当作已确认
+        seq = self.window.add(self._current_position())
+        self._prev_lsns[c_event.partition] = c_event.lsn
+        key, partition = self._route(c_event, key)
+        if self.pipeline:
+            self.pipeline.submit(seq, key, c_event, partition)
+            return
+        self.mq.send_async(key.encode(), codec.encode(c_event, self.codec),
+                           functools.partial(self.window.ack, seq),
+                           partition)
+
+    def _current_position(self) -> Tuple[str, int, Optional[str]]:
+        return self.current_file_log, self.current_log_pos, self._gtid
+
+    def _current_zone_rows(self, rows: List[Dict[str, Dict[str, Any]]],
+                           image: str) -> List[Dict[str, Dict[str, Any]]]:
+        """ 只保留当前 zone 写入的行，没有 pidal_c 的行忽略 """
+        rows = [i for i in rows if "pidal_c" in i[image]]
+        zones = pidal.get_zones([i[image]["pidal_c"] for i in rows])
+        return [i for i, z in zip(rows, zones) if z == self.zone_id]
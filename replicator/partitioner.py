@@ -0,0 +1,61 @@
+import zlib
+
+from typing import Any, Dict, List, Optional
+
+from common.router import Router
+from meta.model import DBTable
+
+PARTITION_BY_TABLE = "table"
+PARTITION_BY_LOCK_KEY = "lock_key"
+PARTITION_BY_ZSID = "zsid"
+
+
+class Partitioner(object):
+    """
+    行到分区的映射，同一行的变更总是在同一个分区中，保证行内有序。
+    table: 按表名作为 MQ key，所有事件一条 LSN 链(默认)
+    lock_key: 按锁字段的值 hash 到 partitions 个分区
+    zsid: 按 zsid 取模到 partitions 个分区，同一个 zsid 的行在一个分区
+    """
+
+    def __init__(self, partition_by: str, partitions: int,
+                 tables: Dict[str, DBTable], lock_keys: Dict[str, List[str]]):
+        self.partition_by = partition_by
+        self.partitions = max(int(partitions), 1)
+        self.tables = tables
+        self.lock_keys = lock_keys
+        self.router: Optional[Router] = None
+        if partition_by == PARTITION_BY_ZSID:
+            self.router = Router(tables, {})
+
+    def is_partitioned(self) -> bool:
+        return self.partition_by != PARTITION_BY_TABLE
+
+    def get_partition(self, table: str, values: Dict[str, Any]) -> int:
+        if self.partition_by == PARTITION_BY_TABLE:
+            return 0
+        if self.partition_by == PARTITION_BY_LOCK_KEY:
+            key = repr(tuple(values[k] for k in self.lock_keys[table]))
+            # hash() 每个进程不同，使用稳定的 crc32
+            return zlib.crc32(key.encode()) % self.partitions
+        return self.router.get_zsid(table, values) % self.partitions
+
+    def get_row_partition(self, table: str,
+                          row: Dict[str, Dict[str, Any]]) -> int:
+        # UPDATE 按修改后的值分区
+        values = row.get("after_values") or row["values"]
+        return self.get_partition(table, values)
+
+    def get_row_partitions(self, table: str,
+                           row: Dict[str, Dict[str, Any]]) -> List[int]:
+        """
+        行需要发送到的分区。UPDATE 修改了分区字段时返回修改前、后两个分区，
+        这一行之前的变更在前一个分区，之后的变更在后一个分区。
+        """
+        after = self.get_row_partition(table, row)
+        if "before_values" not in row:
+            return [after]
+        before = self.get_partition(table, row["before_values"])
+        if before == after:
+            return [after]
+        return [before, after]
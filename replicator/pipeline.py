@@ -0,0 +1,149 @@
+import functools
+import queue
+import threading
+import time
+
+from concurrent.futures import Executor, Future, ProcessPoolExecutor,\
+        ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from common import codec
+from common.change_event import ChangeEvent
+from common.logging import logger
+from mq.mq import MQProducer
+from mq.window import SendWindow
+
+
+def _encode(event: ChangeEvent, codec_name: str) -> Tuple[bytes, float]:
+    start = time.monotonic()
+    value = codec.encode(event, codec_name)
+    return value, time.monotonic() - start
+
+
+class PipelineStats(object):
+    """
+    各阶段的累计耗时（秒）和处理数量，用来判断瓶颈在哪个阶段。
+    read: 读取线程解析 binlog、过滤、构造事件的时间
+    wait: 读取线程因为队列已满而阻塞的时间
+    encode: 编码线程/进程的编码时间
+    idle: 发送线程等待编码结果的时间
+    publish: 发送线程调用 MQ 的时间
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count: int = 0
+        self.timings: Dict[str, float] = {"read": 0.0, "wait": 0.0,
+                                          "encode": 0.0, "idle": 0.0,
+                                          "publish": 0.0}
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage] += seconds
+
+    def incr(self):
+        with self._lock:
+            self.count += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            r = dict(self.timings)
+            r["count"] = self.count
+            return r
+
+
+class Pipeline(object):
+    """
+    binlog 读取 -> 编码 -> 发送 的分段流水线，阶段之间是有界队列。
+    编码可以并行，发送线程按照提交的顺序取结果，保证 binlog 顺序。
+    """
+
+    def __init__(self, mq: MQProducer, window: SendWindow,
+                 executor: Executor, queue_size: int, stats_interval: float,
+                 name: str, codec_name: str = codec.CODEC_JSON):
+        self.mq = mq
+        self.window = window
+        self.executor = executor
+        self.stats_interval = stats_interval
+        self.name = name
+        self.codec_name = codec_name
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stats = PipelineStats()
+        self._last_submit: Optional[float] = None
+        self._last_report = time.monotonic()
+        self._publisher = threading.Thread(target=self._publish_loop,
+                                           name="publisher-" + name,
+                                           daemon=True)
+        self._publisher.start()
+
+    @staticmethod
+    def new_executor(encoder_type: str, encoder_workers: int) -> Executor:
+        """ 编码线程/进程池，多个节点的流水线共用 """
+        if encoder_type == "process":
+            return ProcessPoolExecutor(max_workers=encoder_workers)
+        elif encoder_type == "thread":
+            return ThreadPoolExecutor(max_workers=encoder_workers)
+        raise Exception("unknown encoder type [{}].".format(encoder_type))
+
+    def submit(self, seq: int, key: str, event: ChangeEvent,
+               partition: Optional[int] = None):
+        """ 在读取线程中调用，seq 为发送窗口中的序号 """
+        now = time.monotonic()
+        if self._last_submit is not None:
+            self.stats.add("read", now - self._last_submit)
+        f = self.executor.submit(_encode, event, self.codec_name)
+        self.queue.put((seq, key, partition, f))
+        self._last_submit = time.monotonic()
+        self.stats.add("wait", self._last_submit - now)
+
+    def _publish_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            seq, key, partition, f = item
+            self._publish(seq, key, partition, f)
+            self._maybe_report()
+
+    def _publish(self, seq: int, key: str, partition: Optional[int],
+                 f: Future):
+        start = time.monotonic()
+        try:
+            value, encode_time = f.result()
+        except Exception as e:
+            self.window.ack(seq, e)
+            return
+        now = time.monotonic()
+        self.stats.add("idle", now - start)
+        self.stats.add("encode", encode_time)
+        try:
+            self.mq.send_async(key.encode(), value,
+                               functools.partial(self.window.ack, seq),
+                               partition)
+        except Exception as e:
+            self.window.ack(seq, e)
+            return
+        self.stats.add("publish", time.monotonic() - now)
+        self.stats.incr()
+
+    def _maybe_report(self):
+        if not self.stats_interval:
+            return
+        now = time.monotonic()
+        if now - self._last_report < self.stats_interval:
+            return
+        self._last_report = now
+        logger.info("pipeline [{}] queue {} in_flight {} stats {}".format(
+            self.name, self.queue.qsize(), self.window.in_flight(),
+            self.stats.snapshot()))
+
+    def get_stats(self) -> Dict[str, float]:
+        r = self.stats.snapshot()
+        r["queue"] = self.queue.qsize()
+        r["in_flight"] = self.window.in_flight()
+        return r
+
+    def close(self):
+        """ 等待队列中的事件全部交给 MQ """
+        self.queue.put(None)
+        self._publisher.join()
@@ -1,146 +1,170 @@
-from typing import Optional
+import threading
 
-from pymysqlreplication.event import RotateEvent
-from pymysqlreplication.row_event import WriteRowsEvent, DeleteRowsEvent,\
-        UpdateRowsEvent
+from typing import Dict, List, Optional
 
-from replicator.listener.factory import Factory
+from concurrent.futures import Executor
+
+from replicator.node import NodeReplicator
+from replicator.pipeline import Pipeline
 from mq.factory import Factory as MQFactory
-from common.config import Config, MQConfig
-from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from common.config import Config, MQConfig, ReplicatorConfig,\
+        CheckpointConfig
+from common.checkpoint import CheckpointStore
+from common.logging import logger
+from meta.constant import DBNodeType
+from meta.model import DBConfig, DBTable
 
 from meta.manager import MetaManager
 
 
 class Replicator(object):
+    """
+    一个进程同时读取多个 DB 节点，所有节点共用 MQ producer 和元数据。
+    """
+
     def __init__(self):
         self.config = Config.get_instance()
         self.zone_id = self.config.current_zone_id
         self.meta_manager = MetaManager.new(self.config)
-        self.current_file_log: str
-        self.current_file_log_index: int
-        self.current_log_pos: int
-        self._prev_event_lsn: Optional[ChangeEventLSN] = None
+        self.checkpoint = CheckpointStore.new(CheckpointConfig.get_instance())
+        self.nodes: List[NodeReplicator] = []
+        self.executor: Optional[Executor] = None
+        self._errors: List[Exception] = []
+        self._threads: List[threading.Thread] = []
+        # 节点增减和启动线程互斥
+        self._lock = threading.Lock()
+        self._server_index = 0
         self.get_latest()
-        self._running = True
+        self.meta_manager.add_observer(self._on_version_update)
 
     def get_latest(self):
         self.current_version = self.meta_manager.get_latest_version()
-        self.create_listeners(self.current_version)
+        self.meta_manager.pin(self.current_version)
         self.create_mq()
+        self.create_listeners(self.current_version)
 
     def create_mq(self):
         self.mq = MQFactory.new_producer(MQConfig.get_instance())
+        conf = ReplicatorConfig.get_instance()
+        if conf.pipeline:
+            self.executor = Pipeline.new_executor(conf.encoder_type,
+                                                  conf.encoder_workers)
 
     def create_listeners(self, version: int):
         db_conf = self.meta_manager.get_db(version)
         assert all((db_conf, db_conf.nodes))
-        if self.config.node not in db_conf.nodes.keys():
-            raise Exception("unknown node [{}].".format(self.config.node))
-        node = db_conf.nodes[self.config.node]
-        self.node = node
-        self.node_stream = Factory.new(node, self.config.server_id)
+        for name in self.get_node_names(db_conf):
+            self.nodes.append(self._new_node(db_conf, name))
+
+    def _new_node(self, db_conf: DBConfig, name: str) -> NodeReplicator:
+        node = db_conf.nodes[name]
+        tables = db_conf.get_node_tables(node.name)
+        if not tables:
+            raise Exception("node [{}] has no table.".format(node.name))
+        # 新增的节点使用之后的 server_id，不和正在读取的节点冲突
+        server_id = self.config.server_id + self._server_index
+        self._server_index += 1
+        return NodeReplicator(self.zone_id, self.meta_manager, node, tables,
+                              server_id, self.mq, self.executor,
+                              self.checkpoint)
+
+    def _on_version_update(self, version: int):
+        """
+        元数据服务通知新版本，在通知线程中调用。已有的节点在各自的事务
+        边界切换，删除的节点停止，新增的节点启动新的线程。
+        """
+        if not self.meta_manager.version_gt(version, self.current_version):
+            return
+        try:
+            db_conf = self.meta_manager.get_db(version)
+            names = self.get_node_names(db_conf)
+            tables: Dict[str, Dict[str, DBTable]] = {
+                i: db_conf.get_node_tables(i) for i in names}
+            if not all(tables.values()):
+                raise Exception("node [{}] has no table.".format(
+                    [i for i in names if not tables[i]]))
+        except Exception as e:
+            logger.error("meta version [{}] ignored: {}".format(version, e))
+            return
+        logger.info("replicator switch meta version {} -> {}.".format(
+            self.current_version, version))
+        with self._lock:
+            if self._errors:
+                return
+            self.meta_manager.pin(version)
+            self.meta_manager.unpin(self.current_version)
+            self.current_version = version
+            for i in list(self.nodes):
+                if i.node.name not in names:
+                    i.stop()
+                    self.nodes.remove(i)
+                    continue
+                name = i.node.name
+                i.update_meta(db_conf.nodes[name], tables[name])
+            current = [i.node.name for i in self.nodes]
+            for name in names:
+                if name in current:
+                    continue
+                node = self._new_node(db_conf, name)
+                self.nodes.append(node)
+                self._start_node(node)
+
+    def get_node_names(self, db_conf: DBConfig) -> List[str]:
+        """
+        node 可以是一个节点名、节点名列表，或者 "*" 表示所有 SOURCE 节点。
+        """
+        if self.config.node == "*":
+            names = [i.name for i in db_conf.nodes.values()
+                     if i.type is DBNodeType.SOURCE]
+        elif isinstance(self.config.node, str):
+            names = [self.config.node]
+        else:
+            names = list(self.config.node)
+        if not names:
+            raise Exception("no node to replicate.")
+        for i in names:
+            if i not in db_conf.nodes.keys():
+                raise Exception("unknown node [{}].".format(i))
+        return names
 
     def start(self):
-        log_file, log_pos = self.meta_manager.get_client()\
-                .get_replicator_process(self.zone_id, self.node.name)
-        if log_file is not None:
-            self.current_file_log = log_file
-            self.current_log_pos = log_pos
-        stream = self.node_stream.get_stream(log_file, log_pos)
-        i = 0
-        for event in stream:
-            i += 1
-            if not self._running:
+        with self._lock:
+            for i in self.nodes:
+                self._start_node(i)
+        # 元数据更新可能在等待时启动新的节点
+        while True:
+            with self._lock:
+                threads = [t for t in self._threads if t.is_alive()]
+            if not threads:
                 break
-            if isinstance(event, RotateEvent):
-                self._rotate_event(event)
-            elif isinstance(event, WriteRowsEvent):
-                self._insert_event(event)
-            elif isinstance(event, DeleteRowsEvent):
-                self._delete_event(event)
-            elif isinstance(event, UpdateRowsEvent):
-                self._update_event(event)
-            else:
-                pass
-            if i == 20:
-                self._report_process()
-                i = 0
-
-    def _rotate_event(self, event: RotateEvent):
-        self.current_log_pos = event.position
-        file_log = event.next_binlog
-        self.current_file_log = file_log
-        log_index = ""
-        for i in file_log[::-1]:
-            if i.isdigit():
-                log_index = i + log_index
-            else:
-                break
-        self.current_file_log_index = int(log_index)
-        self._report_process()
+            for t in threads:
+                t.join()
+        self.close()
+        with self._lock:
+            errors = list(self._errors)
+        if errors:
+            raise errors[0]
+
+    def _start_node(self, node: NodeReplicator):
+        t = threading.Thread(target=self._run_node, args=(node,),
+                             name="replicator-{}".format(node.node.name))
+        t.start()
+        self._threads.append(t)
 
-    def _report_process(self):
+    def _run_node(self, node: NodeReplicator):
         try:
-            self.meta_manager.get_client()\
-                .report_replicator_process(self.zone_id, self.node.name,
-                                           self.current_file_log,
-                                           self.current_log_pos)
-        except Exception:
-            # 同步进度的时候遇到异常忽略下次会同步的。
-            return
+            node.start()
+        except Exception as e:
+            logger.error("node [{}] replicator error: {}".format(
+                node.node.name, e))
+            # 一个节点失败时停止所有节点，由外部重启
+            with self._lock:
+                self._errors.append(e)
+                for i in self.nodes:
+                    i.stop()
 
-    def _update_event(self, event: UpdateRowsEvent):
-        values = []
-        for row in event.rows:
-            if "pidal_c" not in row["after_values"].keys():
-                continue
-            if self._is_current_zone(row["after_values"]["pidal_c"]):
-                values.append(row)
-        if not values:
-            return
-        c_event = ChangeEvent.new(self._prev_event_lsn,
-                                  self.zone_id, self.node.name, event,
-                                  EventType.UPDATE,
-                                  self.current_file_log_index,
-                                  values)
-        self.mq.send(c_event.table.encode(), c_event.encode())
-        self._prev_event_lsn = c_event.lsn
-
-    def _delete_event(self, event: DeleteRowsEvent):
-        values = []
-        for row in event.rows:
-            if "pidal_c" not in row["values"].keys():
-                continue
-            if self._is_current_zone(row["values"]["pidal_c"]):
-                values.append(row)
-        if not values:
-            return
-        c_event = ChangeEvent.new(self._prev_event_lsn,
-                                  self.zone_id, self.node.name, event,
-                                  EventType.DELETE,
-                                  self.current_file_log_index,
-                                  values)
-        self.mq.send(c_event.table.encode(), c_event.encode())
-        self._prev_event_lsn = c_event.lsn
-
-    def _insert_event(self, event: WriteRowsEvent):
-        values = []
-        for row in event.rows:
-            if "pidal_c" not in row["values"].keys():
-                continue
-            if self._is_current_zone(row["values"]["pidal_c"]):
-                values.append(row)
-        if not values:
-            return
-        c_event = ChangeEvent.new(self._prev_event_lsn,
-                                  self.zone_id, self.node.name, event,
-                                  EventType.INSERT,
-                                  self.current_file_log_index,
-                                  values)
-        self.mq.send(c_event.table.encode(), c_event.encode())
-        self._prev_event_lsn = c_event.lsn
-
-    def _is_current_zone(self, pidal_c: int) -> bool:
-        source_zone_id = pidal_c >> 53
-        return self.zone_id == source_zone_id
+    def close(self):
+        self.mq.flush()
+        self.checkpoint.close()
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,283 @@
+import queue
+import threading
+import time
+
+import pymysql
+from pymysql.cursors import DictCursor, SSDictCursor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.config import SnapshotConfig
+from common.checkpoint import CheckpointStore
+from common.dsn import DSN
+from common.logging import logger
+from common.schema import unique_keys_query, parse_lock_keys
+from meta.model import DBNode
+
+# [物理表, 主键下界(包含), 主键上界(不包含)]，没有单列整数主键时上下界为
+# None。块内按主键分页读取，块的数量不超过 parallelism，和主键的跨度无关。
+Chunk = List[Any]
+Position = Tuple[str, int, Optional[str]]
+
+
+class Snapshot(object):
+    """
+    一个节点的全量同步。多个连接在同一个一致性快照中按主键范围并行读取，
+    记录快照对应的 binlog 位置，全量完成后从这个位置开始增量同步。
+
+    每块按主键分页(WHERE pk > 上一页最后的主键 ORDER BY pk LIMIT n)读取，
+    稀疏的主键不会产生空块。没有主键的表整张表一块，中断后重新读取。
+
+    进度按页保存，重启后从每块最后确认的主键继续，仍然从第一次记录的
+    binlog 位置继续增量同步，期间的变更会被重复应用，由 apply 的数据版本
+    保证幂等。
+    """
+
+    def __init__(self, node: DBNode, tables: List[str], conf: SnapshotConfig,
+                 checkpoint: CheckpointStore, checkpoint_key: str,
+                 emit: Callable[[str, List[Dict[str, Any]], Position], None],
+                 sync: Callable[[], None]):
+        self.node = node
+        self.dsn = DSN(node.dsn)
+        self.tables = tables
+        self.conf = conf
+        self.checkpoint = checkpoint
+        self.checkpoint_key = checkpoint_key
+        # emit(物理表, 行, 全量开始的位置) 发送一批行，
+        # sync() 等待已发送的行全部被确认
+        self.emit = emit
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+        self._primary_keys: Dict[str, List[str]] = {}
+        self._chunks: List[Chunk] = []
+        self._position: Position
+        self._errors: List[Exception] = []
+
+    def run(self) -> Position:
+        """ 返回增量同步的开始位置 """
+        state = self.checkpoint.get(self.checkpoint_key)
+        if state and state["finished"]:
+            return state["log_file"], state["log_pos"], state["gtid"]
+        conns = [self._connect(SSDictCursor)
+                 for _ in range(self.conf.parallelism)]
+        try:
+            position = self._begin(conns)
+            self._primary_keys = self._get_primary_keys(conns[0])
+            if state:
+                position = (state["log_file"], state["log_pos"],
+                            state["gtid"])
+            if state and "chunks" in state:
+                state = dict(state, done=list(state["done"]),
+                             last=dict(state["last"]))
+            else:
+                # 旧格式的进度按块号记录，不能对应到分页，重新读取
+                state = {"log_file": position[0], "log_pos": position[1],
+                         "gtid": position[2], "finished": False,
+                         "chunks": self._get_chunks(
+                             self._get_bounds(conns[0]),
+                             self.conf.parallelism),
+                         "done": [], "last": {}}
+                self._save(state)
+            self._state = state
+            self._position = position
+            self._chunks = state["chunks"]
+            logger.info("node [{}] snapshot {}/{} chunks from {}".format(
+                self.node.name, len(state["done"]), len(self._chunks),
+                position))
+            self._read(conns)
+            state["finished"] = True
+            self._save(state)
+        finally:
+            for c in conns:
+                c.close()
+        return position
+
+    def _connect(self, cursorclass: Any) -> pymysql.Connection:
+        return pymysql.connect(cursorclass=cursorclass,
+                               **self.dsn.get_args())
+
+    def _begin(self, conns: List[pymysql.Connection]) -> Position:
+        """ 所有连接开启同一时刻的一致性快照，返回对应的 binlog 位置 """
+        lock = self._connect(DictCursor) if self.conf.lock else None
+        try:
+            if lock is not None:
+                with lock.cursor() as cur:
+                    cur.execute("FLUSH TABLES WITH READ LOCK")
+            for c in conns:
+                with c.cursor() as cur:
+                    cur.execute("SET SESSION TRANSACTION ISOLATION LEVEL "
+                                "REPEATABLE READ")
+                    cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            with conns[0].cursor() as cur:
+                cur.execute("SHOW MASTER STATUS")
+                r = cur.fetchone()
+        finally:
+            if lock is not None:
+                with lock.cursor() as cur:
+                    cur.execute("UNLOCK TABLES")
+                lock.close()
+        if not r:
+            raise Exception("node [{}] binlog is not enabled.".format(
+                self.node.name))
+        return r["File"], r["Position"], r.get("Executed_Gtid_Set") or None
+
+    def _get_primary_keys(self,
+                          conn: pymysql.Connection) -> Dict[str, List[str]]:
+        """ 没有主键的表为空列表 """
+        sql, args = unique_keys_query(self.dsn.database, self.tables)
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+            rows = list(cur.fetchall())
+        upper = [{k.upper(): v for k, v in r.items()} for r in rows]
+        names = {r["TABLE_NAME"] for r in upper
+                 if r["INDEX_NAME"] == "PRIMARY"}
+        keys = parse_lock_keys(rows, {t: "PRIMARY" for t in self.tables
+                                      if t in names})
+        return {t: keys.get(t, []) for t in self.tables}
+
+    def _get_bounds(self, conn: pymysql.Connection) \
+            -> Dict[str, Optional[List[int]]]:
+        """ 单列整数主键的最小、最大值，其他的表为 None，整张表一块 """
+        bounds: Dict[str, Optional[List[int]]] = {}
+        for t in self.tables:
+            bounds[t] = None
+            keys = self._primary_keys[t]
+            if len(keys) != 1:
+                continue
+            with conn.cursor() as cur:
+                cur.execute("SELECT MIN(`{0}`) AS lo, MAX(`{0}`) AS hi "
+                            "FROM `{1}`".format(keys[0], t))
+                r = cur.fetchone()
+            if isinstance(r["lo"], int) and isinstance(r["hi"], int):
+                bounds[t] = [r["lo"], r["hi"]]
+        return bounds
+
+    @staticmethod
+    def _get_chunks(bounds: Dict[str, Optional[List[int]]],
+                    parallelism: int) -> List[Chunk]:
+        """ 有整数主键范围的表平分成 parallelism 块，只和并发数有关 """
+        chunks: List[Chunk] = []
+        for t, b in bounds.items():
+            if b is None:
+                chunks.append([t, None, None])
+                continue
+            lo, hi = b
+            step = -(-(hi + 1 - lo) // parallelism)
+            for i in range(lo, hi + 1, max(step, 1)):
+                chunks.append([t, i, min(i + step, hi + 1)])
+        return chunks
+
+    @staticmethod
+    def _page_query(chunk: Chunk, keys: List[str], last: Optional[List[Any]],
+                    limit: int) -> Tuple[str, List[Any]]:
+        """ 块内从 last 之后按主键顺序读取一页，没有主键时读取整张表 """
+        table, lo, hi = chunk
+        sql = "SELECT * FROM `{}`".format(table)
+        if not keys:
+            return sql, []
+        where: List[str] = []
+        args: List[Any] = []
+        if lo is not None:
+            where.append("`{0}` >= %s AND `{0}` < %s".format(keys[0]))
+            args.extend([lo, hi])
+        if last is not None:
+            columns = ", ".join("`{}`".format(k) for k in keys)
+            values = ", ".join(["%s"] * len(keys))
+            where.append("({}) > ({})".format(columns, values))
+            args.extend(last)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY {} LIMIT {:d}".format(
+            ", ".join("`{}`".format(k) for k in keys), limit)
+        return sql, args
+
+    def _read(self, conns: List[pymysql.Connection]):
+        chunks: queue.Queue = queue.Queue()
+        done = set(self._state["done"])
+        for i in range(len(self._chunks)):
+            if i not in done:
+                chunks.put(i)
+        threads = []
+        for c in conns:
+            t = threading.Thread(target=self._worker, args=(c, chunks),
+                                 name="snapshot-{}".format(self.node.name))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def _worker(self, conn: pymysql.Connection, chunks: queue.Queue):
+        rate = self.conf.max_rows_per_second / self.conf.parallelism
+        while not self._errors:
+            try:
+                i = chunks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._read_chunk(conn, i, rate)
+            except Exception as e:
+                logger.error("node [{}] snapshot chunk {} error: {}".format(
+                    self.node.name, self._chunks[i], e))
+                self._errors.append(e)
+                return
+
+    def _read_chunk(self, conn: pymysql.Connection, index: int,
+                    rate: float):
+        chunk = self._chunks[index]
+        table = chunk[0]
+        keys = self._primary_keys[table]
+        last = self._state["last"].get(str(index))
+        start = time.monotonic()
+        count = 0
+        while True:
+            sql, args = self._page_query(chunk, keys, last,
+                                         self.conf.chunk_size)
+            rows = 0
+            row: Optional[Dict[str, Any]] = None
+            # 流式游标，不在内存中缓存整页
+            with conn.cursor() as cur:
+                cur.execute(sql, args)
+                while True:
+                    batch = cur.fetchmany(self.conf.fetch_size)
+                    if not batch:
+                        break
+                    self.emit(table, list(batch), self._position)
+                    rows += len(batch)
+                    row = batch[-1]
+                    count += len(batch)
+                    if rate > 0:
+                        wait = count / rate - (time.monotonic() - start)
+                        if wait > 0:
+                            time.sleep(wait)
+            finished = not keys or rows < self.conf.chunk_size
+            if row is not None:
+                last = [_json_value(row[k]) for k in keys]
+            # 页内的行全部被确认后才记录进度
+            self.sync()
+            with self._lock:
+                if finished:
+                    self._state["done"].append(index)
+                    self._state["last"].pop(str(index), None)
+                else:
+                    self._state["last"][str(index)] = last
+                self._save(self._state)
+            if finished:
+                return
+
+    def _save(self, state: Dict[str, Any]):
+        # 保存副本，CheckpointStore 比较新旧值判断是否需要刷盘
+        self.checkpoint.update(self.checkpoint_key,
+                               dict(state, done=list(state["done"]),
+                                    last=dict(state["last"])), 0)
+        self.checkpoint.flush()
+
+
+def _json_value(value: Any) -> Any:
+    """ 主键值写入 JSON 进度，其他类型按字符串比较 """
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+from apply.apply import Apply
+from common import pidal
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+
+
+def row(uk: int, v: str, version: int, id_: int = 0) -> Dict[str, Any]:
+    return {"id": id_ or uk, "uk": uk, "v": v,
+            "pidal_c": pidal.encode(1, 0, version)}
+
+
+def new_event(event_type: EventType, values: List[Dict[str, Any]]) \
+        -> ChangeEvent:
+    return ChangeEvent(None, ChangeEventLSN(0, 1, 1, 100), 0, event_type,
+                       1, "n0", "db", "t", values)
+
+
+def update(before: Dict[str, Any], after: Dict[str, Any]) -> ChangeEvent:
+    return new_event(EventType.UPDATE, [{"before_values": before,
+                                         "after_values": after}])
+
+
+class FakeCursor(object):
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.executed: List[Any] = []
+
+    async def execute(self, sql: str, args: List[Any]):
+        self.executed.append((sql, args))
+
+    async def fetchall(self):
+        return self.rows
+
+
+def new_apply() -> Apply:
+    a = Apply.__new__(Apply)
+    # 锁字段是唯一索引 uk，不是主键
+    a.tables = {"t": ["uk"]}
+    a.zone_id = 2
+    a.router = SimpleNamespace(get_zone=lambda table, values: 1)
+    a.apply_conf = SimpleNamespace(bulk_batch_rows=100)
+    return a
+
+
+def run(rows: List[Dict[str, Any]], events: List[ChangeEvent]) -> List[Any]:
+    cur = FakeCursor(rows)
+    asyncio.run(new_apply()._batch_table(cur, "t", events))
+    return cur.executed[1:]
+
+
+def test_update_by_lock_key():
+    executed = run([row(1, "a", 1)], [update(row(1, "a", 1), row(1, "b", 2))])
+    assert executed == [(
+        "UPDATE `t` SET `v` = %s, `pidal_c` = %s WHERE `uk` = %s",
+        ["b", pidal.encode(1, 0, 2), 1])]
+
+
+def test_key_moving_update():
+    executed = run([row(1, "a", 1)],
+                   [update(row(1, "a", 1), row(2, "a", 2, id_=1))])
+    assert [s.split(" ")[0] for s, _ in executed] == ["DELETE", "INSERT"]
+    assert executed[0][1] == [1]
+
+
+def test_move_onto_existing_key_raises():
+    with pytest.raises(Exception, match="duplicate lock_key"):
+        run([row(1, "a", 1), row(2, "b", 1)],
+            [update(row(1, "a", 1), row(2, "a", 2, id_=1))])
+
+
+def test_move_onto_key_inserted_in_batch_raises():
+    events = [new_event(EventType.INSERT, [{"values": row(2, "b", 1)}]),
+              update(row(1, "a", 1), row(2, "a", 2, id_=1))]
+    with pytest.raises(Exception, match="duplicate lock_key"):
+        run([row(1, "a", 1)], events)
+
+
+def test_move_onto_key_deleted_in_batch():
+    events = [new_event(EventType.DELETE, [{"values": row(2, "b", 1)}]),
+              update(row(1, "a", 1), row(2, "a", 2, id_=1))]
+    executed = run([row(1, "a", 1), row(2, "b", 1)], events)
+    # uk=1 删除，uk=2 原来的行被新行覆盖
+    assert executed[0] == ("DELETE FROM `t` WHERE `uk` IN (%s)", [1])
+    assert executed[1] == (
+        "UPDATE `t` SET `id` = %s, `v` = %s, `pidal_c` = %s WHERE `uk` = %s",
+        [1, "a", pidal.encode(1, 0, 2), 2])
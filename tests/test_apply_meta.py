@@ -0,0 +1,38 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+from typing import List
+
+from apply.apply import Apply
+
+
+class FakeMetaManager(object):
+
+    def __init__(self):
+        self.threads: List[threading.Thread] = []
+
+    def version_gt(self, v1: int, v2: int) -> bool:
+        return v1 > v2
+
+    def load_version_meta(self, version: int):
+        self.threads.append(threading.current_thread())
+
+    def get_db(self, version: int = 0):
+        return None
+
+
+def test_switch_version_loads_meta_in_executor():
+    a = Apply.__new__(Apply)
+    a.meta_manager = FakeMetaManager()
+    a.config = SimpleNamespace(node="n0")
+    a.scheduler = None
+    a.current_version = 1
+    a._next_version = None
+    a._on_version_update(2)
+    assert a._next_version == 2
+    asyncio.run(a._switch_version())
+    assert a._next_version is None
+    assert a.meta_manager.threads
+    assert a.meta_manager.threads[0] is not threading.main_thread()
+    # 节点不可用时保持旧版本
+    assert a.current_version == 1
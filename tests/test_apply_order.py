@@ -0,0 +1,57 @@
+from typing import Any, Dict, List, Optional
+
+from apply.apply import Apply
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+
+
+def new_event(event_type: EventType, position: int, partition: int,
+              values: List[Dict[str, Any]],
+              barrier: Optional[List[int]] = None) -> ChangeEvent:
+    lsn = ChangeEventLSN(0, 1, 1, position)
+    return ChangeEvent(None, lsn, 0, event_type, 1, "n0", "db", "t", values,
+                       partition=partition, barrier=barrier)
+
+
+def new_apply() -> Apply:
+    a = Apply.__new__(Apply)
+    a._barriers = {}
+    a._held = {}
+    return a
+
+
+def test_key_moving_update_waits_for_both_partitions():
+    a = new_apply()
+    moving = {"before_values": {"id": 1}, "after_values": {"id": 2}}
+    insert = new_event(EventType.INSERT, 10, 0, [{"values": {"id": 1}}])
+    # 同一个 binlog 事件在两个分区中的副本
+    copy0 = new_event(EventType.UPDATE, 20, 0, [moving], [0, 1])
+    copy1 = new_event(EventType.UPDATE, 20, 1, [moving], [0, 1])
+    later = new_event(EventType.UPDATE, 30, 1,
+                      [{"before_values": {"id": 2},
+                        "after_values": {"id": 2, "v": 1}}])
+    ready = []
+    # 新分区的副本和之后的事件先到达，等旧分区的事件应用后才应用
+    for e in (copy1, later, insert, copy0):
+        ready.extend(a._order(e, "m{}.{}".format(e.partition,
+                                                  e.lsn.log_position)))
+    events = [e for e, _ in ready]
+    assert events[0] is insert
+    assert events[1].values == [moving]
+    assert events[2] is later
+    assert ready[1][1] == [(copy1, "m1.20"), (copy0, "m0.20")]
+    assert a._held == {} and a._barriers == {}
+
+
+def test_merge_transaction_copies():
+    moving = {"before_values": {"id": 1}, "after_values": {"id": 2}}
+    r0 = new_event(EventType.UPDATE, 20, 0, [moving, {"x": 0}])
+    r1 = new_event(EventType.UPDATE, 20, 1, [moving])
+    other = new_event(EventType.INSERT, 15, 1, [{"values": {"id": 9}}])
+    t0 = new_event(EventType.TRANSACTION, 40, 0, [], [0, 1])
+    t0.events = [r0]
+    t1 = new_event(EventType.TRANSACTION, 40, 1, [], [0, 1])
+    t1.events = [other, r1]
+    merged = Apply._merge([t0, t1])
+    assert [e.lsn.log_position for e in merged.events] == [15, 20]
+    assert merged.events[1].values == [moving, {"x": 0}]
+    assert merged.barrier == [0, 1]
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from typing import Dict, List
+
+from mq.mq import MQConsumer, MQMessage
+
+
+class FakeConsumer(MQConsumer):
+
+    def __init__(self, batches: List[List[MQMessage]]):
+        self.batches = batches
+        self.commits: List[Dict[int, int]] = []
+        self.commit_threads: List[threading.Thread] = []
+
+    @classmethod
+    def new(cls, conf):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def get_stream(self):
+        raise NotImplementedError
+
+    def poll(self, timeout: float, max_records: int) -> List[MQMessage]:
+        if self.batches:
+            return self.batches.pop(0)
+        time.sleep(timeout)
+        return []
+
+    def commit(self, offsets: Dict[int, int]):
+        self.commits.append(offsets)
+        self.commit_threads.append(threading.current_thread())
+
+
+def test_stream_and_close():
+    consumer = FakeConsumer([[MQMessage(b"k", b"v", 0, i)]
+                             for i in range(3)])
+
+    async def main():
+        stream = consumer.get_async_stream(2, 10, 0.2)
+        offsets = []
+        async for messages in stream:
+            offsets.extend(m.offset for m in messages)
+            if len(offsets) == 3:
+                break
+        stream.commit({0: 3})
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        t = asyncio.ensure_future(tick())
+        await asyncio.sleep(0)
+        # 拉取线程正在 poll，等待线程退出时事件循环继续运行
+        await stream.close()
+        t.cancel()
+        assert ticks > 1
+        assert await stream.get() is None
+        return offsets
+
+    assert asyncio.run(main()) == [0, 1, 2]
+    assert consumer.commits == [{0: 3}]
+    assert consumer.commit_threads[0] is not threading.main_thread()
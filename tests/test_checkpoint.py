@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import threading
+
+from common.checkpoint import CheckpointStore
+
+
+def new_store(path: str, flush_events: int = 0) -> CheckpointStore:
+    return CheckpointStore(path, 3600, flush_events, 0)
+
+
+def test_update_and_reload():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "checkpoint.json")
+        c = new_store(path)
+        c.update("k", {"a": 1})
+        assert not c.is_flushed()
+        c.flush()
+        assert c.is_flushed()
+        assert new_store(path).get("k") == {"a": 1}
+
+
+def test_flush_by_events():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "checkpoint.json")
+        c = new_store(path, flush_events=2)
+        c.update("k", 1)
+        assert not os.path.exists(path)
+        c.update("k", 2, flush=False)
+        assert c.need_flush()
+        assert not os.path.exists(path)
+        c.update("k", 3)
+        assert c.is_flushed()
+        with open(path) as f:
+            assert json.load(f) == {"k": 3}
+
+
+def test_update_while_writing():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "checkpoint.json")
+        c = new_store(path)
+        started = threading.Event()
+        release = threading.Event()
+        write = c._write
+
+        def slow_write(data: str):
+            started.set()
+            release.wait(5)
+            write(data)
+
+        c._write = slow_write
+        c.update("k", 1)
+        t = threading.Thread(target=c.flush)
+        t.start()
+        assert started.wait(5)
+        # 写文件时不持有锁，可以继续更新
+        c.update("k", 2)
+        release.set()
+        t.join()
+        # 写入的是旧的进度，新的更新仍然需要刷盘
+        assert not c.is_flushed()
+        with open(path) as f:
+            assert json.load(f) == {"k": 1}
+        c._write = write
+        c.flush()
+        assert c.is_flushed()
+        assert new_store(path).get("k") == 2
+
+
+def test_mirror_after_flush():
+    with tempfile.TemporaryDirectory() as d:
+        c = new_store(os.path.join(d, "checkpoint.json"))
+        got = []
+        done = threading.Event()
+
+        def handler(v):
+            got.append(v)
+            done.set()
+
+        c.add_mirror("k", handler)
+        c.update("k", 1)
+        assert not done.is_set()
+        c.flush()
+        assert done.wait(5)
+        assert got == [1]
@@ -0,0 +1,103 @@
+import datetime
+import decimal
+
+from typing import Any, Dict
+
+import pytest
+
+from common import codec
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+
+
+def new_event(columns: int, rows: int) -> ChangeEvent:
+    values = []
+    for r in range(rows):
+        v: Dict[str, Any] = {"id": r, "pidal_c": (1 << 53) | r << 1}
+        for c in range(columns):
+            v["col_{}".format(c)] = [r * c, "v_{}".format(c), None][c % 3]
+        values.append({"values": v})
+    return ChangeEvent(ChangeEventLSN(0, 1, 1, 100),
+                       ChangeEventLSN(0, 1, 1, 200, 9), 1600000000,
+                       EventType.INSERT, 1, "db0", "test", "t", values)
+
+
+def typed_event() -> ChangeEvent:
+    event = new_event(5, 1)
+    event.values[0]["values"].update({
+        "created": datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+        "day": datetime.date(2020, 1, 2),
+        "at": datetime.time(23, 59, 59, 1),
+        "duration": datetime.timedelta(hours=-1, seconds=3),
+        "price": decimal.Decimal("12.3400"),
+        "raw": b"\x00\xff",
+        "big": 2 ** 64 - 1,
+        "negative": -2 ** 40,
+        "tags": {"a", "b"},
+        "doc": {"k": [1, 2]},
+        "ok": True,
+        "rate": 0.5,
+        "text": "中文"})
+    return event
+
+
+@pytest.mark.parametrize("name", codec.CODECS)
+@pytest.mark.parametrize("columns, rows", [(1, 1), (10, 3), (60, 20)])
+def test_round_trip(name: str, columns: int, rows: int):
+    event = new_event(columns, rows)
+    d = codec.decode(codec.encode(event, name))
+    assert d.values == event.values
+    assert d.lsn == event.lsn and d.prev_lsn == event.prev_lsn
+    assert (d.event_type, d.db, d.table, d.timestamp) == \
+        (event.event_type, event.db, event.table, event.timestamp)
+
+
+def test_binary_types():
+    event = typed_event()
+    d = codec.decode(codec.encode(event, codec.CODEC_BINARY))
+    assert d.values == event.values
+    for k, v in event.values[0]["values"].items():
+        assert type(d.values[0]["values"][k]) is type(v), k
+
+
+def test_simple_signatures():
+    # 只有整数、浮点、字符串、NULL 和 bool 的行使用快速路径
+    rows = [{"values": {"a": 1, "b": "中文", "c": None, "d": True,
+                        "e": False, "f": 0.5, "g": ""}},
+            {"values": {"a": 2, "b": "x", "c": None, "d": False,
+                        "e": True, "f": -1.5, "g": "y"}},
+            {"values": {"a": 2 ** 64 - 1, "b": "x", "c": 1, "d": None,
+                        "e": -2 ** 63, "f": 0.0, "g": None}}]
+    event = ChangeEvent(None, ChangeEventLSN(0, 1, 1, 1), 0,
+                        EventType.INSERT, 1, "n0", "db", "t", rows)
+    for _ in range(2):
+        d = codec.decode(codec.encode(event, codec.CODEC_BINARY))
+        assert d.values == rows
+        assert [type(v) for v in d.values[0]["values"].values()] == \
+            [int, str, type(None), bool, bool, float, str]
+
+
+def test_transaction_header():
+    event = typed_event()
+    update = ChangeEvent(None, ChangeEventLSN(0, 1, 2, 250), 1600000000,
+                         EventType.UPDATE, 1, "db0", "test", "t",
+                         [{"before_values": {"id": 1, "v": None},
+                           "after_values": {"id": 2, "v": "x"}}])
+    t = ChangeEvent(None, ChangeEventLSN(0, 1, 2, 300, 10), 1600000000,
+                    EventType.TRANSACTION, 1, "db0", "test", "", [], True,
+                    [event, update], partition=3, barrier=[1, 3])
+    data = codec.encode(t, codec.CODEC_BINARY)
+    assert codec.is_binary(data)
+    header = codec.decode_header(data)
+    assert header.lsn == t.lsn and header.prev_lsn is None
+    assert header.partition == 3 and header.barrier == [1, 3]
+    assert header.is_retry
+    d = codec.decode(data)
+    assert [e.values for e in d.events] == [event.values, update.values]
+    assert d.events[1].event_type is EventType.UPDATE
+
+
+def test_json_is_detected():
+    event = new_event(3, 1)
+    data = codec.encode(event, codec.CODEC_JSON)
+    assert not codec.is_binary(data)
+    assert codec.decode_header(data).lsn == event.lsn
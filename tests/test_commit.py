@@ -0,0 +1,125 @@
+import asyncio
+import os
+import tempfile
+import threading
+from typing import Dict, List, Tuple
+
+from apply.apply import Apply
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+from common.checkpoint import CheckpointStore
+from mq.commit import OffsetCommitter
+from mq.mq import MQMessage
+
+
+def new_committer(interval: float = 3600, messages: int = 0) \
+        -> Tuple[OffsetCommitter, List[Dict[int, int]]]:
+    commits: List[Dict[int, int]] = []
+    return OffsetCommitter(commits.append, interval, messages), commits
+
+
+def test_commits_contiguous_prefix():
+    c, commits = new_committer()
+    messages = [MQMessage(b"k", b"", 0, i) for i in range(10, 14)]
+    for m in messages:
+        c.track(m)
+    # 后面的消息先完成，不能越过未完成的 10
+    c.done(messages[2])
+    c.done(messages[1])
+    c.durable()
+    c.flush()
+    assert commits == []
+    c.done(messages[0])
+    c.durable()
+    c.flush()
+    assert commits == [{0: 13}]
+    c.done(messages[3])
+    c.durable()
+    c.flush()
+    c.flush()
+    assert commits == [{0: 13}, {0: 14}]
+
+
+def test_commits_only_durable_progress():
+    c, commits = new_committer()
+    m = MQMessage(b"k", b"", 1, 5)
+    c.track(m)
+    c.done(m)
+    c.flush()
+    assert commits == []
+    c.durable()
+    c.flush()
+    assert commits == [{1: 6}]
+
+
+def test_envelope_commits_after_last_message():
+    c, commits = new_committer()
+    inner = [MQMessage(b"k", b"", 0, 7, i, 3) for i in range(3)]
+    for m in inner:
+        c.track(m)
+    c.done(inner[0])
+    c.done(inner[1])
+    c.durable()
+    c.flush()
+    # 信封没有全部完成，重启后重新消费整个信封
+    assert commits == [{0: 7}]
+    c.done(inner[2])
+    c.durable()
+    c.flush()
+    assert commits == [{0: 7}, {0: 8}]
+
+
+def test_partitions_are_independent():
+    c, commits = new_committer(messages=2)
+    a, b = MQMessage(b"k", b"", 0, 1), MQMessage(b"k", b"", 1, 1)
+    c.track(a)
+    c.track(b)
+    c.done(b)
+    c.durable()
+    c.maybe_commit()
+    assert commits == []
+    c.done(a)
+    c.durable()
+    c.maybe_commit()
+    assert commits == [{0: 2, 1: 2}]
+
+
+def test_commit_interval():
+    c, commits = new_committer(interval=0)
+    m = MQMessage(b"k", b"", 0, 1)
+    c.track(m)
+    c.done(m)
+    c.durable()
+    c.maybe_commit()
+    assert commits == [{0: 2}]
+
+
+def test_apply_flushes_checkpoint_in_executor():
+    a = Apply.__new__(Apply)
+    a._applied_lsns = {}
+    a.committer, commits = new_committer(interval=0)
+    threads = []
+
+    async def main():
+        with tempfile.TemporaryDirectory() as d:
+            a.checkpoint = CheckpointStore(os.path.join(d, "c.json"), 3600,
+                                           1, 0)
+            a.checkpoint_key = "apply"
+            write = a.checkpoint._write
+
+            def record(data: str):
+                threads.append(threading.current_thread())
+                write(data)
+
+            a.checkpoint._write = record
+            m = MQMessage(b"k", b"v", 0, 10)
+            event = ChangeEvent(None, ChangeEventLSN(0, 1, 1, 4), 0,
+                                EventType.INSERT, 1, "n0", "db", "t", [])
+            a.committer.track(m)
+            a._on_applied(event, m)
+            # 只记录进度，offset 要等刷盘后才提交
+            assert threads == [] and commits == []
+            await a._flush_checkpoint()
+
+    asyncio.run(main())
+    assert threads and threads[0] is not threading.main_thread()
+    assert commits == [{0: 11}]
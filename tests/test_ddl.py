@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+from pymysqlreplication.event import QueryEvent
+
+from replicator.node import NodeReplicator, ddl_tables
+from replicator.partitioner import Partitioner
+
+
+@pytest.mark.parametrize("query, tables", [
+    ("ALTER TABLE t ADD c INT", {("db", "t"): False}),
+    ("alter table `other`.`t` add c int", {("other", "t"): False}),
+    ("CREATE UNIQUE INDEX uk ON `t` (a)", {("db", "t"): False}),
+    ("DROP INDEX uk ON db.t", {("db", "t"): False}),
+    ("CREATE TABLE t (id INT PRIMARY KEY)", {("db", "t"): False}),
+    ("create table if not exists `t` like t_tpl", {("db", "t"): False}),
+    ("DROP TABLE `t` /* generated by server */", {("db", "t"): True}),
+    ("DROP TABLE IF EXISTS a, `db`.`b`",
+     {("db", "a"): True, ("db", "b"): True}),
+    ("RENAME TABLE a TO b", {("db", "a"): True, ("db", "b"): False}),
+    ("/* pt-osc */ ALTER TABLE t ENGINE=InnoDB", {("db", "t"): False}),
+    ("-- cut-over\nRENAME TABLE t TO t_old, t_new TO t",
+     {("db", "t_old"): False, ("db", "t_new"): True, ("db", "t"): False}),
+    ("rename /* gh-ost */ table `db`.`t` to `db`.`_t_del`, "
+     "`db`.`_t_gho` to `db`.`t`",
+     {("db", "_t_del"): False, ("db", "_t_gho"): True, ("db", "t"): False}),
+])
+def test_ddl_tables(query: str, tables: Dict[Any, bool]):
+    assert ddl_tables(query, "db") == tables
+
+
+@pytest.mark.parametrize("query", [
+    "INSERT INTO t VALUES (1)", "TRUNCATE TABLE t", "/* x */ COMMIT",
+    "CREATE TEMPORARY TABLE t (id INT)",
+    "DROP /*!40005 TEMPORARY */ TABLE IF EXISTS t"])
+def test_not_ddl(query: str):
+    assert ddl_tables(query, "db") == {}
+
+
+class FakeStream(object):
+
+    def __init__(self):
+        self.queries: List[Dict[str, str]] = []
+
+    def get_lock_keys(self, table_keys: Dict[str, str]) \
+            -> Dict[str, List[str]]:
+        self.queries.append(table_keys)
+        return {t: ["id"] for t in table_keys}
+
+
+def new_node() -> NodeReplicator:
+    n = NodeReplicator.__new__(NodeReplicator)
+    n.tables = {t: SimpleNamespace(lock_key="PRIMARY") for t in ("t", "u")}
+    n.database = "db"
+    n.compact_update = True
+    n.lock_keys = {"t": ["old"], "u": ["id"]}
+    n.partitioner = Partitioner("table", 1, n.tables, n.lock_keys)
+    n.node_stream = FakeStream()
+    n.node = SimpleNamespace(name="n0")
+    n.zone_id = 1
+    n.transaction_group = False
+    n.current_file_log_index = 1
+    n._prev_lsns = {}
+    n.sent = []
+
+    def send(event, key):
+        n._prev_lsns[event.partition] = event.lsn
+        n.sent.append(event)
+    n._send = send
+    return n
+
+
+def ddl(query: str) -> QueryEvent:
+    e = QueryEvent.__new__(QueryEvent)
+    e.packet = SimpleNamespace(log_pos=100, server_id=1)
+    e.timestamp = 0
+    e.schema = b"db"
+    e.query = query
+    return e
+
+
+def test_cut_over_refreshes_replicated_table():
+    n = new_node()
+    n._ddl_event(ddl("RENAME /* gh-ost */ TABLE t TO _t_del, _t_gho TO t"))
+    assert [e.table for e in n.sent] == ["t"]
+    assert n.node_stream.queries == [{"t": "PRIMARY"}]
+    assert n.lock_keys["t"] == ["id"]
+
+
+def test_rename_events_have_distinct_lsns():
+    n = new_node()
+    n._ddl_event(ddl("RENAME TABLE t TO t_old, u TO t"))
+    assert [e.table for e in n.sent] == ["u", "t"]
+    assert n.sent[0].lsn != n.sent[1].lsn
+    assert n.sent[1].prev_lsn == n.sent[0].lsn
+    # u 被改名，不再有锁字段
+    assert "u" not in n.lock_keys
+
+
+def test_drop_and_create_table():
+    n = new_node()
+    n._ddl_event(ddl("DROP TABLE IF EXISTS u, other"))
+    assert [e.table for e in n.sent] == ["u"]
+    assert n.node_stream.queries == []
+    assert "u" not in n.lock_keys
+    n._ddl_event(ddl("CREATE TABLE u (id INT PRIMARY KEY)"))
+    assert n.node_stream.queries == [{"u": "PRIMARY"}]
+    assert n.lock_keys["u"] == ["id"]
+
+
+def test_ignores_other_schema():
+    n = new_node()
+    n._ddl_event(ddl("ALTER TABLE other.t ADD c INT"))
+    assert n.sent == []
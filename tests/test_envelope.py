@@ -0,0 +1,131 @@
+import time
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+import pytest
+
+from common.config import MQConfig
+from mq import envelope
+from mq.envelope import EnvelopeConsumer, EnvelopeProducer
+from mq.window import SendWindow
+
+
+class FakeProducer(object):
+
+    def __init__(self):
+        self.sent: List[Any] = []
+        self.sync: List[Any] = []
+
+    def send(self, key: bytes, value: bytes):
+        self.sync.append((key, value))
+
+    def send_async(self, key: bytes, value: bytes, callback: Any,
+                   partition: Optional[int] = None):
+        self.sent.append((key, envelope.unpack(value), partition))
+        callback(None)
+
+    def flush(self, timeout: Optional[float] = None):
+        pass
+
+    def flush_pending(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def new_producer(max_events: int = 3, max_bytes: int = 1 << 20,
+                 linger_ms: int = 60000) -> EnvelopeProducer:
+    conf = SimpleNamespace(envelope_max_events=max_events,
+                           envelope_max_bytes=max_bytes,
+                           envelope_linger_ms=linger_ms, compression="none")
+    return EnvelopeProducer(FakeProducer(), conf)
+
+
+@pytest.mark.parametrize("name", list(envelope.COMPRESSIONS.keys()))
+@pytest.mark.parametrize("values", [[], [b""], [b"a", b"", b"x" * 70000]])
+def test_pack_round_trip(name: str, values: List[bytes]):
+    data = envelope.pack(values, envelope.get_compression(name))
+    assert envelope.is_envelope(data)
+    assert envelope.unpack(data) == values
+
+
+def test_unknown_compression():
+    with pytest.raises(Exception):
+        envelope.get_compression("snappy")
+
+
+def test_batch_by_key_and_partition():
+    p = new_producer()
+    acked = []
+    for i, (key, partition) in enumerate([(b"a", 0), (b"a", 1), (b"b", 0),
+                                          (b"a", 0), (b"a", 0)]):
+        p.send_async(key, str(i).encode(), acked.append, partition)
+    # 只有 (a, 0) 达到 3 条
+    assert p.producer.sent == [(b"a", [b"0", b"3", b"4"], 0)]
+    assert acked == [None] * 3
+    p.flush()
+    assert sorted(p.producer.sent[1:]) == [(b"a", [b"1"], 1),
+                                           (b"b", [b"2"], 0)]
+    assert len(acked) == 5
+    p.close()
+
+
+def test_max_bytes():
+    p = new_producer(max_events=100, max_bytes=10)
+    p.send_async(b"a", b"12345", lambda e: None, 0)
+    assert p.producer.sent == []
+    p.send_async(b"a", b"67890", lambda e: None, 0)
+    assert p.producer.sent == [(b"a", [b"12345", b"67890"], 0)]
+    p.close()
+
+
+def test_linger_flushes():
+    p = new_producer(linger_ms=10)
+    p.send_async(b"a", b"1", lambda e: None, 0)
+    deadline = time.monotonic() + 2
+    while not p.producer.sent and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert p.producer.sent == [(b"a", [b"1"], 0)]
+    p.close()
+
+
+def test_sync_send_flushes_same_key_first():
+    p = new_producer()
+    p.send_async(b"t", b"1", lambda e: None)
+    p.send(b"t", b"2")
+    assert p.producer.sent == [(b"t", [b"1"], None)]
+    assert p.producer.sync == [(b"t", b"2")]
+    p.close()
+
+
+def test_consumer_unpacks():
+    data = envelope.pack([b"x", b"y"], envelope.COMPRESSION_ZLIB)
+    records = [SimpleNamespace(key=b"k", value=data, partition=2, offset=7),
+               SimpleNamespace(key=b"k", value=b"{}", partition=2, offset=8)]
+    consumer = EnvelopeConsumer(SimpleNamespace(
+        poll=lambda timeout, max_records: records))
+    messages = consumer.poll(1, 10)
+    assert [(m.value, m.offset, m.index, m.count) for m in messages] == \
+        [(b"x", 7, 0, 2), (b"y", 7, 1, 2), (b"{}", 8, 0, 1)]
+
+
+def test_full_window_flushes_envelopes():
+    # 两个 key 各自都没有攒够，窗口满时发出，不等攒批超时
+    p = new_producer(max_events=3)
+    w = SendWindow(3, on_full=p.flush_pending)
+    for key in (b"a", b"b", b"a", b"b"):
+        seq = w.add(0)
+        p.send_async(key, key, lambda e, seq=seq: w.ack(seq, e), 0)
+    assert sorted(p.producer.sent) == [(b"a", [b"a", b"a"], 0),
+                                       (b"b", [b"b"], 0)]
+    assert w.in_flight() == 1
+    p.close()
+
+
+def test_window_smaller_than_envelope_is_rejected():
+    with pytest.raises(Exception, match="max_in_flight"):
+        MQConfig("kafka", "", "", "t", "g", max_in_flight=10,
+                 envelope_max_events=100)
+    MQConfig("kafka", "", "", "t", "g", max_in_flight=10,
+             envelope_max_events=0)
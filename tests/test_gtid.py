@@ -0,0 +1,83 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from common.dsn import DSN
+from meta.model import DBNode
+from meta.constant import DBNodeType
+from replicator.listener import mysql
+from replicator.listener.mysql import MySQL
+
+UUID = "3e11fa47-71ca-11e1-9e33-c80aa9429562"
+OTHER = "4c9e3dfc-9d25-11e9-8d2e-0242ac1cfd7e"
+
+
+class FakeCursor(object):
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql: str, args: List[Any]):
+        pass
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConn(object):
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.rows)
+
+    def close(self):
+        pass
+
+
+def binlog_events() -> List[Dict[str, Any]]:
+    def gtid(gno: int, end: int) -> Dict[str, Any]:
+        return {"Event_type": "Gtid", "End_log_pos": end,
+                "Info": "SET @@SESSION.GTID_NEXT= '{}:{}'".format(UUID, gno)}
+    return [{"Event_type": "Format_desc", "End_log_pos": 126, "Info": ""},
+            {"Event_type": "Previous_gtids", "End_log_pos": 197,
+             "Info": "{}:1-10,\n{}:1-3".format(UUID, OTHER)},
+            gtid(11, 276), {"Event_type": "Xid", "End_log_pos": 400,
+                            "Info": "COMMIT"},
+            gtid(12, 479), {"Event_type": "Xid", "End_log_pos": 600,
+                            "Info": "COMMIT"}]
+
+
+def new_listener(dsn: str = "mysql://u:p@127.0.0.1:3306/db") -> MySQL:
+    node = DBNode(DBNodeType.SOURCE, "n0", dsn)
+    return MySQL(node, DSN(dsn), 1, ["t"])
+
+
+def test_gtid_executed_at_position(monkeypatch):
+    monkeypatch.setattr(mysql.pymysql, "connect",
+                        lambda **kwargs: FakeConn(binlog_events()))
+    gtids = new_listener().get_gtid_executed("mysql-bin.000002", 400)
+    assert gtids == "{}:1-11,{}:1-3".format(UUID, OTHER) or \
+        gtids == "{}:1-3,{}:1-11".format(OTHER, UUID)
+
+
+def test_gtid_executed_refuses_empty(monkeypatch):
+    rows = [{"Event_type": "Previous_gtids", "End_log_pos": 197,
+             "Info": ""}]
+    monkeypatch.setattr(mysql.pymysql, "connect",
+                        lambda **kwargs: FakeConn(rows))
+    with pytest.raises(Exception):
+        new_listener().get_gtid_executed("mysql-bin.000001", 4)
+
+
+def test_gtid_executed_mariadb():
+    with pytest.raises(Exception):
+        new_listener("mariadb://u:p@127.0.0.1:3306/db").get_gtid_executed(
+            "mysql-bin.000001", 4)
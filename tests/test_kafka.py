@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import List, Optional
+
+from kafka.errors import KafkaTimeoutError
+
+from mq.kafka import KafkaP
+from mq.window import SendWindow
+
+
+class FakeKafkaProducer(object):
+
+    def __init__(self):
+        self.flushes: List[Optional[float]] = []
+
+    def flush(self, timeout: Optional[float] = None):
+        self.flushes.append(timeout)
+        # 消息已经发出，还没有确认
+        raise KafkaTimeoutError("not acked")
+
+
+def new_producer() -> KafkaP:
+    p = KafkaP.__new__(KafkaP)
+    p.kafka = FakeKafkaProducer()
+    p.topic = "t"
+    p.timeout = 1
+    return p
+
+
+def test_flush_pending_does_not_wait():
+    p = new_producer()
+    p.flush_pending()
+    assert p.kafka.flushes == [0]
+
+
+def test_full_window_flushes_kafka():
+    p = new_producer()
+    w = SendWindow(1, on_full=p.flush_pending)
+    s = w.add(1)
+    assert p.kafka.flushes == []
+    t = threading.Thread(target=w.add, args=(2,))
+    t.start()
+    # 窗口满时先发出攒批的消息，然后等待确认
+    for _ in range(500):
+        if p.kafka.flushes:
+            break
+        time.sleep(0.01)
+    assert p.kafka.flushes == [0]
+    assert t.is_alive()
+    w.ack(s)
+    t.join(5)
+    assert not t.is_alive()
+    assert w.in_flight() == 1
@@ -0,0 +1,115 @@
+import copy
+import gc
+import threading
+from typing import Any, Dict, List
+
+from common.circular_version_number import CircularVersionNumber
+from meta.manager import MetaManager, MAX_META_VERSION, \
+        META_VERSION_BUFFERSIZE
+from meta.model import DBConfig, ObjectPool
+
+
+def db_conf(dsn: str) -> Dict[str, Any]:
+    return {
+        "name": "db", "source_replica": {
+            "enable": False, "algorithm": "", "algorithm_args": []},
+        "nodes": [{"type": 1, "name": "n0", "dsn": dsn},
+                  {"type": 1, "name": "n1", "dsn": "mysql://h1/db"}],
+        "tables": [{
+            "type": 2, "name": "t", "status": 3, "zskeys": ["uid"],
+            "zs_algorithm": "mod", "zs_algorithm_args": [1024],
+            "lock_key": "PRIMARY", "strategies": [{"backends": [
+                "n0.t_{0, 512}", "n1.t_{512, 1024, 1}", "n0.t_2048",
+                "n1.raw"]}]}]}
+
+
+def test_unchanged_objects_are_shared():
+    pool = ObjectPool()
+    v1 = DBConfig.new_from_dict(copy.deepcopy(db_conf("mysql://h0/db")),
+                                pool)
+    v2 = DBConfig.new_from_dict(copy.deepcopy(db_conf("mysql://h2/db")),
+                                pool)
+    # 只有变化的节点是新对象
+    assert v1 is not v2
+    assert v1.tables["t"] is v2.tables["t"]
+    assert v1.nodes["n1"] is v2.nodes["n1"]
+    assert v1.nodes["n0"] is not v2.nodes["n0"]
+    backends = v1.tables["t"].strategies[0].backends
+    assert len(backends) == 4 and len(backends[0]) == 512
+    n0 = v1.get_node_tables("n0")
+    assert list(n0) == ["t_{}".format(i) for i in range(512)] + ["t_2048"]
+    assert len(v1.get_node_tables("n1")) == 513
+    del v1
+    gc.collect()
+    # 只被 v1 引用的 n0 被回收
+    assert len(pool) == 3
+
+
+def test_no_pool_builds_new_objects():
+    v1 = DBConfig.new_from_dict(db_conf("mysql://h0/db"))
+    v2 = DBConfig.new_from_dict(db_conf("mysql://h0/db"))
+    assert v1.tables["t"] is not v2.tables["t"]
+
+
+class FakeClient(object):
+
+    def get_zones(self, version: int) -> List[Dict[str, Any]]:
+        return [{"zone_id": 1, "zone_name": "z1", "shardings": []}]
+
+    def get_db(self, version: int, zone_id: int) -> Dict[str, Any]:
+        # 每个版本只有 n0 的地址变化
+        return db_conf("mysql://h{}/db".format(version))
+
+
+def new_manager(retain: int) -> MetaManager:
+    m = MetaManager.__new__(MetaManager)
+    m.versions = {}
+    m.latest_version = 0
+    m.zone_id = 1
+    m._pins = {}
+    m._pool = ObjectPool()
+    m._lock = threading.RLock()
+    m.retain_versions = retain
+    m._pimms_client = FakeClient()
+    m._meta_version_tool = CircularVersionNumber(MAX_META_VERSION,
+                                                 META_VERSION_BUFFERSIZE)
+    return m
+
+
+def load(m: MetaManager, versions: List[int]):
+    for v in versions:
+        m.load_version_meta(v)
+        m.latest_version = v
+
+
+def test_clean_keeps_latest_versions():
+    m = new_manager(3)
+    load(m, range(1, 7))
+    assert sorted(m.versions.keys()) == [4, 5, 6]
+    # 所有版本共享同一个表对象
+    tables = {id(m.get_db(v).tables["t"]) for v in m.versions}
+    assert len(tables) == 1
+    gc.collect()
+    # 清理的版本的 db 和 n0 被回收，n1 和 t 共享
+    kinds = sorted(k[0] for k in m._pool._objects.keys())
+    assert kinds == ["db"] * 3 + ["node"] * 4 + ["table"]
+
+
+def test_clean_keeps_pinned_versions():
+    m = new_manager(2)
+    load(m, [1, 2])
+    m.pin(1)
+    load(m, [3, 4])
+    assert sorted(m.versions.keys()) == [1, 3, 4]
+    m.pin(1)
+    m.unpin(1)
+    assert 1 in m.versions
+    m.unpin(1)
+    assert sorted(m.versions.keys()) == [3, 4]
+
+
+def test_clean_orders_circular_versions():
+    m = new_manager(2)
+    load(m, [MAX_META_VERSION - 1, MAX_META_VERSION, 1])
+    # 版本号回绕之后 1 是最新的版本
+    assert sorted(m.versions.keys()) == [1, MAX_META_VERSION]
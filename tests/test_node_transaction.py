@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+from typing import Any, List
+
+import pytest
+
+from pymysqlreplication.event import GtidEvent, MariadbGtidEvent, \
+        QueryEvent, XidEvent
+from pymysqlreplication.gtid import GtidSet
+from pymysqlreplication.row_event import WriteRowsEvent
+
+from replicator.node import NodeReplicator
+
+UUID = "3e11fa47-71ca-11e1-9e33-c80aa9429562"
+SID = bytes.fromhex(UUID.replace("-", ""))
+
+
+def new_event(cls: type, log_pos: int, **kwargs: Any) -> Any:
+    e = cls.__new__(cls)
+    e.packet = SimpleNamespace(log_pos=log_pos)
+    e.event_size = 10
+    for k, v in kwargs.items():
+        setattr(e, k, v)
+    return e
+
+
+def new_node(gtid: bool = False) -> NodeReplicator:
+    n = NodeReplicator.__new__(NodeReplicator)
+    n._running = True
+    n._in_transaction = False
+    n._explicit_begin = False
+    n._transaction_events = {}
+    n._transaction_barrier = set()
+    n._prev_lsns = {}
+    n._current_gtid = None
+    n.gtid_set = GtidSet(UUID + ":1-10") if gtid else None
+    n._gtid = str(n.gtid_set) if gtid else None
+    n.current_file_log = "mysql-bin.000001"
+    n.current_log_pos = 4
+    n._events = 0
+    n._bytes = 0
+    n._next_meta = None
+    n.positions = []
+    n._report_process = lambda: n.positions.append(n.current_log_pos)
+    n._ddl_event = lambda event: None
+    n.sent = []
+    n._send = lambda event, key: n.sent.append(event)
+    n.node = SimpleNamespace(name="n0")
+    n.zone_id = 1
+    n.current_file_log_index = 1
+
+    def insert(event: WriteRowsEvent):
+        n._transaction_events.setdefault(0, []).append(event)
+    n._insert_event = insert
+    return n
+
+
+def positions(node: NodeReplicator, events: List[Any]) -> List[int]:
+    result = []
+    for e in events:
+        node._consume([e])
+        result.append(node.current_log_pos)
+    return result
+
+
+@pytest.fixture(autouse=True)
+def new_transaction(monkeypatch):
+    monkeypatch.setattr("common.change_event.ChangeEvent.new_transaction",
+                        lambda *args: SimpleNamespace(events=args[6]))
+
+
+def test_mariadb_gtid_opens_transaction():
+    n = new_node()
+    events = [new_event(MariadbGtidEvent, 100, gtid="0-1-5"),
+              new_event(WriteRowsEvent, 200),
+              new_event(XidEvent, 300, xid=1)]
+    # 行还在缓冲中时不能推进进度
+    assert positions(n, events) == [4, 4, 300]
+    assert not n._in_transaction
+    assert len(n.sent) == 1
+
+
+def test_lowercase_begin():
+    n = new_node()
+    events = [new_event(QueryEvent, 100, query="begin", schema=b"db"),
+              new_event(WriteRowsEvent, 200)]
+    assert positions(n, events) == [4, 4]
+    assert n._in_transaction
+
+
+def test_gtid_event_is_not_a_checkpoint():
+    n = new_node(gtid=True)
+    events = [new_event(GtidEvent, 100, sid=SID, gno=11),
+              new_event(QueryEvent, 150, query="BEGIN", schema=b"db"),
+              new_event(WriteRowsEvent, 200),
+              new_event(XidEvent, 300, xid=1)]
+    assert positions(n, events) == [4, 4, 4, 300]
+    assert n._gtid == UUID + ":1-11"
+
+
+def test_ddl_after_gtid_commits():
+    n = new_node(gtid=True)
+    events = [new_event(GtidEvent, 100, sid=SID, gno=11),
+              new_event(QueryEvent, 200, query="ALTER TABLE t ADD c INT",
+                        schema=b"db")]
+    assert positions(n, events) == [4, 200]
+    assert not n._in_transaction
+    assert n._gtid == UUID + ":1-11"
@@ -0,0 +1,47 @@
+from replicator.node import NodeReplicator
+from replicator.partitioner import Partitioner, PARTITION_BY_LOCK_KEY
+
+
+def new_partitioner() -> Partitioner:
+    return Partitioner(PARTITION_BY_LOCK_KEY, 16, {}, {"t": ["id"]})
+
+
+def find_moving_update(p: Partitioner):
+    for i in range(1, 100):
+        if p.get_partition("t", {"id": 0}) != p.get_partition("t",
+                                                               {"id": i}):
+            return {"before_values": {"id": 0, "v": 1},
+                    "after_values": {"id": i, "v": 1}}
+    raise AssertionError("no moving key")
+
+
+def test_update_keeps_partition():
+    p = new_partitioner()
+    row = {"before_values": {"id": 7, "v": 1},
+           "after_values": {"id": 7, "v": 2}}
+    assert p.get_row_partitions("t", row) == \
+        [p.get_partition("t", {"id": 7})]
+    assert p.get_row_partitions("t", {"values": {"id": 7}}) == \
+        [p.get_partition("t", {"id": 7})]
+
+
+def test_update_moving_key():
+    p = new_partitioner()
+    row = find_moving_update(p)
+    before = p.get_partition("t", row["before_values"])
+    after = p.get_partition("t", row["after_values"])
+    assert p.get_row_partitions("t", row) == [before, after]
+
+
+def test_split_sends_moving_update_to_both_partitions():
+    node = NodeReplicator.__new__(NodeReplicator)
+    node.partitioner = new_partitioner()
+    moving = find_moving_update(node.partitioner)
+    same = {"before_values": {"id": 5, "v": 1},
+            "after_values": {"id": 5, "v": 2}}
+    parts, barrier = node._split("t", [moving, same])
+    before = node.partitioner.get_partition("t", moving["before_values"])
+    after = node.partitioner.get_partition("t", moving["after_values"])
+    assert barrier == sorted([before, after])
+    assert moving in parts[before] and moving in parts[after]
+    assert sum(r is same for rows in parts.values() for r in rows) == 1
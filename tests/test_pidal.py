@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from common import pidal
+
+ZONE_MAX = 2 ** (64 - pidal.ZONE_SHIFT) - 1
+
+
+def legacy(pidal_c: int):
+    """ 旧的字符串切片实现 """
+    p = bin(pidal_c)
+    return pidal_c >> 53, int(p[-53:-33], 2), int(p[-21:-1], 2)
+
+
+@pytest.mark.parametrize("zone", [0, 1, ZONE_MAX])
+@pytest.mark.parametrize("meta", [0, 1, pidal.META_VERSION_MASK])
+@pytest.mark.parametrize("data", [0, 1, pidal.DATA_VERSION_MASK])
+@pytest.mark.parametrize("lock", [False, True])
+def test_round_trip_boundaries(zone, meta, data, lock):
+    v = pidal.encode(zone, meta, data, lock)
+    assert 0 <= v < 2 ** 64
+    assert pidal.decode(v) == (zone, meta, data, lock)
+    assert pidal.get_zone(v) == zone
+    assert pidal.get_data_version(v) == data
+    assert pidal.is_lock(v) is lock
+
+
+def test_fields_do_not_overlap():
+    full = pidal.encode(ZONE_MAX, pidal.META_VERSION_MASK,
+                        pidal.DATA_VERSION_MASK, True)
+    assert pidal.decode(full & ~pidal.LOCK_MASK) == \
+        (ZONE_MAX, pidal.META_VERSION_MASK, pidal.DATA_VERSION_MASK, False)
+    only_meta = pidal.encode(0, pidal.META_VERSION_MASK, 0)
+    assert pidal.decode(only_meta) == (0, pidal.META_VERSION_MASK, 0, False)
+    only_data = pidal.encode(0, 0, pidal.DATA_VERSION_MASK)
+    assert pidal.decode(only_data) == (0, 0, pidal.DATA_VERSION_MASK, False)
+
+
+def test_reserved_bits_are_ignored():
+    v = pidal.encode(3, 5, 7, True) | (0xFFF << 21)
+    assert pidal.decode(v) == (3, 5, 7, True)
+
+
+@pytest.mark.parametrize("meta, data", [(pidal.META_VERSION_MASK + 1, 0),
+                                        (0, pidal.DATA_VERSION_MASK + 1),
+                                        (-1, 0)])
+def test_encode_out_of_range(meta, data):
+    with pytest.raises(Exception):
+        pidal.encode(1, meta, data)
+
+
+def test_matches_legacy_decoder():
+    rnd = random.Random(0)
+    for _ in range(2000):
+        d = (rnd.randint(1, ZONE_MAX), rnd.randint(0, pidal.META_VERSION_MASK),
+             rnd.randint(0, pidal.DATA_VERSION_MASK), rnd.random() < 0.5)
+        v = pidal.encode(*d) | (rnd.getrandbits(12) << 21)
+        assert legacy(v) == d[:3]
+        assert pidal.decode(v) == d
+
+
+def test_batch_matches_scalar():
+    rnd = random.Random(1)
+    values = [pidal.encode(rnd.randint(1, ZONE_MAX),
+                           rnd.randint(0, pidal.META_VERSION_MASK),
+                           rnd.randint(0, pidal.DATA_VERSION_MASK),
+                           rnd.random() < 0.5) for _ in range(200)]
+    columns = pidal.decode_batch(values)
+    assert [list(map(int, c)) for c in columns[:3]] == \
+        [[pidal.decode(v)[i] for v in values] for i in range(3)]
+    assert list(map(bool, columns[3])) == [pidal.is_lock(v) for v in values]
+    assert list(map(int, pidal.get_zones(values))) == \
+        [pidal.get_zone(v) for v in values]
+    assert pidal.encode_batch(*columns) == values
+    assert pidal.decode_batch([]) == [[], [], [], []]
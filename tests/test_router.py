@@ -0,0 +1,50 @@
+import pytest
+
+from common import router
+from common.router import Router
+from meta.model import DBTable
+
+ZONES = {i: i % 2 + 1 for i in range(8)}
+
+
+def mod_table(modulus: int = 8) -> DBTable:
+    return DBTable(None, "t", None, ["uid"], "mod", [modulus], "PRIMARY", [])
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def use_numpy(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(router, "numpy", None)
+    elif router.numpy is None:
+        pytest.skip("numpy is not installed")
+
+
+def test_mod_route(use_numpy):
+    r = Router({"t_0": mod_table(), "t_1": mod_table()}, ZONES)
+    # 同一个逻辑表的物理表共用一个 TableRoute
+    assert r.routes["t_0"] is r.routes["t_1"]
+    rows = [{"uid": i} for i in range(100)]
+    expect = [ZONES[i % 8] for i in range(100)]
+    assert [r.get_zone("t_0", i) for i in rows] == expect
+    assert list(r.get_zones("t_0", rows)) == expect
+    assert r.get_zsid("t_0", {"uid": 13}) == 5
+
+
+def test_unknown_zsid(use_numpy):
+    r = Router({"t_0": mod_table(16)}, ZONES)
+    assert r.get_zone("t_0", {"uid": 7}) == ZONES[7]
+    with pytest.raises(Exception, match=r"zsid \[9\]"):
+        r.get_zone("t_0", {"uid": 9})
+    with pytest.raises(Exception, match=r"zsid \[9\]"):
+        r.get_zones("t_0", [{"uid": 1}, {"uid": 25}])
+
+
+def test_algorithm_fallback():
+    # 多个 zskey 时退回到 Algorithm，mod(m, uid)
+    t = DBTable(None, "t", None, ["m", "uid"], "mod", [], "PRIMARY", [])
+    r = Router({"t_0": t}, ZONES)
+    assert r.routes["t_0"].modulus is None
+    rows = [{"m": 8, "uid": i} for i in range(20)]
+    assert r.get_zones("t_0", rows) == [ZONES[i % 8] for i in range(20)]
+    with pytest.raises(Exception):
+        r.get_zone("t_0", {"m": 10, "uid": 9})
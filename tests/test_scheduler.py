@@ -0,0 +1,169 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from apply.scheduler import Scheduler
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+
+
+def new_event(position: int, event_type: EventType, rows: List[Any],
+              events: Optional[List[ChangeEvent]] = None) -> ChangeEvent:
+    return ChangeEvent(None, ChangeEventLSN(0, 1, 1, position), 0,
+                       event_type, 1, "n0", "db", "t", rows, False, events)
+
+
+def insert(position: int, *ids: int) -> ChangeEvent:
+    return new_event(position, EventType.INSERT,
+                     [{"values": {"id": i}} for i in ids])
+
+
+class Recorder(object):
+    """ 按 id 控制每个事件什么时候完成 """
+
+    def __init__(self, lanes: int = 4):
+        self.started: List[Any] = []
+        self.applied: List[int] = []
+        self.gates: Dict[int, asyncio.Event] = {}
+        self.scheduler = Scheduler(lanes, 100, self.get_key, self.apply,
+                                   self.on_applied)
+
+    @staticmethod
+    def get_key(table: str, values: Dict[str, Any]):
+        return (values["id"],)
+
+    def gate(self, position: int) -> asyncio.Event:
+        return self.gates.setdefault(position, asyncio.Event())
+
+    async def apply(self, event: ChangeEvent, lane: Optional[int]):
+        position = event.lsn.log_position
+        self.started.append((position, lane))
+        if position in self.gates:
+            await self.gates[position].wait()
+        if position < 0:
+            raise Exception("apply error")
+
+    def on_applied(self, event: ChangeEvent, context: Any):
+        self.applied.append(context)
+
+
+def lanes_of(r: Recorder, *ids: int) -> List[int]:
+    return [r.scheduler._get_lane("t", {"id": i}) for i in ids]
+
+
+def different_ids(r: Recorder) -> List[int]:
+    """ 两个不同 lane 的 id """
+    lanes = lanes_of(r, *range(100))
+    return [0, next(i for i in range(100) if lanes[i] != lanes[0])]
+
+
+def test_applied_in_submit_order():
+    async def main():
+        r = Recorder()
+        a, b = different_ids(r)
+        s = r.scheduler
+        s.start()
+        r.gate(1)
+        await s.submit(insert(1, a), 1)
+        await s.submit(insert(2, b), 2)
+        await asyncio.sleep(0.01)
+        # 2 已经完成，但是 1 没有完成，不能回调
+        assert sorted(p for p, _ in r.started) == [1, 2]
+        assert r.applied == []
+        r.gate(1).set()
+        await s.drain()
+        assert r.applied == [1, 2]
+        await s.close()
+    asyncio.run(main())
+
+
+def test_same_key_keeps_order():
+    async def main():
+        r = Recorder()
+        s = r.scheduler
+        s.start()
+        r.gate(1)
+        for i in range(1, 4):
+            await s.submit(insert(i, 7), i)
+        await asyncio.sleep(0.01)
+        assert r.started == [(1, lanes_of(r, 7)[0])]
+        r.gate(1).set()
+        await s.drain()
+        assert [p for p, _ in r.started] == [1, 2, 3]
+        assert r.applied == [1, 2, 3]
+        await s.close()
+    asyncio.run(main())
+
+
+def test_ddl_is_a_barrier():
+    async def main():
+        r = Recorder()
+        a, b = different_ids(r)
+        s = r.scheduler
+        s.start()
+        r.gate(1)
+        await s.submit(insert(1, a), 1)
+        ddl = asyncio.ensure_future(
+            s.submit(new_event(2, EventType.DDL, []), 2))
+        await asyncio.sleep(0.01)
+        # DDL 等待所有 lane 完成
+        assert not ddl.done() and [p for p, _ in r.started] == [1]
+        r.gate(1).set()
+        await ddl
+        await s.submit(insert(3, b), 3)
+        await s.drain()
+        assert r.started[1] == (2, None)
+        assert r.applied == [1, 2, 3]
+        await s.close()
+    asyncio.run(main())
+
+
+def test_events_across_lanes():
+    async def main():
+        r = Recorder()
+        a, b = different_ids(r)
+        s = r.scheduler
+        s.start()
+        # 非事务消息按 lane 拆分，全部完成后才回调一次
+        await s.submit(insert(1, a, b), 1)
+        # 跨 lane 的事务和修改锁字段的 UPDATE 单独执行
+        await s.submit(new_event(2, EventType.TRANSACTION, [],
+                                 [insert(2, a), insert(2, b)]), 2)
+        await s.submit(new_event(3, EventType.UPDATE, [{
+            "before_values": {"id": a}, "after_values": {"id": b}}]), 3)
+        await s.drain()
+        assert sorted(r.started[:2]) == sorted(zip([1, 1], lanes_of(r, a, b)))
+        assert r.started[2:] == [(2, None), (3, None)]
+        assert r.applied == [1, 2, 3]
+        await s.close()
+    asyncio.run(main())
+
+
+def test_error_stops_scheduler():
+    async def main():
+        r = Recorder()
+        s = r.scheduler
+        s.start()
+        await s.submit(insert(-1, 1), 1)
+        with pytest.raises(Exception, match="apply error"):
+            await s.drain()
+        with pytest.raises(Exception, match="apply error"):
+            await s.submit(insert(2, 1), 2)
+        assert r.applied == []
+        for i in s._workers:
+            i.cancel()
+    asyncio.run(main())
+
+
+def test_unknown_key_runs_alone():
+    async def main():
+        r = Recorder()
+        s = r.scheduler
+        s.start()
+        # 取不到锁字段时不抛出 KeyError，单独交给 apply 处理
+        await s.submit(new_event(1, EventType.INSERT,
+                                 [{"values": {"x": 1}}]), 1)
+        await s.close()
+        assert r.started == [(1, None)]
+        assert r.applied == [1]
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from apply.apply import Apply
+from common.schema import SchemaCache
+
+
+def test_cache_file(tmp_path):
+    path = str(tmp_path / "schema_cache.json")
+    c = SchemaCache(path)
+    c.save("n0.db", [2, 7], {("t_0", "PRIMARY"): ["id"]})
+    c.save("n0.db", [2, 7], {("t_1", "uk"): ["a", "b"]})
+    c2 = SchemaCache(path)
+    assert c2.get("n0.db", [2, 7]) == {("t_0", "PRIMARY"): ["id"],
+                                       ("t_1", "uk"): ["a", "b"]}
+    # 校验和变化时整个库失效
+    assert c2.get("n0.db", [2, 8]) == {}
+    c2.save("n0.db", [2, 8], {("t_1", "uk"): ["a"]})
+    assert SchemaCache(path).get("n0.db", [2, 8]) == {("t_1", "uk"): ["a"]}
+    with open(path) as f:
+        assert list(json.load(f).keys()) == ["n0.db"]
+
+
+def test_memory_only():
+    c = SchemaCache("")
+    c.save("n0.db", [1, 1], {("t", "PRIMARY"): ["id"]})
+    assert c.get("n0.db", [1, 1]) == {("t", "PRIMARY"): ["id"]}
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.tables: List[List[str]] = []
+
+    async def query(self, sql: str, args: List[Any]) -> List[Dict]:
+        if "BIT_XOR" in sql:
+            return [{"n": 3, "crc": 99}]
+        self.tables.append(args[1:])
+        return [{"TABLE_NAME": t, "INDEX_NAME": "PRIMARY",
+                 "SEQ_IN_INDEX": 1, "COLUMN_NAME": "id"} for t in args[1:]]
+
+
+def new_apply(tables: List[str]) -> Apply:
+    a = Apply.__new__(Apply)
+    a.node = SimpleNamespace(name="n0", dsn="mysql://u:p@h:3306/db")
+    a.client = FakeClient()
+    a.schema_cache = SchemaCache("")
+    a.zsid = {}
+    a.current_version = 1
+    a.meta_manager = SimpleNamespace(get_db=lambda version: SimpleNamespace(
+        get_node_tables=lambda node: {t: SimpleNamespace(
+            name="t", lock_key="PRIMARY", zskeys=["id"], zs_algorithm="mod",
+            zs_algorithm_args=[2]) for t in a.node_tables}))
+    a.node_tables = tables
+    return a
+
+
+def test_switch_version_queries_new_tables():
+    a = new_apply(["t_0", "t_1"])
+    asyncio.run(a.get_tables())
+    assert a.client.tables == [["t_0", "t_1"]]
+    # 新版本增加了一个表，只查询这个表
+    a.node_tables = ["t_0", "t_1", "t_2"]
+    a.current_version = 2
+    asyncio.run(a.get_tables())
+    assert a.client.tables == [["t_0", "t_1"], ["t_2"]]
+    assert a.tables == {"t_0": ["id"], "t_1": ["id"], "t_2": ["id"]}
+    asyncio.run(a.get_tables())
+    assert len(a.client.tables) == 2
@@ -0,0 +1,119 @@
+import copy
+import threading
+
+from typing import Any, Dict, List
+
+from common.config import SnapshotConfig
+from replicator.snapshot import Snapshot
+
+
+class FakeCursor(object):
+
+    def __init__(self, conn: 'FakeConn'):
+        self.conn = conn
+        self.rows: List[Dict[str, Any]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql: str, args: List[Any] = None):
+        self.conn.queries.append((sql, list(args or [])))
+        self.rows = list(self.conn.results.pop(0))
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size: int) -> List[Dict[str, Any]]:
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConn(object):
+
+    def __init__(self, results: List[List[Dict[str, Any]]]):
+        self.results = results
+        self.queries: List[Any] = []
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+
+def new_snapshot(tables: List[str], chunk_size: int = 2) -> Snapshot:
+    s = Snapshot.__new__(Snapshot)
+    s.tables = tables
+    s.conf = SnapshotConfig(True, 4, chunk_size, 1)
+    s.emitted = []
+    s.emit = lambda table, rows, position: s.emitted.append((table, rows))
+    s.sync = lambda: None
+    s.saved = []
+    s._save = lambda state: s.saved.append(copy.deepcopy(state))
+    s._position = ("mysql-bin.000001", 4, None)
+    s._errors = []
+    s._lock = threading.Lock()
+    return s
+
+
+def key_row(table: str, index: str, seq: int, column: str) \
+        -> Dict[str, Any]:
+    return {"TABLE_NAME": table, "INDEX_NAME": index, "SEQ_IN_INDEX": seq,
+            "COLUMN_NAME": column}
+
+
+def test_primary_keys_without_primary():
+    s = new_snapshot(["t", "log"])
+    s.dsn = type("DSN", (), {"database": "db"})()
+    conn = FakeConn([[key_row("t", "PRIMARY", 1, "id"),
+                      key_row("log", "uk_name", 1, "name")]])
+    assert s._get_primary_keys(conn) == {"t": ["id"], "log": []}
+
+
+def test_table_without_primary_is_one_chunk():
+    s = new_snapshot(["log"])
+    s._primary_keys = {"log": []}
+    s._chunks = Snapshot._get_chunks({"log": None}, 4)
+    assert s._chunks == [["log", None, None]]
+    s._state = {"done": [], "last": {}}
+    rows = [{"name": str(i)} for i in range(5)]
+    conn = FakeConn([rows])
+    s._read_chunk(conn, 0, 0)
+    assert conn.queries == [("SELECT * FROM `log`", [])]
+    assert [r for _, b in s.emitted for r in b] == rows
+    assert s._state["done"] == [0]
+
+
+def test_sparse_bigint_key_chunks_are_bounded():
+    lo, hi = 1, 2 ** 62
+    chunks = Snapshot._get_chunks({"t": [lo, hi]}, 4)
+    assert len(chunks) == 4
+    assert chunks[0][1] == lo and chunks[-1][2] == hi + 1
+    for a, b in zip(chunks, chunks[1:]):
+        assert a[2] == b[1]
+
+
+def test_keyset_pagination():
+    s = new_snapshot(["t"], chunk_size=2)
+    s._primary_keys = {"t": ["id"]}
+    s._chunks = [["t", 1, 100]]
+    s._state = {"done": [], "last": {}}
+    conn = FakeConn([[{"id": 3}, {"id": 50}], [{"id": 99}]])
+    s._read_chunk(conn, 0, 0)
+    assert conn.queries == [
+        ("SELECT * FROM `t` WHERE `id` >= %s AND `id` < %s "
+         "ORDER BY `id` LIMIT 2", [1, 100]),
+        ("SELECT * FROM `t` WHERE `id` >= %s AND `id` < %s AND "
+         "(`id`) > (%s) ORDER BY `id` LIMIT 2", [1, 100, 50])]
+    # 第一页之后记录最后的主键，读完后标记完成
+    assert s.saved[0]["last"] == {"0": [50]}
+    assert s._state["done"] == [0] and s._state["last"] == {}
+
+
+def test_resume_composite_key():
+    sql, args = Snapshot._page_query(["t", None, None], ["a", "b"], [1, "x"],
+                                     10)
+    assert sql == "SELECT * FROM `t` WHERE (`a`, `b`) > (%s, %s) " \
+        "ORDER BY `a`, `b` LIMIT 10"
+    assert args == [1, "x"]
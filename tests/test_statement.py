@@ -0,0 +1,37 @@
+from pymysql.converters import escape_item
+
+from apply import statement
+
+
+def render(s: statement.Statement) -> str:
+    sql, args = s
+    return sql % tuple(escape_item(a, "utf8") for a in args)
+
+
+def test_templates():
+    values = {"id": 1, "k": 2, "name": "a"}
+    assert statement.select_for_update("t", ["id", "k"], values) == (
+        "SELECT * FROM `t` WHERE `id` = %s AND `k` = %s FOR UPDATE", [1, 2])
+    assert statement.lock("t", ["id"], values) == (
+        "UPDATE `t` SET `pidal_c` = `pidal_c` | 1 WHERE `id` = %s", [1])
+    assert statement.insert("t", values) == (
+        "INSERT INTO `t` (`id`, `k`, `name`) VALUES (%s, %s, %s)",
+        [1, 2, "a"])
+    assert statement.update("t", ["id"], {"name": "b"}, values) == (
+        "UPDATE `t` SET `name` = %s WHERE `id` = %s", ["b", 1])
+    assert statement.delete("t", ["id"], values) == (
+        "DELETE FROM `t` WHERE `id` = %s", [1])
+
+
+def test_values_are_escaped_by_driver():
+    values = {"id": 1, "memo": None, "name": "it's"}
+    sql = render(statement.insert("t", values))
+    assert sql == "INSERT INTO `t` (`id`, `memo`, `name`) " \
+        "VALUES (1, NULL, 'it\\'s')"
+
+
+def test_template_depends_on_columns():
+    a = statement.insert("t", {"id": 1, "name": "a"})[0]
+    b = statement.insert("t", {"name": "a", "id": 1})[0]
+    assert a != b
+    assert statement.insert("t", {"id": 2, "name": "b"})[0] is a
@@ -0,0 +1,134 @@
+import asyncio
+import json
+from typing import Any, List, Optional
+
+from apply.watermark import Watermark, _position
+from common.change_event import ChangeEvent, ChangeEventLSN, EventType
+
+
+def lsn(position: int, log_index: int = 1) -> ChangeEventLSN:
+    return ChangeEventLSN(0, 1, log_index, position)
+
+
+def new_event(position: int, partition: int = 0,
+              barrier: Optional[List[int]] = None,
+              event_type: EventType = EventType.INSERT) -> ChangeEvent:
+    return ChangeEvent(None, lsn(position), 0, event_type, 1, "n0", "db",
+                       "t", [], partition=partition, barrier=barrier)
+
+
+def row(partition: int, lane: int, lanes: int, position: int):
+    return {"source_zone_id": 1, "partition_id": partition, "lane": lane,
+            "lanes": lanes, "lsn": json.dumps(lsn(position).encode())}
+
+
+class FakeCursor(object):
+
+    def __init__(self, rows: List[Any]):
+        self.rows = rows
+        self.executed: List[Any] = []
+
+    async def execute(self, sql: str, args: Any = None):
+        self.executed.append((sql, args))
+
+    async def fetchall(self):
+        return self.rows
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeConn(object):
+
+    def __init__(self, cur: FakeCursor):
+        self.cur = cur
+
+    def cursor(self):
+        return self.cur
+
+    async def begin(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeClient(object):
+
+    def __init__(self, rows: List[Any]):
+        self.conn = FakeConn(FakeCursor(rows))
+
+    async def acquire(self):
+        return self.conn
+
+    def release(self, conn: FakeConn):
+        pass
+
+
+def test_position_order():
+    assert _position(lsn(10)) < _position(lsn(9, 2))
+    assert _position(lsn(9)) < _position(lsn(10))
+
+
+def test_is_applied_per_lane():
+    w = Watermark("n0", 2)
+    w.commit({(1, 0, 0): lsn(100)})
+    assert w.is_applied(new_event(100), 0)
+    assert w.is_applied(new_event(50), 0)
+    assert not w.is_applied(new_event(101), 0)
+    assert not w.is_applied(new_event(50), 1)
+    assert not w.is_applied(new_event(50, partition=1), 0)
+    # 跨 lane 的事件需要所有 lane 都超过
+    assert not w.is_applied(new_event(50), None)
+    w.commit({(1, 0, 1): lsn(60)})
+    assert w.is_applied(new_event(50), None)
+    # 全量数据总是应用
+    assert not w.is_applied(new_event(1, event_type=EventType.SNAPSHOT), 0)
+
+
+def test_commit_keeps_maximum():
+    w = Watermark("n0", 1)
+    w.commit({(1, 0, 0): lsn(100)})
+    w.commit({(1, 0, 0): lsn(90)})
+    assert w.lsns[(1, 0, 0)] == lsn(100)
+
+
+def test_save_barrier_partitions():
+    w = Watermark("n0", 2)
+    cur = FakeCursor([])
+    events = [new_event(10, 0, [0, 2]), new_event(20, 0, [0, 2]),
+              new_event(5, event_type=EventType.SNAPSHOT)]
+    lsns = asyncio.run(w.save(cur, events, 1))
+    assert lsns == {(1, 0, 1): lsn(20), (1, 2, 1): lsn(20)}
+    (sql, args), = cur.executed
+    assert "ON DUPLICATE KEY UPDATE" in sql
+    assert args[:6] == [1, "n0", 0, 1, 2, _position(lsn(20))]
+    assert len(args) == 14
+    w.commit(lsns)
+    assert w.is_applied(new_event(20, 2), 1)
+
+
+def test_load_same_lanes():
+    w = Watermark("n0", 2)
+    client = FakeClient([row(0, 0, 2, 10), row(0, 1, 2, 20)])
+    asyncio.run(w.load(client))
+    assert w.lsns == {(1, 0, 0): lsn(10), (1, 0, 1): lsn(20)}
+    assert not any(s.startswith("DELETE") for s, _ in client.conn.cur.executed)
+
+
+def test_load_lanes_changed():
+    w = Watermark("n0", 3)
+    # 分区 0 完整，取最小值；分区 1 缺少 lane，丢弃
+    client = FakeClient([row(0, 0, 2, 10), row(0, 1, 2, 20),
+                         row(1, 0, 2, 30)])
+    asyncio.run(w.load(client))
+    assert w.lsns == {(1, 0, i): lsn(10) for i in range(3)}
+    executed = [s for s, _ in client.conn.cur.executed]
+    assert executed[2].startswith("DELETE")
+    assert executed[3].startswith("INSERT")
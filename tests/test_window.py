@@ -0,0 +1,112 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from mq.window import SendWindow
+from replicator.node import NodeReplicator
+
+
+def test_position_waits_for_earlier_acks():
+    w = SendWindow(10, ("f", 4))
+    s1 = w.add(("f", 10))
+    s2 = w.add(("f", 20))
+    s3 = w.add(("f", 30))
+    assert w.committed(("f", 30)) == ("f", 4)
+    # 后发的先确认，进度不能越过未确认的消息
+    w.ack(s2)
+    w.ack(s3)
+    assert w.committed(("f", 30)) == ("f", 4)
+    assert w.in_flight() == 3
+    w.ack(s1)
+    assert w.in_flight() == 0
+    assert w.committed(("f", 40)) == ("f", 40)
+
+
+def test_full_window_blocks_until_ack():
+    w = SendWindow(2)
+    s1 = w.add(1)
+    w.add(2)
+    added = threading.Event()
+
+    def add():
+        w.add(3)
+        added.set()
+    t = threading.Thread(target=add, daemon=True)
+    t.start()
+    assert not added.wait(0.05)
+    w.ack(s1)
+    assert added.wait(1)
+    t.join(1)
+    assert w.in_flight() == 2
+
+
+def test_error_wakes_up_and_raises():
+    w = SendWindow(1)
+    s1 = w.add(1)
+    errors = []
+
+    def add():
+        try:
+            w.add(2)
+        except Exception as e:
+            errors.append(e)
+    t = threading.Thread(target=add, daemon=True)
+    t.start()
+    w.ack(s1, Exception("broker down"))
+    t.join(1)
+    assert len(errors) == 1 and "broker down" in str(errors[0])
+    with pytest.raises(Exception):
+        w.committed(2)
+
+
+def test_full_window_calls_on_full():
+    calls = []
+
+    def on_full():
+        # 在锁外调用，回调中可以确认消息
+        calls.append(w.in_flight())
+        w.ack(s1)
+    w = SendWindow(1, on_full=on_full)
+    s1 = w.add(1)
+    w.add(2)
+    assert calls == [1]
+    assert w.in_flight() == 1
+
+
+def test_check_keeps_position():
+    w = SendWindow(10, ("f", 4))
+    w.check()
+    assert w.committed(("f", 10)) == ("f", 10)
+    s = w.add(("f", 20))
+    w.check()
+    assert w.committed(("f", 30)) == ("f", 10)
+    w.ack(s, Exception("broken"))
+    with pytest.raises(Exception, match="broken"):
+        w.check()
+
+
+def test_sync_then_report_with_pending_sends():
+    n = NodeReplicator.__new__(NodeReplicator)
+    n.window = SendWindow(10)
+    n.mq = SimpleNamespace(flush=lambda: None)
+    saved = []
+    n.checkpoint = SimpleNamespace(
+            update=lambda key, value, events, size: saved.append(value))
+    n.checkpoint_key = "replicator"
+    n._events = 0
+    n._bytes = 0
+    n._gtid = None
+    n.current_file_log = "mysql-bin.000001"
+    n.current_log_pos = 4
+    n._report_process()
+    # 快照分片同步时窗口为空，之后发送的消息还没有确认
+    n._sync()
+    n.current_log_pos = 100
+    seq = n.window.add(n._current_position())
+    n.current_log_pos = 200
+    n._report_process()
+    assert [i["log_pos"] for i in saved] == [4, 4]
+    n.window.ack(seq)
+    n._report_process()
+    assert saved[-1]["log_pos"] == 200